@@ -14,18 +14,43 @@
 
 """Manage `apptainer` installation on Juju units."""
 
+import dataclasses
+import functools
+import hashlib
+import json
 import logging
-import shutil
+import os
 import subprocess
+from collections.abc import Callable, Mapping
+from pathlib import Path
 from string import Template
 
 import charms.operator_libs_linux.v0.apt as apt
-import distro
 
-from constants import APPTAINER_PACKAGES, APPTAINER_PPA_KEY, APPTAINER_PPA_URL
+import aptrun
+import archive
+import backends
+import dpkglock
+import runner
+import versions
+from constants import APPTAINER_CONFIG_FILE, APPTAINER_PACKAGES, APPTAINER_STATE_FILE
 
 _logger = logging.getLogger(__name__)
 
+_MANAGED_BEGIN = "# BEGIN juju managed options"
+_MANAGED_END = "# END juju managed options"
+_OVERRIDDEN = "#juju# "
+_INSTALL_ERRORS = (
+    apt.GPGKeyError,
+    apt.PackageNotFoundError,
+    apt.PackageError,
+    subprocess.CalledProcessError,
+    dpkglock.LockTimeoutError,
+    versions.VersionsError,
+    backends.BackendError,
+    OSError,
+)
+
 
 class ApptainerOpsError(Exception):
     """Exception raised when an `apptainer`-related operation on the unit has failed."""
@@ -36,71 +61,157 @@ class ApptainerOpsError(Exception):
         return self.args[0]
 
 
-def install() -> None:
+def _recorded(state: dict) -> backends.Backend:
+    """Get the backend Apptainer was last installed with."""
+    if spec := state.get("backend"):
+        return backends.get(spec["name"], spec["source"], spec["layout"])
+
+    # Units installed before the backend was recorded were installed from the PPA.
+    return backends.PPA(layout="versioned" if versions.active() else "packages")
+
+
+def _report(state_file: Path, backend: backends.Backend) -> None:
+    """Cache the outcome of the last operation of a backend with the observed state."""
+    if not backend.last or not (state := _load_state(state_file)):
+        return
+
+    state["report"] = dataclasses.asdict(backend.last)
+    try:
+        _save_state(state_file, state)
+    except OSError as e:
+        _logger.warning("failed to cache apptainer state. reason: %s", e)
+
+
+def install(
+    progress: aptrun.Progress | None = None, backend: backends.Backend | None = None
+) -> None:
     """Install `apptainer`.
 
-    Raises:
-        ApptainerOpsError: Raised if `apt` fails to install `apptainer` on the unit.
+    Args:
+        progress: Called with the phase and percentage of `apt-get` as it progresses.
+        backend: Backend to install with. Defaults to the upstream Apptainer PPA
+            located at https://ppa.launchpadcontent.net/apptainer/ppa/ubuntu.
 
-    Notes:
-        This function uses the `apptainer` packages hosted within the
-        upstream Apptainer PPA located at https://ppa.launchpadcontent.net/apptainer/ppa/ubuntu.
+    Raises:
+        ApptainerOpsError: Raised if the backend fails to install `apptainer` on the unit.
+        CommandTimeoutError: Raised if `apt-get` did not finish in time.
     """
+    backend = backend or backends.PPA()
     try:
-        _logger.info("adding `apptainer` ppa '%s' to /etc/apt/sources.list.d", APPTAINER_PPA_URL)
-        ppa = apt.DebianRepository(
-            enabled=True,
-            repotype="deb",
-            uri=APPTAINER_PPA_URL,
-            release=distro.codename(),
-            groups=["main"],
-        )
-        ppa.import_key(APPTAINER_PPA_KEY)
-        repositories = apt.RepositoryMapping()
-        repositories.add(ppa)
-        _logger.info(
-            "`apptainer` ppa '%s' successfully added to /etc/apt/sources.list.d", APPTAINER_PPA_URL
-        )
+        for _, _, apply in backend.steps(progress):
+            apply()
+    except _INSTALL_ERRORS as e:
+        raise ApptainerOpsError(f"failed to install apptainer {backend.label}. reason: {e}")
+
+
+def upgrade(
+    progress: aptrun.Progress | None = None, state_file: Path = APPTAINER_STATE_FILE
+) -> None:
+    """Upgrade `apptainer` to the latest version available to the backend it was installed with.
 
-        apt.update()
-        _logger.info("installing packages `%s` using apt", APPTAINER_PACKAGES)
-        apt.add_package(APPTAINER_PACKAGES)
-        _logger.info("packages `%s` successfully installed on unit", APPTAINER_PACKAGES)
-    except (apt.GPGKeyError, apt.PackageNotFoundError, apt.PackageError) as e:
+    Args:
+        progress: Called with the phase and percentage of `apt-get` as it progresses.
+        state_file: File the observed state is cached in.
+
+    Raises:
+        ApptainerOpsError: Raised if the backend fails to upgrade `apptainer` on the unit.
+        CommandTimeoutError: Raised if `apt-get` did not finish in time.
+    """
+    backend = _recorded(_load_state(state_file))
+    try:
+        backend.upgrade(progress)
+    except _INSTALL_ERRORS as e:
+        reason = (getattr(e, "stderr", "") or str(e)).strip()
         raise ApptainerOpsError(
-            f"failed to install apptainer packages `{APPTAINER_PACKAGES}`. reason: {e}"
+            f"failed to upgrade {backend.label} to the latest version. reason: {reason}"
         )
+    finally:
+        _report(state_file, backend)
+
+
+def rollback(version: str | None = None, state_file: Path = APPTAINER_STATE_FILE) -> str:
+    """Roll `apptainer` back to a previously installed version without network access.
+
+    Versioned installs switch back to the previous version. Package installs
+    reinstall the archived packages of a version.
 
+    Args:
+        version: Archived version to reinstall. Defaults to the most recently archived
+            version other than the installed one. Not supported for versioned installs.
+        state_file: File the observed state is cached in.
 
-def upgrade() -> None:
-    """Upgrade `apptainer` to the latest available version.
+    Returns:
+        The version that is now installed.
 
     Raises:
-        ApptainerOpsError: Raised if `apt` fails to upgrade the version of `apptainer` on the unit.
+        ApptainerOpsError: Raised if there is no version to roll back to, or it could
+            not be installed.
+        CommandTimeoutError: Raised if `dpkg` did not finish in time.
     """
-    for name in APPTAINER_PACKAGES:
-        try:
-            package = apt.DebianPackage.from_installed_package(name)
-            package.ensure(apt.PackageState.Latest)
-        except (apt.PackageNotFoundError, apt.PackageError) as e:
-            raise ApptainerOpsError(
-                (
-                    f"failed to upgrade packages `{APPTAINER_PACKAGES}` to the latest version. "
-                    + f"reason: {e}"
+    try:
+        if versions.active():
+            if version:
+                raise ApptainerOpsError(
+                    "versioned installs can only roll back to the previous version"
                 )
-            )
+            return versions.rollback()
+
+        if not version:
+            current = archive.installed_version(APPTAINER_PACKAGES[0])
+            candidates = [v for v in archive.versions() if v != current]
+            if not candidates:
+                raise ApptainerOpsError("no archived apptainer version to roll back to")
+            version = candidates[0]
+
+        archive.restore(version)
+    except (archive.ArchiveError, versions.VersionsError, OSError) as e:
+        raise ApptainerOpsError(f"failed to roll back apptainer. reason: {e}")
+
+    # Record the reinstalled packages as reconciled, so that reconciling the packages
+    # does not upgrade them again.
+    state = _load_state(state_file)
+    if record := state.get("packages"):
+        record["stamps"] = {f: _stamp(Path(f)) for f in record["stamps"]}
+        try:
+            _save_state(state_file, state)
+        except OSError as e:
+            _logger.warning("failed to cache apptainer state. reason: %s", e)
+
+    return version
 
 
-def remove() -> None:
-    """Remove `apptainer`."""
+def remove(state_file: Path = APPTAINER_STATE_FILE) -> None:
+    """Remove `apptainer` with the backend it was installed with.
+
+    Package installs are removed in a single apt transaction.
+
+    Args:
+        state_file: File the observed state is cached in.
+
+    Raises:
+        ApptainerOpsError: Raised if the backend fails to remove `apptainer` from the unit.
+        CommandTimeoutError: Raised if `apt-get` did not finish in time.
+    """
+    backend = _recorded(_load_state(state_file))
     try:
-        _logger.info("removing packages `%s` using apt", APPTAINER_PACKAGES)
-        apt.remove_package(APPTAINER_PACKAGES)
-        _logger.info("packages `%s` successfully removed from unit", APPTAINER_PACKAGES)
-    except apt.PackageNotFoundError as e:
-        raise ApptainerOpsError(
-            f"failed to remove apptainer packages `{APPTAINER_PACKAGES}`. reason: {e}"
-        )
+        backend.remove()
+    except _INSTALL_ERRORS as e:
+        reason = (getattr(e, "stderr", "") or str(e)).strip()
+        raise ApptainerOpsError(f"failed to remove apptainer {backend.label}. reason: {reason}")
+
+
+def cleanup(state_file: Path = APPTAINER_STATE_FILE) -> None:
+    """Remove the charm-managed options from `apptainer.conf` and the cached state.
+
+    Raises:
+        ApptainerOpsError: Raised if `apptainer.conf` could not be restored.
+    """
+    if (file := config_file()).exists():
+        update_config({}, file=file)
+    try:
+        state_file.unlink(missing_ok=True)
+    except OSError as e:
+        raise ApptainerOpsError(f"failed to remove `{state_file}`. reason: {e}")
 
 
 def version() -> str:
@@ -108,22 +219,274 @@ def version() -> str:
 
     Raises:
         ApptainerOpsError: Raised if `apptainer` is not installed on unit.
+        CommandTimeoutError: Raised if `apptainer --version` did not finish in time.
     """
     error_msg = Template("failed to get the version of `apptainer` installed. reason: $reason")
     try:
-        result = subprocess.check_output(["apptainer", "--version"], text=True)
-        return result.split()[-1]
+        result = runner.run([binary(), "--version"])
+        return result.stdout.split()[-1]
     except FileNotFoundError as e:
         raise ApptainerOpsError(error_msg.substitute(reason=str(e).lower()))
     except subprocess.CalledProcessError as e:
         raise ApptainerOpsError(error_msg.substitute(reason=(str(e) + f" {e.stderr}").lower()))
 
 
-def installed() -> bool:
-    """Check if `apptainer` is both installed on the unit and available on `$PATH`."""
+def installed(state_file: Path = APPTAINER_STATE_FILE) -> bool:
+    """Check if `apptainer` is both installed on the unit and available to run."""
+    if reconciled(state_file):
+        return True
+
+    return _recorded(_load_state(state_file)).installed()
+
+
+def report(state_file: Path = APPTAINER_STATE_FILE) -> dict[str, str]:
+    """Get the install backend of `apptainer`, and the outcome of its last operation.
+
+    Args:
+        state_file: File the observed state is cached in.
+
+    Returns:
+        The backend, its source or layout, whether `apptainer` is installed, and the
+        name, outcome, and duration of the last install, upgrade, or reconcile.
+    """
+    state = _load_state(state_file)
+    backend = _recorded(state)
+    results = {"backend": backend.name, "installed": str(installed(state_file)).lower()}
+    if backend.source:
+        results["source"] = backend.source
+    if isinstance(backend, backends.PPA):
+        results["layout"] = backend.layout
+    if last := state.get("report"):
+        results["operation"] = last["operation"]
+        results["succeeded"] = str(last["ok"]).lower()
+        results["seconds"] = f"{last['seconds']:.1f}"
+
+    return results
+
+
+def binary() -> str:
+    """Get the `apptainer` command of the active install, resolving versioned installs."""
+    return str(versions.binary()) if versions.active() else "apptainer"
+
+
+def config_file() -> Path:
+    """Get the `apptainer.conf` of the active install, resolving versioned installs."""
+    return versions.config_file() if versions.active() else APPTAINER_CONFIG_FILE
+
+
+def _render_config(current: list[str], options: Mapping[str, str | list[str]]) -> list[str]:
+    """Render the lines of `apptainer.conf` with a new set of charm-managed options."""
+    lines = []
+    managed = False
+    for line in current:
+        if line == _MANAGED_BEGIN:
+            managed = True
+        elif line == _MANAGED_END:
+            managed = False
+        elif not managed:
+            line = line.removeprefix(_OVERRIDDEN)
+            key, sep, _ = line.partition("=")
+            if sep and not line.lstrip().startswith("#") and key.strip() in options:
+                line = _OVERRIDDEN + line
+            lines.append(line)
+
+    if options:
+        lines.append(_MANAGED_BEGIN)
+        for key, values in options.items():
+            lines.extend(f"{key} = {v}" for v in ([values] if isinstance(values, str) else values))
+        lines.append(_MANAGED_END)
+
+    return lines
+
+
+def site_config(key: str, file: Path | None = None) -> list[str] | None:
+    """Get the values the site sets an option to in `apptainer.conf`.
+
+    Values set in the charm-managed block are left out, while values that the charm
+    overrides are included, so the site's own configuration is returned however
+    often the charm has updated the file.
+
+    Args:
+        key: Name of the option, e.g. `bind path`.
+        file: Path to `apptainer.conf`. Defaults to that of the active install.
+
+    Returns:
+        The values of the option in the order they are set, or `None` if
+        `apptainer.conf` could not be read, e.g. before Apptainer is installed.
+    """
+    try:
+        current = (file or config_file()).read_text().splitlines()
+    except OSError:
+        return None
+
+    values = []
+    managed = False
+    for line in current:
+        if line == _MANAGED_BEGIN:
+            managed = True
+        elif line == _MANAGED_END:
+            managed = False
+        elif not managed:
+            name, sep, value = line.removeprefix(_OVERRIDDEN).partition("=")
+            if sep and not name.lstrip().startswith("#") and name.strip() == key:
+                values.append(value.strip())
+
+    return values
+
+
+def update_config(
+    options: Mapping[str, str | list[str]], file: Path = APPTAINER_CONFIG_FILE
+) -> bool:
+    """Set charm-managed options in `apptainer.conf`.
+
+    Managed options are written to a block at the end of the file. Lines in the rest
+    of the file that set a managed option are commented out with a marker so that
+    they are restored once the charm no longer manages that option.
+
+    Args:
+        options: Mapping of option names to a value, or a list of values for options
+            that can be set multiple times such as `bind path`.
+        file: Path to `apptainer.conf`.
+
+    Returns:
+        True if `apptainer.conf` was changed, otherwise False.
+
+    Raises:
+        ApptainerOpsError: Raised if `apptainer.conf` could not be updated.
+    """
+    try:
+        current = file.read_text().splitlines()
+    except OSError as e:
+        raise ApptainerOpsError(f"failed to read `{file}`. reason: {e}")
+
+    lines = _render_config(current, options)
+    if lines == current:
+        return False
+
+    _logger.info("updating managed options %s in `%s`", list(options), file)
+    try:
+        tmp = file.with_name(f".{file.name}.tmp")
+        tmp.write_text("\n".join(lines) + "\n")
+        tmp.chmod(file.stat().st_mode & 0o777)
+        os.replace(tmp, file)
+    except OSError as e:
+        raise ApptainerOpsError(f"failed to update `{file}`. reason: {e}")
+
+    return True
+
+
+def _apply_config(options: Mapping[str, str | list[str]]) -> list[Path]:
+    """Set the charm-managed options in `apptainer.conf`."""
+    file = config_file()
+    update_config(options, file=file)
+    return [file]
+
+
+def _digest(value: object) -> str:
+    """Get a digest of the inputs of a reconcile step."""
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+def _stamp(file: Path) -> list[int] | None:
+    """Get a stamp of a file that changes whenever the file is replaced or modified."""
     try:
-        apt.DebianPackage.from_installed_package("apptainer")
-    except apt.PackageNotFoundError:
+        stat = file.stat()
+    except FileNotFoundError:
+        return None
+
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+
+def _fresh(record: dict | None, inputs: str | None = None) -> bool:
+    """Check if a reconcile step has been applied and its files have not changed since."""
+    if not record or (inputs is not None and record.get("inputs") != inputs):
         return False
 
-    return True if shutil.which("apptainer") else False
+    return all(_stamp(Path(file)) == stamp for file, stamp in record["stamps"].items())
+
+
+def _load_state(file: Path) -> dict:
+    """Load the cached state observed after the last reconcile."""
+    try:
+        state = json.loads(file.read_text())
+    except (OSError, ValueError):
+        return {}
+
+    return state if isinstance(state, dict) else {}
+
+
+def _save_state(file: Path, state: dict) -> None:
+    """Atomically save the observed state."""
+    file.parent.mkdir(parents=True, exist_ok=True)
+    tmp = file.with_name(f".{file.name}.tmp")
+    tmp.write_text(json.dumps(state))
+    os.replace(tmp, file)
+
+
+def reconcile(
+    options: Mapping[str, str | list[str]] | None = None,
+    state_file: Path = APPTAINER_STATE_FILE,
+    progress: aptrun.Progress | None = None,
+    backend: backends.Backend | None = None,
+) -> list[str]:
+    """Bring the Apptainer installation on the unit in line with its desired state.
+
+    The desired state is Apptainer installed by a backend, such as the PPA and its
+    signing key and the Apptainer packages, and the charm-managed options in
+    `apptainer.conf`. Each step is skipped if its inputs
+    are unchanged since it was last applied and the files it wrote have the same
+    stamp, so a reconcile with nothing to do costs a few `stat()` calls.
+
+    Args:
+        options: Charm-managed options for `apptainer.conf`. Left unmanaged if `None`.
+        state_file: File the observed state is cached in.
+        progress: Called with the phase and percentage of `apt-get` as it progresses.
+        backend: Backend to install Apptainer with. Defaults to the PPA.
+
+    Returns:
+        Names of the reconcile steps that were applied.
+
+    Raises:
+        ApptainerOpsError: Raised if a reconcile step failed.
+        CommandTimeoutError: Raised if `apt-get` did not finish in time.
+    """
+    backend = backend or backends.PPA()
+    steps: list[tuple[str, str, Callable[[], list[Path]]]] = [
+        (name, _digest(inputs), apply) for name, inputs, apply in backend.steps(progress)
+    ]
+    if options is not None:
+        steps.append(("config", _digest(options), functools.partial(_apply_config, options)))
+
+    state = _load_state(state_file)
+    applied = []
+    try:
+        for name, inputs, apply in steps:
+            if _fresh(state.get(name), inputs):
+                continue
+
+            _logger.info("reconciling apptainer %s", name)
+            try:
+                files = apply()
+            except _INSTALL_ERRORS as e:
+                raise ApptainerOpsError(f"failed to reconcile apptainer {name}. reason: {e}")
+
+            state[name] = {"inputs": inputs, "stamps": {str(f): _stamp(f) for f in files}}
+            if name == "packages":
+                state["backend"] = backend.spec()
+            applied.append(name)
+    finally:
+        if backend.last:
+            state["report"] = dataclasses.asdict(backend.last)
+        if applied or backend.last:
+            try:
+                _save_state(state_file, state)
+            except OSError as e:
+                _logger.warning("failed to cache apptainer state. reason: %s", e)
+
+    return applied
+
+
+def reconciled(state_file: Path = APPTAINER_STATE_FILE) -> bool:
+    """Check, without forking, if Apptainer is unchanged since it was last reconciled."""
+    state = _load_state(state_file)
+    return all(_fresh(state.get(name)) for name in _recorded(state).step_names)
@@ -0,0 +1,127 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run `apt-get` with its output streamed, and report its progress while it runs.
+
+`apt.update()` and `apt.DebianPackage` buffer the whole `apt-get` output in memory
+and only log it on failure. `apt-get` is instead run with `APT::Status-Fd`, which
+interleaves machine-readable progress lines with its output. Progress is reported
+as it arrives, and only the last lines of output are kept for error reports.
+"""
+
+import logging
+import os
+import subprocess
+import time
+from collections import deque
+from collections.abc import Callable
+
+import runner
+
+_logger = logging.getLogger(__name__)
+
+# Phases reported by the `dlstatus` and `pmstatus` status lines of `apt-get`.
+DOWNLOAD = "downloading"
+INSTALL = "installing"
+_PHASES = {"dlstatus": DOWNLOAD, "pmstatus": INSTALL}
+
+TAIL_LINES = 50
+PROGRESS_INTERVAL = 5.0
+
+Progress = Callable[[str, float], None]
+
+
+class AptError(subprocess.CalledProcessError):
+    """Exception raised when `apt-get` fails.
+
+    `stderr` holds the last lines of the `apt-get` output.
+    """
+
+    def __str__(self) -> str:
+        """Describe the failure by the errors `apt-get` reported, or its last line of output."""
+        lines = (self.stderr or "").splitlines()
+        errors = [line for line in lines if line.startswith(("E:", "dpkg: error"))]
+        reason = "; ".join(errors) or (lines[-1] if lines else "no output")
+        command = next((arg for arg in self.cmd[1:] if not arg.startswith("-")), "")
+        return f"`apt-get {command}` failed with exit status {self.returncode}: {reason}"
+
+
+def _status(line: str) -> tuple[str, float] | None:
+    """Parse the phase and percentage of an `APT::Status-Fd` progress line."""
+    kind, _, rest = line.partition(":")
+    if (phase := _PHASES.get(kind)) is None:
+        return None
+
+    # `<kind>:<package or item>:<percent>:<description>`
+    fields = rest.split(":", 2)
+    try:
+        return phase, float(fields[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def run(
+    args: list[str],
+    progress: Progress | None = None,
+    tail: int = TAIL_LINES,
+    interval: float = PROGRESS_INTERVAL,
+    apt_get: str = "apt-get",
+) -> None:
+    """Run `apt-get`, streaming its output and reporting its progress.
+
+    Args:
+        args: Arguments to pass to `apt-get`, e.g. `["install", "--yes", "apptainer"]`.
+        progress: Called with the current phase and percentage as `apt-get` progresses.
+            Calls are throttled to one per `interval` seconds unless the phase changes.
+        tail: Number of output lines to keep for the error report if `apt-get` fails.
+        interval: Minimum time in seconds between progress reports within a phase.
+        apt_get: Path to the `apt-get` binary.
+
+    Raises:
+        AptError: Raised if `apt-get` fails. `stderr` holds the last `tail` lines of output.
+        CommandTimeoutError: Raised if `apt-get` did not finish in time.
+        OSError: Raised if `apt-get` could not be started.
+    """
+    cmd = [apt_get, "--option=APT::Status-Fd=1", *args]
+    lines: deque[str] = deque(maxlen=tail)
+    reported: tuple[str, int] | None = None
+    last = float("-inf")
+    with runner.popen(
+        cmd,
+        runner.PACKAGE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        errors="replace",
+        env={**os.environ, "DEBIAN_FRONTEND": "noninteractive"},
+    ) as proc:
+        assert proc.stdout is not None
+        for line in proc.stdout:
+            line = line.rstrip("\n")
+            if (status := _status(line)) is None:
+                lines.append(line)
+                continue
+
+            phase, percent = status
+            now = time.monotonic()
+            current = (phase, int(percent))
+            if progress and current != reported:
+                if reported is None or phase != reported[0] or now - last >= interval:
+                    progress(phase, percent)
+                    reported, last = current, now
+
+    if proc.returncode != 0:
+        output = "\n".join(lines)
+        _logger.debug("`%s` failed with output:\n%s", " ".join(cmd), output)
+        raise AptError(proc.returncode, cmd, output=output, stderr=output)
@@ -0,0 +1,204 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Keep the installed Apptainer packages so that upgrades can be rolled back offline.
+
+Before an upgrade, the `.deb` files of the installed packages are copied from the
+apt cache, or rebuilt with `dpkg-repack` if apt has cleaned its cache, into a
+bounded archive with one directory per version:
+
+    /var/lib/apptainer-operator/archive/1.3.6/apptainer_1.3.6-1_amd64.deb
+
+Restoring a version reinstalls its packages with `dpkg -i`, without refreshing
+the package index or downloading anything, so it works even after the PPA has
+stopped publishing the old version. The reinstalled packages are held with
+`apt-mark`, so that nothing but the next upgrade by the charm upgrades them again.
+"""
+
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+
+import dpkglock
+import runner
+
+_logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = Path("/var/lib/apptainer-operator/archive")
+APT_CACHE_DIR = Path("/var/cache/apt/archives")
+# Number of versions kept in the archive.
+KEEP = 3
+
+
+class ArchiveError(Exception):
+    """Exception raised when packages could not be archived or restored."""
+
+    @property
+    def message(self) -> str:
+        """Return message passed as argument to exception."""
+        return self.args[0]
+
+
+def installed_version(package: str) -> str | None:
+    """Get the installed version of a package, or `None` if it is not installed."""
+    result = runner.run(
+        ["dpkg-query", "--show", "--showformat=${db:Status-Status} ${Version}", package],
+        check=False,
+    )
+    status, _, version = result.stdout.partition(" ")
+    return version if result.returncode == 0 and status == "installed" else None
+
+
+def _cached(package: str, version: str, cache_dir: Path) -> Path | None:
+    """Find the `.deb` of a package version in the apt cache."""
+    # apt escapes the `:` of an epoch in the names of the files it caches.
+    pattern = f"{package}_{version.replace(':', '%3a')}_*.deb"
+    return next(iter(sorted(cache_dir.glob(pattern))), None)
+
+
+def _apt_mark(action: str, packages: list[str]) -> None:
+    """Hold or unhold packages with `apt-mark`."""
+    dpkglock.retry(runner.run, ["apt-mark", action, *packages], runner.PACKAGE)
+
+
+def _repack(package: str, dest: Path) -> Path:
+    """Rebuild the `.deb` of an installed package from the files dpkg installed."""
+    if not shutil.which("dpkg-repack"):
+        # `dpkg-repack` is only needed once apt has cleaned its cache, so it is installed
+        # when it is first needed.
+        _logger.info("installing `dpkg-repack` to repack %s", package)
+        dpkglock.retry(
+            runner.run,
+            ["apt-get", "install", "--yes", "--no-upgrade", "--quiet", "dpkg-repack"],
+            runner.PACKAGE,
+            env={**os.environ, "DEBIAN_FRONTEND": "noninteractive"},
+        )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        runner.run(["dpkg-repack", package], runner.SYSTEM, cwd=Path(tmp))
+        deb = next(Path(tmp).glob(f"{package}_*.deb"))
+        return Path(shutil.move(deb, dest / deb.name))
+
+
+def versions(archive_dir: Path = ARCHIVE_DIR) -> list[str]:
+    """Get the archived versions, most recently archived first."""
+    try:
+        entries = [e for e in os.scandir(archive_dir) if e.is_dir() and not e.name.startswith(".")]
+    except FileNotFoundError:
+        return []
+
+    return [e.name for e in sorted(entries, key=lambda e: e.stat().st_mtime_ns, reverse=True)]
+
+
+def save(
+    packages: list[str],
+    archive_dir: Path = ARCHIVE_DIR,
+    cache_dir: Path = APT_CACHE_DIR,
+    keep: int = KEEP,
+) -> str | None:
+    """Archive the installed versions of packages, and drop the oldest archived versions.
+
+    Args:
+        packages: Packages to archive. The archive is named after the version of the
+            first package.
+        archive_dir: Directory of the archive.
+        cache_dir: apt cache to copy the packages from.
+        keep: Number of versions to keep in the archive.
+
+    Returns:
+        The archived version, or `None` if the packages are not installed.
+
+    Raises:
+        ArchiveError: Raised if the packages could not be archived.
+        CommandTimeoutError: Raised if `dpkg-query`, `dpkg-repack`, or `apt-get` did not
+            finish in time.
+    """
+    installed = {p: v for p in packages if (v := installed_version(p))}
+    if packages[0] not in installed:
+        return None
+
+    version = installed[packages[0]]
+    target = archive_dir / version
+    tmp = archive_dir / f".{version}.tmp"
+    try:
+        if not target.is_dir():
+            shutil.rmtree(tmp, ignore_errors=True)
+            tmp.mkdir(parents=True)
+            for package, package_version in installed.items():
+                if deb := _cached(package, package_version, cache_dir):
+                    shutil.copy2(deb, tmp / deb.name)
+                else:
+                    _logger.info("%s %s is not in the apt cache. repacking it", package, version)
+                    _repack(package, tmp)
+            os.rename(tmp, target)
+            _logger.info("archived apptainer %s packages in %s", version, target)
+        # Mark the version as the most recently archived one.
+        os.utime(target)
+    except (
+        OSError,
+        StopIteration,
+        subprocess.CalledProcessError,
+        dpkglock.LockTimeoutError,
+    ) as e:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise ArchiveError(f"failed to archive apptainer {version}. reason: {e}")
+
+    for old in versions(archive_dir)[keep:]:
+        _logger.info("removing apptainer %s from the archive", old)
+        shutil.rmtree(archive_dir / old, ignore_errors=True)
+
+    return version
+
+
+def restore(version: str, archive_dir: Path = ARCHIVE_DIR) -> None:
+    """Reinstall an archived version with `dpkg -i`, without network access, and hold it.
+
+    Raises:
+        ArchiveError: Raised if the version is not archived, or `dpkg` failed to install it.
+        CommandTimeoutError: Raised if `dpkg` or `apt-mark` did not finish in time.
+    """
+    debs = sorted((archive_dir / version).glob("*.deb"))
+    if not debs:
+        raise ArchiveError(f"apptainer {version} is not in the archive {archive_dir}")
+
+    _logger.info("reinstalling archived apptainer %s", version)
+    try:
+        dpkglock.retry(
+            runner.run,
+            ["dpkg", "--install", "--force-confold", *map(str, debs)],
+            runner.PACKAGE,
+            env={**os.environ, "DEBIAN_FRONTEND": "noninteractive"},
+        )
+        # Package files are named `<package>_<version>_<architecture>.deb`.
+        _apt_mark("hold", [deb.name.split("_")[0] for deb in debs])
+    except (OSError, subprocess.CalledProcessError, dpkglock.LockTimeoutError) as e:
+        reason = (getattr(e, "stderr", "") or str(e)).strip()
+        raise ArchiveError(f"failed to reinstall apptainer {version}. reason: {reason}")
+
+
+def unhold(packages: list[str]) -> None:
+    """Release the hold that `restore(...)` put on packages, so that they can be upgraded.
+
+    Raises:
+        ArchiveError: Raised if `apt-mark` failed to unhold the packages.
+        CommandTimeoutError: Raised if `apt-mark` did not finish in time.
+    """
+    try:
+        _apt_mark("unhold", packages)
+    except (OSError, subprocess.CalledProcessError, dpkglock.LockTimeoutError) as e:
+        reason = (getattr(e, "stderr", "") or str(e)).strip()
+        raise ArchiveError(f"failed to unhold packages `{packages}`. reason: {reason}")
@@ -0,0 +1,464 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Install Apptainer from the upstream PPA, local packages, or a relocatable tarball.
+
+Every backend installs, upgrades, and removes Apptainer in its own way:
+
+* `ppa` installs the packages from the upstream Apptainer PPA, either system-wide,
+  or side by side under `/opt/apptainer` with the `versioned` layout.
+* `local-debs` installs the packages found in a local directory, resolving their
+  dependencies from the apt sources of the unit.
+* `tarball` extracts a relocatable Apptainer tree side by side under `/opt/apptainer`.
+  It never runs `apt-get` or `dpkg`, so it does not wait on the dpkg lock and can run
+  while the principal charm installs its own packages.
+
+Backends time each operation they run, and keep the outcome of the last one in
+`Backend.last`.
+"""
+
+import abc
+import functools
+import logging
+import os
+import shutil
+import tempfile
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+import charms.operator_libs_linux.v0.apt as apt
+import distro
+
+import aptrun
+import archive
+import dpkglock
+import openpgp
+import runner
+import sources
+import versions
+from constants import (
+    APPTAINER_PACKAGES,
+    APPTAINER_PPA_KEY,
+    APPTAINER_PPA_URL,
+    APPTAINER_VERSIONED_PACKAGES,
+)
+
+_logger = logging.getLogger(__name__)
+
+DPKG_INFO_DIR = Path("/var/lib/dpkg/info")
+
+# A reconcile step: its name, the inputs it is applied for, and a function that
+# applies it and returns the files it wrote.
+Step = tuple[str, object, Callable[[], list[Path]]]
+
+
+class BackendError(Exception):
+    """Exception raised when an install backend is misconfigured."""
+
+    @property
+    def message(self) -> str:
+        """Return message passed as argument to exception."""
+        return self.args[0]
+
+
+@dataclass(frozen=True)
+class Report:
+    """Outcome of the last operation run by an install backend.
+
+    Attributes:
+        backend: Name of the backend.
+        operation: Name of the operation, e.g. `install`.
+        ok: True if the operation succeeded.
+        seconds: Wall-clock time the operation took.
+    """
+
+    backend: str
+    operation: str
+    ok: bool
+    seconds: float
+
+
+class Backend(abc.ABC):
+    """Base class of the Apptainer install backends.
+
+    Args:
+        source: Where the backend installs Apptainer from, if it is not the PPA.
+        layout: Install layout of the `ppa` backend, either `packages` or `versioned`.
+    """
+
+    name = ""
+    # Names of the reconcile steps returned by `steps(...)`.
+    step_names: tuple[str, ...] = ("packages",)
+
+    def __init__(self, source: str = "", layout: str = "packages") -> None:
+        self.source = source
+        self.layout = layout
+        self.last: Report | None = None
+
+    @property
+    def label(self) -> str:
+        """Describe what the backend installs, for error messages."""
+        return f"packages `{APPTAINER_PACKAGES}`"
+
+    def spec(self) -> dict[str, str]:
+        """Get the arguments `get(...)` recreates the backend from."""
+        return {"name": self.name, "source": self.source, "layout": self.layout}
+
+    @contextmanager
+    def _timed(self, operation: str) -> Iterator[None]:
+        """Time an operation, and record its outcome in `last`."""
+        start = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.last = Report(self.name, operation, ok, round(time.monotonic() - start, 3))
+            _logger.info(
+                "%s backend %s %s after %.1fs",
+                self.name,
+                operation,
+                "succeeded" if ok else "failed",
+                self.last.seconds,
+            )
+
+    @abc.abstractmethod
+    def inputs(self) -> object:
+        """Get the inputs of the install, which is repeated whenever they change."""
+
+    def steps(self, progress: aptrun.Progress | None = None) -> list[Step]:
+        """Get the reconcile steps that install Apptainer."""
+        return [("packages", self.inputs(), functools.partial(self.install, progress))]
+
+    def install(self, progress: aptrun.Progress | None = None) -> list[Path]:
+        """Install Apptainer, and return the files to detect changes to the install by."""
+        with self._timed("install"):
+            return self._install(progress)
+
+    def upgrade(self, progress: aptrun.Progress | None = None) -> None:
+        """Upgrade Apptainer to the latest version available to the backend."""
+        with self._timed("upgrade"):
+            self._upgrade(progress)
+
+    def remove(self) -> None:
+        """Remove Apptainer."""
+        with self._timed("remove"):
+            self._remove()
+
+    @abc.abstractmethod
+    def installed(self) -> bool:
+        """Check if Apptainer is installed by the backend."""
+
+    @abc.abstractmethod
+    def _install(self, progress: aptrun.Progress | None) -> list[Path]:
+        """Install Apptainer, see `install(...)`."""
+
+    @abc.abstractmethod
+    def _upgrade(self, progress: aptrun.Progress | None) -> None:
+        """Upgrade Apptainer, see `upgrade(...)`."""
+
+    @abc.abstractmethod
+    def _remove(self) -> None:
+        """Remove Apptainer, see `remove(...)`."""
+
+
+def _ppa() -> apt.DebianRepository:
+    """Get the upstream Apptainer PPA for the release of the unit."""
+    return apt.DebianRepository(
+        enabled=True,
+        repotype="deb",
+        uri=APPTAINER_PPA_URL,
+        release=distro.codename(),
+        groups=["main"],
+    )
+
+
+def _add_ppa(ppa: apt.DebianRepository) -> list[Path]:
+    """Add the Apptainer PPA and its signing key to apt."""
+    _logger.info("adding `apptainer` ppa '%s' to /etc/apt/sources.list.d", APPTAINER_PPA_URL)
+    key = openpgp.import_key(APPTAINER_PPA_KEY)
+    sources.add(ppa)
+    _logger.info(
+        "`apptainer` ppa '%s' successfully added to /etc/apt/sources.list.d", APPTAINER_PPA_URL
+    )
+    return [key, sources.filename(ppa)]
+
+
+def _dpkg_list(package: str) -> Path:
+    """Get the file dpkg lists the contents of an installed package in."""
+    if not (file := DPKG_INFO_DIR / f"{package}.list").exists():
+        # Packages that are `Multi-Arch: same` are listed under an architecture-qualified name.
+        file = next(iter(sorted(DPKG_INFO_DIR.glob(f"{package}:*.list"))), file)
+
+    return file
+
+
+def _archive() -> None:
+    """Archive the installed packages so that the upgrade can be rolled back offline."""
+    try:
+        archive.save(APPTAINER_PACKAGES)
+    except archive.ArchiveError as e:
+        # Upgrades must not be blocked on the archive, but rollbacks will be unavailable.
+        _logger.warning(e.message)
+
+
+def _unhold() -> None:
+    """Release the hold a rollback put on the installed packages before they are upgraded."""
+    try:
+        archive.unhold(APPTAINER_PACKAGES)
+    except archive.ArchiveError as e:
+        # apt reports the held packages if the upgrade fails because of them.
+        _logger.warning(e.message)
+
+
+class _Debs(Backend):
+    """Base class of the backends that install Apptainer packages system-wide."""
+
+    def _remove(self) -> None:
+        _logger.info("removing packages `%s` using apt", APPTAINER_PACKAGES)
+        dpkglock.retry(
+            runner.run,
+            [
+                "apt-get",
+                "remove",
+                "--yes",
+                "--quiet",
+                # Packages reinstalled by a rollback are held.
+                "--allow-change-held-packages",
+                *APPTAINER_PACKAGES,
+            ],
+            runner.PACKAGE,
+            env={**os.environ, "DEBIAN_FRONTEND": "noninteractive"},
+        )
+        _logger.info("packages `%s` successfully removed from unit", APPTAINER_PACKAGES)
+
+    def installed(self) -> bool:
+        """Check if the `apptainer` package is installed and on `$PATH`."""
+        try:
+            result = runner.run(
+                ["dpkg-query", "--show", "--showformat=${db:Status-Status}", "apptainer"],
+                check=False,
+            )
+        except (OSError, runner.CommandTimeoutError) as e:
+            _logger.warning("failed to query the `apptainer` package. reason: %s", e)
+            return False
+
+        if result.returncode != 0 or result.stdout != "installed":
+            return False
+
+        return True if shutil.which("apptainer") else False
+
+
+class PPA(_Debs):
+    """Install the Apptainer packages from the upstream Apptainer PPA."""
+
+    name = "ppa"
+    step_names = ("ppa", "packages")
+
+    def inputs(self) -> object:
+        """Get the PPA, the packages, and the layout they are installed with."""
+        return [sources.line(_ppa()), APPTAINER_PACKAGES, self.layout]
+
+    def steps(self, progress: aptrun.Progress | None = None) -> list[Step]:
+        """Get the reconcile steps that add the PPA, then install Apptainer from it."""
+        ppa = _ppa()
+        return [
+            ("ppa", [sources.line(ppa), APPTAINER_PPA_KEY], functools.partial(_add_ppa, ppa)),
+            *super().steps(progress),
+        ]
+
+    def _install(self, progress: aptrun.Progress | None) -> list[Path]:
+        if self.layout == "versioned":
+            return self._install_versioned(progress)
+
+        dpkglock.retry(aptrun.run, ["update"], progress)
+        _logger.info("installing packages `%s` using apt", APPTAINER_PACKAGES)
+        dpkglock.retry(
+            aptrun.run,
+            [
+                "install",
+                "--yes",
+                # Installed packages are only upgraded by `upgrade()`, once the node is drained.
+                "--no-upgrade",
+                "--option=Dpkg::Options::=--force-confold",
+                *APPTAINER_PACKAGES,
+            ],
+            progress,
+        )
+        _logger.info("packages `%s` successfully installed on unit", APPTAINER_PACKAGES)
+        versions.deactivate()
+        return [_dpkg_list(package) for package in APPTAINER_PACKAGES]
+
+    def _install_versioned(self, progress: aptrun.Progress | None) -> list[Path]:
+        """Install the latest Apptainer side by side with the installed versions."""
+        dpkglock.retry(aptrun.run, ["update"], progress)
+        with tempfile.TemporaryDirectory() as tmp:
+            debs = versions.download(APPTAINER_VERSIONED_PACKAGES, Path(tmp))
+            # Only Apptainer itself is versioned. Its dependencies are installed system-wide.
+            if depends := versions.field(debs[0], "Depends"):
+                dpkglock.retry(aptrun.run, ["satisfy", "--yes", depends], progress)
+            version = versions.unpack(debs)
+
+        versions.activate(version)
+        versions.gc()
+        return [versions.ROOT / version / "usr" / "bin" / "apptainer"]
+
+    def _upgrade(self, progress: aptrun.Progress | None) -> None:
+        if self.layout == "versioned":
+            self._install_versioned(progress)
+            return
+
+        _archive()
+        _unhold()
+        dpkglock.retry(
+            aptrun.run,
+            [
+                "install",
+                "--yes",
+                "--only-upgrade",
+                "--option=Dpkg::Options::=--force-confold",
+                *APPTAINER_PACKAGES,
+            ],
+            progress,
+        )
+
+    def installed(self) -> bool:
+        """Check if Apptainer is installed with the layout of the backend."""
+        if self.layout == "versioned":
+            return versions.active() is not None and versions.binary().exists()
+
+        return super().installed()
+
+
+class LocalDebs(_Debs):
+    """Install the Apptainer packages found in a local directory."""
+
+    name = "local-debs"
+
+    def _debs(self) -> list[Path]:
+        """Get the packages in the source directory."""
+        if not self.source:
+            raise BackendError("the `local-debs` backend requires a source directory")
+        if not (debs := sorted(Path(self.source).glob("*.deb"))):
+            raise BackendError(f"no packages found in `{self.source}`")
+
+        return debs
+
+    def inputs(self) -> object:
+        """Get the name, size, and modification time of each local package."""
+        try:
+            return [[deb.name, *_stamp(deb)] for deb in self._debs()]
+        except (BackendError, OSError):
+            return []
+
+    def _apt_install(self, progress: aptrun.Progress | None, upgrade: bool = False) -> list[Path]:
+        """Install the local packages, and the dependencies they are missing.
+
+        Installed packages are left at their version unless `upgrade` is set.
+        """
+        debs = self._debs()
+        _logger.info("installing packages %s using apt", [deb.name for deb in debs])
+        # `apt-get` only treats arguments that contain a `/` as package files.
+        dpkglock.retry(
+            aptrun.run,
+            [
+                "install",
+                "--yes",
+                *([] if upgrade else ["--no-upgrade"]),
+                "--option=Dpkg::Options::=--force-confold",
+                *(str(deb.absolute()) for deb in debs),
+            ],
+            progress,
+        )
+        versions.deactivate()
+        # Package files are named `<package>_<version>_<architecture>.deb`.
+        return [_dpkg_list(deb.name.split("_")[0]) for deb in debs]
+
+    def _install(self, progress: aptrun.Progress | None) -> list[Path]:
+        return self._apt_install(progress)
+
+    def _upgrade(self, progress: aptrun.Progress | None) -> None:
+        _archive()
+        _unhold()
+        self._apt_install(progress, upgrade=True)
+
+
+class Tarball(Backend):
+    """Install Apptainer from a relocatable tarball, without `apt-get` or `dpkg`."""
+
+    name = "tarball"
+
+    @property
+    def label(self) -> str:
+        """Describe the tarball the backend installs, for error messages."""
+        return f"tarball `{self.source}`"
+
+    def inputs(self) -> object:
+        """Get the path, size, and modification time of the tarball."""
+        try:
+            return [self.source, *_stamp(Path(self.source))]
+        except OSError:
+            return [self.source]
+
+    def _install(self, progress: aptrun.Progress | None) -> list[Path]:
+        if not self.source:
+            raise BackendError("the `tarball` backend requires a source tarball")
+
+        version = versions.extract(Path(self.source))
+        versions.activate(version)
+        versions.gc()
+        return [versions.ROOT / version / "usr" / "bin" / "apptainer"]
+
+    def _upgrade(self, progress: aptrun.Progress | None) -> None:
+        self._install(progress)
+
+    def _remove(self) -> None:
+        versions.deactivate()
+        versions.gc()
+
+    def installed(self) -> bool:
+        """Check if an extracted version is active."""
+        return versions.active() is not None and versions.binary().exists()
+
+
+BACKENDS: dict[str, type[Backend]] = {
+    backend.name: backend for backend in (PPA, LocalDebs, Tarball)
+}
+
+
+def _stamp(file: Path) -> list[int]:
+    """Get the size and modification time of a file."""
+    stat = file.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def get(name: str = PPA.name, source: str = "", layout: str = "packages") -> Backend:
+    """Get an install backend by name.
+
+    Args:
+        name: Name of the backend, one of `BACKENDS`.
+        source: Package directory of the `local-debs` backend, or tarball of the
+            `tarball` backend.
+        layout: Install layout of the `ppa` backend.
+
+    Raises:
+        BackendError: Raised if there is no backend with the name.
+    """
+    if name not in BACKENDS:
+        raise BackendError(f"unknown install backend `{name}`. expected one of {list(BACKENDS)}")
+
+    return BACKENDS[name](source, layout)
@@ -0,0 +1,251 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure `apptainer exec` container launch latency on Juju units."""
+
+import logging
+import math
+import re
+import shlex
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+import apptainer
+import runner
+
+_logger = logging.getLogger(__name__)
+_ldd_path = re.compile(r"(/\S+)")
+_loop_device = re.compile(r"loop device", re.IGNORECASE)
+
+
+class BenchmarkError(Exception):
+    """Exception raised when a container launch benchmark could not be run."""
+
+    @property
+    def message(self) -> str:
+        """Return message passed as argument to exception."""
+        return self.args[0]
+
+
+@dataclass(frozen=True)
+class LaunchSample:
+    """Timing of a single container launch.
+
+    Attributes:
+        latency: Time in seconds from process start to process exit.
+        loop_wait: Time in seconds spent between the first and last loop device message,
+            or 0 if the launch was not run with `--debug`.
+        returncode: Exit code of the launch command.
+    """
+
+    latency: float
+    loop_wait: float
+    returncode: int
+
+
+@dataclass(frozen=True)
+class LatencyReport:
+    """Summary of a series of container launches."""
+
+    launches: int
+    failures: int
+    p50: float
+    p95: float
+    p99: float
+    loop_wait: float
+
+    @classmethod
+    def from_samples(
+        cls, samples: list[LaunchSample], debug: list[LaunchSample] | None = None
+    ) -> "LatencyReport":
+        """Summarise a list of launch samples.
+
+        Args:
+            samples: Launches to take latencies and failures from.
+            debug: Launches run with `--debug` to take the loop device wait from. The
+                wait is taken from `samples` if unset.
+        """
+        latencies = sorted(s.latency for s in samples)
+        debug = samples if debug is None else debug
+        return cls(
+            launches=len(samples),
+            failures=sum(1 for s in samples if s.returncode != 0),
+            p50=percentile(latencies, 50),
+            p95=percentile(latencies, 95),
+            p99=percentile(latencies, 99),
+            loop_wait=sum(s.loop_wait for s in debug) / len(debug) if debug else 0.0,
+        )
+
+    def dict(self) -> dict[str, str]:
+        """Return report as action results, with times formatted in milliseconds."""
+        return {
+            "launches": str(self.launches),
+            "failures": str(self.failures),
+            "p50-ms": f"{self.p50 * 1000:.1f}",
+            "p95-ms": f"{self.p95 * 1000:.1f}",
+            "p99-ms": f"{self.p99 * 1000:.1f}",
+            "loop-wait-ms": f"{self.loop_wait * 1000:.1f}",
+        }
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Get the nearest-rank percentile of a sorted list of values."""
+    if not values:
+        return 0.0
+
+    rank = max(math.ceil(pct / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def command(run_time_run: str, image: str | Path, args: list[str]) -> list[str]:
+    """Expand an `oci.conf` `RunTimeRun` command for a local image.
+
+    Args:
+        run_time_run: `RunTimeRun` command from the published `oci.conf` configuration.
+        image: Path to the image to substitute for the `%r` pattern.
+        args: Arguments to substitute for the `%@` pattern.
+    """
+    cmd = []
+    for token in shlex.split(run_time_run):
+        if token == "%@":
+            cmd.extend(args)
+        else:
+            cmd.append(token.replace("%r", str(image)))
+
+    return cmd
+
+
+def build_image(workdir: Path) -> Path:
+    """Build a tiny SIF image containing only `true` and its shared libraries.
+
+    The image is built from a local root filesystem, so no network access is required.
+
+    Args:
+        workdir: Directory to build the root filesystem and image in.
+
+    Raises:
+        BenchmarkError: Raised if the image could not be built.
+    """
+    true = shutil.which("true")
+    if true is None:
+        raise BenchmarkError("failed to build benchmark image. reason: `true` not found")
+
+    rootfs = workdir / "rootfs"
+    image = workdir / "benchmark.sif"
+    try:
+        # `ldd` exits non-zero for static executables, which have no libraries to copy.
+        ldd = runner.run(["ldd", true], check=False).stdout
+        for path in [true, *_ldd_path.findall(ldd)]:
+            target = rootfs / path.lstrip("/")
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy(Path(path).resolve(), target)
+
+        _logger.info("building benchmark image %s from %s", image, rootfs)
+        runner.run(
+            [apptainer.binary(), "build", "--force", str(image), str(rootfs)], runner.CONTAINER
+        )
+    except runner.CommandTimeoutError as e:
+        raise BenchmarkError(f"failed to build benchmark image. reason: {e.message}")
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise BenchmarkError(f"failed to build benchmark image. reason: {e}")
+
+    return image
+
+
+def launch(cmd: list[str], timeout: float = 60, debug: bool = False) -> LaunchSample:
+    """Launch a container and time it from process start to process exit.
+
+    Args:
+        cmd: Launch command to time.
+        timeout: Maximum time in seconds to wait for the launch to complete.
+        debug: Pass `--debug` to `apptainer` so that loop device messages can be
+            timestamped as they are written to stderr. Debug logging slows down the
+            launch, so the latency of debug launches is not representative.
+    """
+    cmd = list(cmd)
+    for i, token in enumerate(cmd):
+        if debug and Path(token).name == "apptainer":
+            cmd.insert(i + 1, "--debug")
+            break
+
+    loop_start = loop_end = 0.0
+    start = time.perf_counter()
+    try:
+        with subprocess.Popen(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE if debug else subprocess.DEVNULL,
+            text=True,
+        ) as process:
+            watchdog = threading.Timer(timeout, process.kill)
+            watchdog.start()
+            try:
+                for line in process.stderr or []:
+                    if _loop_device.search(line):
+                        loop_end = time.perf_counter()
+                        loop_start = loop_start or loop_end
+
+                returncode = process.wait()
+            finally:
+                watchdog.cancel()
+    except OSError as e:
+        _logger.error("container launch `%s` failed. reason: %s", shlex.join(cmd), e)
+        returncode = -1
+
+    return LaunchSample(
+        latency=time.perf_counter() - start,
+        loop_wait=loop_end - loop_start,
+        returncode=returncode,
+    )
+
+
+def _series(cmd: list[str], iterations: int, concurrency: int, debug: bool) -> list[LaunchSample]:
+    """Launch a series of containers, `concurrency` at a time."""
+    if concurrency <= 1:
+        return [launch(cmd, debug=debug) for _ in range(iterations)]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(lambda _: launch(cmd, debug=debug), range(iterations)))
+
+
+def run(
+    run_time_run: str, image: str | Path, iterations: int, concurrency: int
+) -> dict[str, LatencyReport]:
+    """Benchmark container launches both serially and concurrently.
+
+    Latencies are measured with the launch command as jobs run it. The loop device
+    wait is measured by a separate series of launches with `--debug`, since debug
+    logging adds to the latency.
+
+    Args:
+        run_time_run: `RunTimeRun` command from the published `oci.conf` configuration.
+        image: Path to the image to launch.
+        iterations: Number of launches to run in each series.
+        concurrency: Number of launches to run at the same time in the concurrent series.
+    """
+    cmd = command(run_time_run, image, ["true"])
+    _logger.info("benchmarking container launch command `%s`", shlex.join(cmd))
+
+    return {
+        series: LatencyReport.from_samples(
+            _series(cmd, iterations, workers, debug=False),
+            _series(cmd, iterations, workers, debug=True),
+        )
+        for series, workers in (("serial", 1), ("concurrent", concurrency))
+    }
@@ -15,21 +15,60 @@
 
 """Charmed operator for Apptainer, a container runtime for HPC clusters."""
 
+import dataclasses
 import logging
+import os
+import shlex
+import tempfile
+import time
+from pathlib import Path
+from typing import NoReturn
 
 import ops
 from hpc_libs.interfaces import OCIRuntimeData, OCIRuntimeProvider, SlurmctldConnectedEvent
+from hpc_libs.is_container import is_container
 from hpc_libs.utils import StopCharm, leader, refresh
 from slurmutils import OCIConfig
 
 import apptainer
-from constants import OCI_RUNTIME_INTEGRATION_NAME
+import aptrun
+import backends
+import benchmark
+import fabric
+import integrity
+import launcher
+import loopdev
+import pool
+import procscan
+import runner
+import scheduler
+import scratch
+import sif
+import slurm
+import subid
+import tuning
+import warmer
+from constants import (
+    INSTALL_LAYOUTS,
+    INSTALL_RETRY_BASE_DELAY,
+    INSTALL_RETRY_EVENT,
+    INSTALL_RETRY_MAX_ATTEMPTS,
+    INSTALL_RETRY_MAX_DELAY,
+    OCI_RUNTIME_INTEGRATION_NAME,
+    PEER_INTEGRATION_NAME,
+    TEARDOWN_POLICIES,
+    UPGRADE_RETRY_DELAY,
+    UPGRADE_RETRY_EVENT,
+)
+from rollout import Rollout
 
 
 def _apptainer_status_check(_: ops.CharmBase) -> ops.StatusBase:
     """Check the state of the unit after a charm method has completed."""
     if not apptainer.installed():
         return ops.BlockedStatus("Apptainer is not installed")
+    if drifted := tuning.drift():
+        return ops.ActiveStatus(f"Kernel limits below tuned values: {', '.join(drifted)}")
 
     return ops.ActiveStatus()
 
@@ -38,73 +77,933 @@ logger = logging.getLogger(__name__)
 refresh = refresh(check=_apptainer_status_check)
 
 
+class InstallRetryEvent(ops.EventBase):
+    """Event dispatched by a systemd timer to retry a failed install."""
+
+
+class UpgradeRetryEvent(ops.EventBase):
+    """Event dispatched by a systemd timer to retry a rolling upgrade step."""
+
+
+class ApptainerCharmEvents(ops.CharmEvents):
+    """Events emitted by the Apptainer charm."""
+
+    install_retry = ops.EventSource(InstallRetryEvent)
+    upgrade_retry = ops.EventSource(UpgradeRetryEvent)
+
+
 class ApptainerCharm(ops.CharmBase):
     """Charmed operator for Apptainer, a container runtime for HPC clusters."""
 
+    on = ApptainerCharmEvents()  # pyright: ignore[reportAssignmentType, reportIncompatibleMethodOverride]
+    _stored = ops.StoredState()
+
     def __init__(self, framework: ops.Framework) -> None:
         super().__init__(framework)
+        self._stored.set_default(install_attempts=0, install_retry_at=0.0, scratch_inputs=[])
+
         framework.observe(self.on.install, self._on_install)
+        framework.observe(self.on.install_retry, self._on_install)
+        framework.observe(self.on.start, self._on_config_changed)
+        framework.observe(self.on.config_changed, self._on_config_changed)
+        framework.observe(self.on.update_status, self._on_update_status)
         framework.observe(self.on.stop, self._on_stop)
         framework.observe(self.on.upgrade_action, self._on_upgrade)
+        framework.observe(self.on.rolling_upgrade_action, self._on_rolling_upgrade)
+        framework.observe(self.on.rollback_action, self._on_rollback)
+        framework.observe(self.on[PEER_INTEGRATION_NAME].relation_joined, self._on_peer_changed)
+        framework.observe(self.on[PEER_INTEGRATION_NAME].relation_changed, self._on_peer_changed)
+        framework.observe(self.on.upgrade_retry, self._on_peer_changed)
+        framework.observe(self.on.benchmark_action, self._on_benchmark)
+        framework.observe(self.on.pool_stats_action, self._on_pool_stats)
+        framework.observe(self.on.list_containers_action, self._on_list_containers)
+        framework.observe(self.on.install_status_action, self._on_install_status)
+        framework.observe(self.on.loop_pool_status_action, self._on_loop_pool_status)
+        framework.observe(self.on.sync_fakeroot_action, self._on_sync_fakeroot)
+        framework.observe(self.on.cache_warm_action, self._on_cache_warm)
+        framework.observe(self.on.verify_cache_action, self._on_verify_cache)
 
         self._oci_runtime = OCIRuntimeProvider(self, OCI_RUNTIME_INTEGRATION_NAME)
         framework.observe(self._oci_runtime.on.slurmctld_connected, self._on_slurmctld_connected)
 
     @refresh
-    def _on_install(self, event: ops.InstallEvent) -> None:
-        """Handle when unit is installed onto a machine."""
+    def _on_install(self, event: ops.InstallEvent | InstallRetryEvent) -> None:
+        """Handle when unit is installed onto a machine, or a failed install is retried."""
         self.unit.status = ops.MaintenanceStatus("Installing Apptainer")
         try:
-            apptainer.install()
+            apptainer.reconcile(
+                self._apptainer_config(),
+                progress=self._apt_progress("Installing Apptainer"),
+                backend=self._install_backend(),
+            )
             self.unit.set_workload_version(apptainer.version())
         except apptainer.ApptainerOpsError as e:
             logger.error(e)
+            self._schedule_install_retry(event)
+        except runner.CommandTimeoutError as e:
+            logger.error(e.message)
+            self._schedule_install_retry(event, timeout=e)
+
+        self._stored.install_attempts = 0
+        self._stored.install_retry_at = 0.0
+        scheduler.cancel(self.unit.name, INSTALL_RETRY_EVENT)
+        self.unit.status = ops.ActiveStatus()
+        if isinstance(event, InstallRetryEvent):
+            # The `config-changed` and `start` events that followed the failed install
+            # found Apptainer missing, so the unit has not been configured yet.
+            self._configure(event)
+
+    @refresh
+    def _on_config_changed(self, event: ops.ConfigChangedEvent | ops.StartEvent) -> None:
+        """Apply charm configuration to the unit."""
+        self._configure(event)
+
+    def _configure(
+        self, event: ops.ConfigChangedEvent | ops.StartEvent | InstallRetryEvent
+    ) -> None:
+        """Apply charm configuration to the unit, if Apptainer is installed.
+
+        Raises:
+            StopCharm: Raised if the configuration could not be applied.
+        """
+        if not apptainer.installed():
+            return
+
+        try:
+            fabric.binds(self._config_list("fabric-bind-paths"))
+        except fabric.FabricError as e:
+            logger.error(e.message)
+            raise StopCharm(
+                ops.BlockedStatus("Fabric bind paths not found. See `juju debug-log` for details.")
+            )
+
+        backend = self._install_backend()
+        if backend.name != backends.PPA.name and not backend.source:
+            raise StopCharm(
+                ops.BlockedStatus(f"`install-source` is required by the `{backend.name}` backend")
+            )
+
+        try:
+            self._configure_scratch()
+            apptainer.reconcile(self._apptainer_config(), backend=backend)
+            launcher.install()
+            launcher.configure_staging(
+                str(self.config.get("stage-cache-dir", "")),
+                int(self.config.get("stage-cache-max-size", 0)) * 1024**3,
+                int(self.config.get("stage-pull-ttl", 300)),
+            )
+            self._configure_tuning()
+            self._configure_loop_pool()
+            self._configure_pool()
+        except OSError as e:
+            logger.error("failed to install launch wrapper or loop device pool. reason: %s", e)
+            raise StopCharm(
+                ops.BlockedStatus(
+                    "Failed to configure Apptainer. See `juju debug-log` for details."
+                )
+            )
+        except (
+            apptainer.ApptainerOpsError,
+            scratch.ScratchError,
+            tuning.TuningError,
+            pool.PoolError,
+        ) as e:
+            logger.error(e.message)
+            raise StopCharm(
+                ops.BlockedStatus(
+                    "Failed to configure Apptainer. See `juju debug-log` for details."
+                )
+            )
+        except runner.CommandTimeoutError as e:
+            logger.error(e.message)
+            # Retry on the next hook, by when a hung mirror or mount may have recovered.
             event.defer()
             raise StopCharm(
-                ops.BlockedStatus("Failed to install Apptainer. See `juju debug-log` for details.")
+                ops.BlockedStatus(f"`{e.name}` timed out configuring Apptainer. Retrying")
             )
 
-        self.unit.status = ops.ActiveStatus()
+        self._publish_ociconfig()
 
     @refresh
-    def _on_stop(self, _: ops.RemoveEvent) -> None:
+    def _on_update_status(self, _: ops.UpdateStatusEvent) -> None:
+        """Restart stopped pool instances, rotate the launch log, and warm hot images."""
+        if not apptainer.installed():
+            return
+
+        try:
+            launcher.rotate_log()
+            self._configure_pool()
+        except OSError as e:
+            logger.warning("failed to rotate launch log. reason: %s", e)
+        except pool.PoolError as e:
+            logger.warning(e.message)
+
+        if self._page_cache_bytes():
+            self._warm_page_cache()
+
+        # Catch up on a rolling upgrade step if its retry timer could not be started.
+        self._rollout_step()
+
+    @refresh
+    def _on_peer_changed(
+        self, _: ops.RelationJoinedEvent | ops.RelationChangedEvent | UpgradeRetryEvent
+    ) -> None:
+        """Publish the unit's Slurm node name and take the next rolling upgrade step."""
+        if relation := self.model.get_relation(PEER_INTEGRATION_NAME):
+            relation.data[self.unit]["nodename"] = slurm.nodename()
+
+        self._rollout_step()
+
+    @refresh
+    def _on_stop(self, _: ops.StopEvent) -> None:
         """Handle when Juju starts teardown process of unit."""
+        policy = self.config.get("teardown-policy", "full")
+        if policy not in TEARDOWN_POLICIES:
+            logger.warning("unknown teardown policy `%s`. using `full`", policy)
+            policy = "full"
+        if policy == "skip":
+            logger.info("skipping teardown of Apptainer")
+            return
+
+        if policy == "full" and (containers := self._running_containers()):
+            # Removing Apptainer would break the containers that are still running.
+            logger.error(
+                "not removing Apptainer. %d containers are still running: %s",
+                len(containers),
+                ", ".join(str(c.pid) for c in containers),
+            )
+            raise StopCharm(
+                ops.BlockedStatus(f"Apptainer not removed: {len(containers)} containers running")
+            )
+
+        for event in (INSTALL_RETRY_EVENT, UPGRADE_RETRY_EVENT):
+            scheduler.cancel(self.unit.name, event)
+
+        # The pool and scratch tmpfs are set up by the charm, so they are torn down
+        # even if Apptainer is kept.
+        self._stop_pool()
+        self._teardown_scratch()
         try:
-            self.unit.status = ops.MaintenanceStatus("Removing Apptainer")
-            apptainer.remove()
-            self.unit.status = ops.MaintenanceStatus("Apptainer removed")
-        except apptainer.ApptainerOpsError as e:
+            if policy == "full":
+                self.unit.status = ops.MaintenanceStatus("Removing Apptainer")
+                apptainer.remove()
+            apptainer.cleanup()
+            launcher.uninstall()
+            loopdev.uninstall()
+            tuning.remove()
+            self.unit.status = ops.MaintenanceStatus(
+                "Apptainer removed" if policy == "full" else "Apptainer configuration removed"
+            )
+        except (apptainer.ApptainerOpsError, tuning.TuningError) as e:
             logger.error(e.message)
             raise StopCharm(
                 ops.BlockedStatus("Failed to remove Apptainer. See `juju debug-log` for details.")
             )
+        except runner.CommandTimeoutError as e:
+            logger.error(e.message)
+            raise StopCharm(ops.BlockedStatus(f"`{e.name}` timed out removing Apptainer"))
 
     @leader
     def _on_slurmctld_connected(self, event: SlurmctldConnectedEvent) -> None:
         """Handle when the Slurm controller `slurmctld` is connected to application."""
-        config = OCIConfig()
-        config.ignore_file_config_json = True
-        config.env_exclude = "^(SLURM_CONF|SLURM_CONF_SERVER)="
-        config.run_time_env_exclude = "^(SLURM_CONF|SLURM_CONF_SERVER)="
-        config.run_time_run = "apptainer exec --userns %r %@"
-        config.run_time_kill = "kill -s SIGTERM %p"
-        config.run_time_delete = "kill -s SIGKILL %p"
-
         self._oci_runtime.set_oci_runtime_data(
-            OCIRuntimeData(ociconfig=config), integration_id=event.relation.id
+            OCIRuntimeData(ociconfig=self._ociconfig()), integration_id=event.relation.id
         )
 
     @refresh
-    def _on_upgrade(self, _: ops.ActionEvent) -> None:
+    def _on_upgrade(self, event: ops.ActionEvent) -> None:
         """Perform upgrade to latest operations."""
+        if (containers := self._running_containers()) and not event.params["force"]:
+            event.fail(
+                f"{len(containers)} containers are running. "
+                + "Drain the node first, or run with `force=true`"
+            )
+            return
+
+        self.unit.status = ops.MaintenanceStatus("Upgrading Apptainer")
+        self._stop_pool()
+        try:
+            self._upgrade_apptainer()
+        except apptainer.ApptainerOpsError as e:
+            logger.error(e.message)
+            raise StopCharm(
+                ops.BlockedStatus("Failed to upgrade Apptainer. See `juju debug-log` for details.")
+            )
+        except runner.CommandTimeoutError as e:
+            logger.error(e.message)
+            raise StopCharm(ops.BlockedStatus(f"`{e.name}` timed out upgrading Apptainer"))
+
+    @refresh
+    def _on_rollback(self, event: ops.ActionEvent) -> None:
+        """Roll Apptainer back to a previous version without network access."""
+        if (containers := self._running_containers()) and not event.params["force"]:
+            event.fail(
+                f"{len(containers)} containers are running. "
+                + "Drain the node first, or run with `force=true`"
+            )
+            return
+
+        self.unit.status = ops.MaintenanceStatus("Rolling back Apptainer")
+        self._stop_pool()
         try:
-            apptainer.upgrade()
+            version = apptainer.rollback(event.params.get("version") or None)
             self.unit.set_workload_version(apptainer.version())
+        except apptainer.ApptainerOpsError as e:
+            logger.error(e.message)
+            event.fail(e.message)
+            return
+        except runner.CommandTimeoutError as e:
+            logger.error(e.message)
+            raise StopCharm(ops.BlockedStatus(f"`{e.name}` timed out rolling back Apptainer"))
+
+        event.set_results({"version": version})
+
+    def _on_rolling_upgrade(self, event: ops.ActionEvent) -> None:
+        """Start a rolling upgrade of Apptainer across all units of the application."""
+        if not self.unit.is_leader():
+            event.fail("Rolling upgrades can only be started on the leader unit")
+            return
+
+        relation = self.model.get_relation(PEER_INTEGRATION_NAME)
+        if relation is None:
+            event.fail("Peer integration is not available yet")
+            return
+
+        if data := relation.data[self.app].get("rollout"):
+            current = Rollout.from_json(data)
+            if not current.finished:
+                event.fail(f"Rolling upgrade {current.id} is already in progress")
+                return
+
+        relation.data[self.unit]["nodename"] = slurm.nodename()
+        units = [self.unit, *relation.units]
+        if missing := [unit.name for unit in units if "nodename" not in relation.data[unit]]:
+            event.fail(f"Units {', '.join(missing)} have not published their node name yet")
+            return
+
+        rollout = Rollout.plan(
+            [unit.name for unit in units],
+            batch_size=event.params["batch-size"],
+            concurrency=event.params["concurrency"],
+        )
+        relation.data[self.app]["rollout"] = rollout.json()
+        event.log(f"Starting rolling upgrade {rollout.id} of {len(units)} units")
+        try:
+            self._rollout_step()
+        except StopCharm as e:
+            self.unit.status = e.status
+            if isinstance(e.status, ops.BlockedStatus):
+                event.fail(e.status.message)
+                return
+
+        event.set_results({"id": rollout.id, "batches": str(len(rollout.batches))})
+
+    def _on_benchmark(self, event: ops.ActionEvent) -> None:
+        """Measure the container launch latency of the unit."""
+        if not apptainer.installed():
+            event.fail("Apptainer is not installed")
+            return
+
+        event.log("Running container launch benchmark")
+        try:
+            with tempfile.TemporaryDirectory() as workdir:
+                image = event.params.get("image") or benchmark.build_image(Path(workdir))
+                reports = benchmark.run(
+                    self._ociconfig().run_time_run or "",
+                    image,
+                    iterations=event.params["iterations"],
+                    concurrency=event.params["concurrency"],
+                )
+        except benchmark.BenchmarkError as e:
+            logger.error(e.message)
+            event.fail(e.message)
+            return
+
+        event.set_results({series: report.dict() for series, report in reports.items()})
+
+    def _on_sync_fakeroot(self, event: ops.ActionEvent) -> None:
+        """Allocate `--fakeroot` subordinate ID ranges for a list of users."""
+        try:
+            users = subid.read_users(Path(event.params["users-file"]))
+            new = subid.sync(users, start=event.params["start"], count=event.params["count"])
+        except OSError as e:
+            logger.error("failed to sync fakeroot mappings. reason: %s", e)
+            event.fail(f"Failed to sync fakeroot mappings. reason: {e}")
+            return
+        except subid.SubIDError as e:
+            logger.error(e.message)
+            event.fail(f"Failed to sync fakeroot mappings. reason: {e.message}")
+            return
+
+        event.set_results({"users": str(len(set(users))), "allocated": str(len(new))})
+
+    def _on_pool_stats(self, event: ops.ActionEvent) -> None:
+        """Report the hit rate of the pre-started instance pool."""
+        stats = pool.stats()
+        event.set_results(
+            {
+                "hits": str(stats.hits),
+                "misses": str(stats.misses),
+                "hit-rate": f"{stats.hit_rate:.3f}",
+            }
+        )
+
+    def _on_list_containers(self, event: ops.ActionEvent) -> None:
+        """List the Apptainer containers running on the unit."""
+        containers = procscan.scan()
+        event.set_results(
+            {
+                "count": str(len(containers)),
+                "containers": {f"pid-{c.pid}": c.dict() for c in containers},
+            }
+        )
+
+    def _on_install_status(self, event: ops.ActionEvent) -> None:
+        """Report how Apptainer is installed on the unit."""
+        event.set_results(apptainer.report())
+
+    def _on_loop_pool_status(self, event: ops.ActionEvent) -> None:
+        """Report the usage of the loop device pool."""
+        usage = loopdev.usage(self._loop_pool_size())
+        event.set_results(
+            {
+                "size": str(usage.size),
+                "present": str(usage.present),
+                "attached": str(usage.attached),
+                "free": str(usage.free),
+            }
+        )
+
+    def _on_cache_warm(self, event: ops.ActionEvent) -> None:
+        """Warm the hot images, and report how much of each image is in page cache."""
+        warmed = self._warm_page_cache()
+        event.set_results(
+            {
+                "count": str(len(warmed)),
+                "pressure": f"{warmer.pressure():.2f}",
+                "images": {f"image-{i}": w.dict() for i, w in enumerate(warmed)},
+            }
+        )
+
+    def _on_verify_cache(self, event: ops.ActionEvent) -> None:
+        """Verify the images in the stage cache against their integrity manifests."""
+        if not (cache_dir := str(self.config.get("stage-cache-dir", ""))):
+            event.fail("Failed to verify cache. reason: `stage-cache-dir` is not set")
+            return
+
+        states, failed, images = {}, [], []
+        for user_dir in sorted(Path(cache_dir).glob("*")):
+            for verified in self._verify_user_cache(
+                user_dir, event.params["full"], event.params["remove-corrupt"]
+            ):
+                images.append(Path(verified.path))
+                if verified.state in (integrity.CORRUPT, integrity.FAILED):
+                    failed.append(verified)
+                states[verified.state] = states.get(verified.state, 0) + 1
+
+        results: dict[str, object] = {"count": str(sum(states.values()))}
+        results.update({state: str(count) for state, count in sorted(states.items())})
+        try:
+            # Only the images that changed since the last index are parsed again.
+            summaries = sif.index(Path(cache_dir), launcher.SIF_INDEX)
+            results["not-sif"] = str(
+                sum(1 for p in images if p.exists() and str(p) not in summaries)
+            )
+        except OSError as e:
+            logger.warning("failed to index cached images. reason: %s", e)
+        if failed:
+            results["images"] = {f"image-{i}": v.dict() for i, v in enumerate(failed)}
+        event.set_results(results)
+
+    @staticmethod
+    def _verify_user_cache(
+        user_dir: Path, full: bool, remove_corrupt: bool
+    ) -> list[integrity.Verified]:
+        """Verify the images in the stage cache of a user.
+
+        The action runs as root in directories that the user can write to, so the
+        images are only reached through a file descriptor of the user's `objects`
+        directory, which must be owned by the user. Swapping a directory for a symlink
+        then cannot point the action at files outside the cache.
+        """
+        if not user_dir.name.isdigit():
+            return []
+
+        uid = int(user_dir.name)
+        try:
+            user_fd = integrity.open_dir(user_dir, uid)
+            try:
+                fd = integrity.open_dir("objects", uid, dir_fd=user_fd)
+            finally:
+                os.close(user_fd)
+        except OSError as e:
+            logger.warning("not verifying stage cache %s. reason: %s", user_dir, e)
+            return []
+
+        # The processes that hash the images reach the directory through the charm's fd.
+        objects = Path(f"/proc/{os.getpid()}/fd/{fd}")
+        results = []
+        try:
+            for name in sorted(os.listdir(fd)):
+                if name.startswith(".") or not name.endswith(".sif"):
+                    continue
+
+                path = str(user_dir / "objects" / name)
+                try:
+                    verified = integrity.verify(objects / name, full=full)
+                except integrity.IntegrityError as e:
+                    logger.warning(e.message)
+                    verified = integrity.Verified(path=path, state=integrity.FAILED)
+
+                if verified.state == integrity.CORRUPT and remove_corrupt:
+                    for file in (name, integrity.manifest_file(Path(name)).name):
+                        try:
+                            os.unlink(file, dir_fd=fd)
+                        except FileNotFoundError:
+                            pass
+                results.append(dataclasses.replace(verified, path=path))
+        finally:
+            os.close(fd)
+
+        return results
+
+    def _schedule_install_retry(
+        self,
+        event: ops.InstallEvent | InstallRetryEvent,
+        timeout: runner.CommandTimeoutError | None = None,
+    ) -> NoReturn:
+        """Record a failed install and schedule a retry at the next backoff deadline.
+
+        Args:
+            event: The install event that failed.
+            timeout: The command timeout the install failed on, if any. The unit is
+                blocked rather than waiting while a timed out install is retried.
+
+        Raises:
+            StopCharm: Always raised to stop the failed install hook.
+        """
+        attempts = self._stored.install_attempts + 1
+        self._stored.install_attempts = attempts
+        if attempts >= INSTALL_RETRY_MAX_ATTEMPTS:
+            raise StopCharm(
+                ops.BlockedStatus(
+                    f"Failed to install Apptainer after {attempts} attempts. "
+                    + "See `juju debug-log` for details."
+                )
+            )
+
+        delay = scheduler.backoff(attempts, INSTALL_RETRY_BASE_DELAY, INSTALL_RETRY_MAX_DELAY)
+        try:
+            scheduler.schedule(self.unit.name, INSTALL_RETRY_EVENT, delay, self.charm_dir)
+            self._stored.install_retry_at = time.time() + delay
+        except scheduler.SchedulerError as e:
+            # Fall back to retrying on the next hook if the timer cannot be started.
+            logger.warning(e.message)
+            event.defer()
+
+        if timeout:
+            raise StopCharm(
+                ops.BlockedStatus(
+                    f"`{timeout.name}` timed out installing Apptainer. "
+                    + f"Retrying ({attempts}/{INSTALL_RETRY_MAX_ATTEMPTS})"
+                )
+            )
+        raise StopCharm(
+            ops.WaitingStatus(
+                f"Failed to install Apptainer. Retrying ({attempts}/{INSTALL_RETRY_MAX_ATTEMPTS})"
+            )
+        )
+
+    def _rollout_step(self) -> None:
+        """Take the next step of the current rolling upgrade, if any.
+
+        The leader drains the batches that may upgrade, and resumes the batches
+        whose units have all upgraded. Every unit upgrades itself once its batch
+        has been drained.
+
+        Raises:
+            StopCharm: Raised if the unit is waiting for containers to exit, or if
+                Apptainer or the state of its Slurm nodes could not be updated.
+        """
+        relation = self.model.get_relation(PEER_INTEGRATION_NAME)
+        if relation is None or "rollout" not in relation.data[self.app]:
+            return
+
+        rollout = Rollout.from_json(relation.data[self.app]["rollout"])
+        if rollout.finished:
+            return
+
+        if not self.unit.is_leader():
+            self._upgrade_unit(relation, rollout)
+            return
+
+        # Leader changes to application data do not trigger events on the leader itself,
+        # so keep stepping until its own batch is no longer blocking progress. The other
+        # batches are still advanced if the leader's own unit cannot upgrade, so that a
+        # busy or broken leader node does not stall the whole rollout.
+        stopped = None
+        while True:
+            if stopped is None:
+                try:
+                    self._upgrade_unit(relation, rollout)
+                except StopCharm as e:
+                    stopped = e
+            if not self._advance_rollout(relation, rollout):
+                break
+            relation.data[self.app]["rollout"] = rollout.json()
+
+        if stopped is not None:
+            raise stopped
+        if rollout.finished:
+            logger.info("rolling upgrade %s has completed", rollout.id)
+
+    def _advance_rollout(self, relation: ops.Relation, rollout: Rollout) -> bool:
+        """Drain and resume batches of Slurm nodes as the rolling upgrade progresses.
+
+        Nodes that were already out of service before their batch was drained, e.g.
+        drained by an administrator, are left as they were.
+
+        Returns:
+            True if any batch was drained or resumed, otherwise False.
+        """
+        units = {unit.name: relation.data[unit] for unit in [self.unit, *relation.units]}
+        # Units that have left the application no longer hold up their batch.
+        upgraded = {
+            name
+            for batch in rollout.batches
+            for name in batch
+            if name not in units or units[name].get("upgraded") == rollout.id
+        }
+
+        def nodes(index: int) -> list[str]:
+            return [
+                units[name]["nodename"]
+                for name in rollout.batches[index]
+                if name in units and units[name]["nodename"] not in rollout.held
+            ]
+
+        progress = False
+        try:
+            for index in rollout.drained:
+                if index not in rollout.resumed and rollout.complete(index, upgraded):
+                    if batch := nodes(index):
+                        slurm.resume(batch)
+                    rollout.resumed.append(index)
+                    progress = True
+
+            for index in rollout.active(upgraded):
+                if index not in rollout.drained:
+                    if batch := nodes(index):
+                        self._drain_batch(batch, rollout)
+                    rollout.drained.append(index)
+                    progress = True
+        except slurm.SlurmOpsError as e:
+            logger.error(e.message)
+            relation.data[self.app]["rollout"] = rollout.json()
+            raise StopCharm(
+                ops.BlockedStatus(
+                    "Failed to update Slurm node state. See `juju debug-log` for details."
+                )
+            )
+
+        return progress
+
+    def _drain_batch(self, nodes: list[str], rollout: Rollout) -> None:
+        """Drain the Slurm nodes of a batch, and hold the nodes already out of service.
+
+        Raises:
+            SlurmOpsError: Raised if the nodes could not be queried or drained.
+        """
+        reason = f"apptainer rolling upgrade {rollout.id}"
+        # Nodes drained by an earlier attempt at this step are not held.
+        held = {
+            node: state
+            for node, state in slurm.out_of_service(nodes).items()
+            if not state.endswith(reason)
+        }
+        if held:
+            logger.info("not draining nodes already out of service: %s", held)
+            rollout.held.update(held)
+        if nodes := [node for node in nodes if node not in held]:
+            slurm.drain(nodes, reason=reason)
+
+    def _upgrade_unit(self, relation: ops.Relation, rollout: Rollout) -> None:
+        """Upgrade Apptainer on the unit once its batch of the rolling upgrade is drained."""
+        if (
+            not rollout.authorized(self.unit.name)
+            or relation.data[self.unit].get("upgraded") == rollout.id
+        ):
+            return
+
+        if containers := self._running_containers():
+            logger.info("waiting for %d containers to exit before upgrading", len(containers))
+            self._schedule_upgrade_retry()
+            raise StopCharm(ops.WaitingStatus("Waiting for running containers to exit to upgrade"))
+
+        self.unit.status = ops.MaintenanceStatus("Upgrading Apptainer")
+        self._stop_pool()
+        try:
+            self._upgrade_apptainer()
         except apptainer.ApptainerOpsError as e:
             logger.error(e.message)
             raise StopCharm(
                 ops.BlockedStatus("Failed to upgrade Apptainer. See `juju debug-log` for details.")
             )
+        except runner.CommandTimeoutError as e:
+            logger.error(e.message)
+            self._schedule_upgrade_retry()
+            raise StopCharm(
+                ops.BlockedStatus(f"`{e.name}` timed out upgrading Apptainer. Retrying")
+            )
+
+        relation.data[self.unit]["upgraded"] = rollout.id
+        try:
+            self._configure_pool()
+        except pool.PoolError as e:
+            logger.warning(e.message)
+
+    def _upgrade_apptainer(self) -> None:
+        """Upgrade Apptainer, and apply the charm-managed options to the upgraded install.
+
+        Raises:
+            ApptainerOpsError: Raised if Apptainer could not be upgraded or configured.
+            CommandTimeoutError: Raised if `apt-get` did not finish in time.
+        """
+        progress = self._apt_progress("Upgrading Apptainer")
+        apptainer.upgrade(progress)
+        # Versioned and tarball upgrades activate a new version with a stock
+        # `apptainer.conf`, so the managed options are applied to it again.
+        apptainer.reconcile(
+            self._apptainer_config(), progress=progress, backend=self._install_backend()
+        )
+        self.unit.set_workload_version(apptainer.version())
+
+    def _schedule_upgrade_retry(self) -> None:
+        """Schedule another attempt at the rolling upgrade step of the unit."""
+        try:
+            scheduler.schedule(
+                self.unit.name, UPGRADE_RETRY_EVENT, UPGRADE_RETRY_DELAY, self.charm_dir
+            )
+        except scheduler.SchedulerError as e:
+            logger.warning(e.message)
+
+    def _apt_progress(self, message: str) -> aptrun.Progress:
+        """Get a callback that shows the progress of `apt-get` in the unit status."""
+
+        def _progress(phase: str, percent: float) -> None:
+            self.unit.status = ops.MaintenanceStatus(f"{message} ({phase} {percent:.0f}%)")
+
+        return _progress
+
+    def _running_containers(self) -> list[procscan.Container]:
+        """Get the containers running on the unit, other than the instance pool.
+
+        Pool instances are managed by the charm, so they do not keep the node busy.
+        """
+        instances = set()
+        if user := self.config.get("warm-pool-user", ""):
+            try:
+                instances = pool.pids(str(user))
+            except pool.PoolError as e:
+                logger.warning(e.message)
+
+        return [
+            container
+            for container in procscan.scan()
+            if not any(p.pid in instances for p in container.processes)
+        ]
+
+    def _stop_pool(self) -> None:
+        """Stop the instance pool before Apptainer is changed or removed.
+
+        The pool is restarted by the next `update-status` or `config-changed` event.
+        """
+        try:
+            pool.reconcile(
+                [],
+                size=0,
+                user=str(self.config.get("warm-pool-user", "")),
+                flags=self._runtime_flags(),
+            )
+        except pool.PoolError as e:
+            logger.warning(e.message)
+
+    def _teardown_scratch(self) -> None:
+        """Unmount the scratch tmpfs, if the charm mounted one."""
+        tmp_dir = str(self.config.get("tmp-dir", ""))
+        if not tmp_dir or not self.config.get("tmp-size", ""):
+            return
+
+        try:
+            scratch.teardown(Path(tmp_dir))
+        except scratch.ScratchError as e:
+            # Containers that are kept running may still be using the tmpfs.
+            logger.warning(e.message)
+
+    def _configure_scratch(self) -> None:
+        """Set up node-local storage for Apptainer temporary files.
+
+        The write throughput of the storage is only measured again once `tmp-dir`,
+        `tmp-size`, or `tmp-min-throughput` change since it last passed.
+        """
+        tmp_dir = str(self.config.get("tmp-dir", ""))
+        if not tmp_dir:
+            self._stored.scratch_inputs = []
+            return
+
+        size = str(self.config.get("tmp-size", ""))
+        minimum = int(self.config.get("tmp-min-throughput", 0))
+        scratch.setup(Path(tmp_dir), size=size)
+        inputs = [tmp_dir, size, minimum]
+        if list(self._stored.scratch_inputs) == inputs:
+            return
+
+        rate = scratch.throughput(Path(tmp_dir))
+        logger.info("write throughput of `%s` is %.1f MiB/s", tmp_dir, rate)
+        if rate < minimum:
+            raise StopCharm(
+                ops.BlockedStatus(f"Write throughput of {tmp_dir} is too low ({rate:.0f} MiB/s)")
+            )
+
+        self._stored.scratch_inputs = inputs
+
+    def _configure_tuning(self) -> None:
+        """Raise the kernel limits for the configured number of concurrent containers."""
+        if not (containers := int(self.config.get("max-concurrent-containers", 0))):
+            tuning.remove()
+            return
+
+        skipped = tuning.apply(
+            tuning.recommend(os.cpu_count() or 1, containers, loops=self._loop_pool_size()),
+            container=is_container(),
+        )
+        if skipped:
+            logger.info("kernel limits %s are not tuned on this unit", [k.name for k in skipped])
+
+    def _configure_loop_pool(self) -> None:
+        """Pre-create the loop device pool now, and at every boot."""
+        if not (size := self._loop_pool_size()):
+            loopdev.uninstall()
+            return
+
+        loopdev.install(size)
+        created = loopdev.create(size)
+        logger.info("created %d loop devices for a pool of %d", created, size)
+
+    def _loop_pool_size(self) -> int:
+        """Get the number of loop devices to pre-create."""
+        if is_container():
+            # Loop devices belong to the host.
+            return 0
+        if size := int(self.config.get("loop-pool-size", 0)):
+            return size
+
+        # Each container mounts its image, and possibly an overlay image, on a loop device.
+        return 2 * int(self.config.get("max-concurrent-containers", 0))
+
+    def _configure_pool(self) -> None:
+        """Start or stop pre-started instances to match the configured instance pool."""
+        pool.reconcile(
+            self._config_list("warm-pool-images"),
+            size=int(self.config.get("warm-pool-size", 0)),
+            user=str(self.config.get("warm-pool-user", "")),
+            flags=self._runtime_flags(),
+        )
+
+    def _page_cache_bytes(self) -> int:
+        """Get the memory budget for keeping hot images in page cache."""
+        return int(self.config.get("page-cache-max-size", 0)) * 1024**3
+
+    def _warm_page_cache(self) -> list[warmer.Warmed]:
+        """Read the most launched images into page cache within the memory budget."""
+        images = warmer.rank(
+            self._config_list("page-cache-images"),
+            top=int(self.config.get("page-cache-top-images", 0)),
+            cache_dir=str(self.config.get("stage-cache-dir", "")),
+        )
+        return warmer.warm(images, max_bytes=self._page_cache_bytes())
+
+    def _config_list(self, key: str) -> list[str]:
+        """Get a comma-separated configuration option as a list."""
+        return [item.strip() for item in str(self.config.get(key, "")).split(",") if item.strip()]
+
+    def _pool_enabled(self) -> bool:
+        """Check if job steps can be launched inside pre-started instances."""
+        return bool(
+            self._config_list("warm-pool-images")
+            and self.config.get("warm-pool-size", 0)
+            and self.config.get("warm-pool-user", "")
+        )
+
+    def _fabric_binds(self) -> fabric.Binds:
+        """Get the host fabric libraries and devices to bind into containers."""
+        try:
+            return fabric.binds(self._config_list("fabric-bind-paths"))
+        except fabric.FabricError as e:
+            # Invalid paths block the unit in `config-changed`. Bind nothing until fixed.
+            logger.warning(e.message)
+            return fabric.Binds()
+
+    def _install_backend(self) -> backends.Backend:
+        """Get the configured install backend of Apptainer."""
+        layout = str(self.config.get("install-layout", "packages"))
+        if layout not in INSTALL_LAYOUTS:
+            logger.warning("unknown install layout `%s`. using `packages`", layout)
+            layout = "packages"
+
+        name = str(self.config.get("install-backend", backends.PPA.name))
+        if name not in backends.BACKENDS:
+            logger.warning("unknown install backend `%s`. using `ppa`", name)
+            name = backends.PPA.name
+
+        return backends.get(name, str(self.config.get("install-source", "")), layout)
+
+    def _runtime_flags(self) -> list[str]:
+        """Get the flags passed to `apptainer exec` when launching job steps."""
+        return ["--userns", *self._fabric_binds().flags()]
+
+    def _apptainer_config(self) -> dict[str, str | list[str]]:
+        """Get the charm-managed options for `apptainer.conf`."""
+        options: dict[str, str | list[str]] = {}
+        if sessiondir_max_size := self.config.get("sessiondir-max-size", 0):
+            options["sessiondir max size"] = str(sessiondir_max_size)
+        if (binds := self._fabric_binds()).paths:
+            options["bind path"] = binds.bind_paths(apptainer.site_config("bind path"))
+        if loop_pool_size := self._loop_pool_size():
+            options["max loop devices"] = str(loopdev.max_loop_devices(loop_pool_size))
+
+        return options
+
+    def _ociconfig(self) -> OCIConfig:
+        """Get the `oci.conf` configuration published to the Slurm controller."""
+        run = [apptainer.binary(), "exec", *self._runtime_flags()]
+        if tmp_dir := self.config.get("tmp-dir", ""):
+            run = ["env", f"APPTAINER_TMPDIR={tmp_dir}", *run]
+        if (
+            self._pool_enabled()
+            or self.config.get("stage-cache-dir", "")
+            or self.config.get("page-cache-top-images", 0)
+        ):
+            run = [str(launcher.BIN_FILE), "%r", "--", *run]
+
+        config = OCIConfig()
+        config.ignore_file_config_json = True
+        config.env_exclude = "^(SLURM_CONF|SLURM_CONF_SERVER)="
+        config.run_time_env_exclude = "^(SLURM_CONF|SLURM_CONF_SERVER)="
+        config.run_time_run = shlex.join([*run, "%r", "%@"])
+        config.run_time_kill = "kill -s SIGTERM %p"
+        config.run_time_delete = "kill -s SIGKILL %p"
+
+        return config
+
+    def _publish_ociconfig(self) -> None:
+        """Publish the current `oci.conf` configuration to all connected Slurm controllers."""
+        if not self.unit.is_leader():
+            return
+
+        data = OCIRuntimeData(ociconfig=self._ociconfig())
+        for relation in self.model.relations[OCI_RUNTIME_INTEGRATION_NAME]:
+            self._oci_runtime.set_oci_runtime_data(data, integration_id=relation.id)
 
 
 if __name__ == "__main__":  # pragma: nocover
@@ -14,12 +14,31 @@
 
 """Constants used within the Apptainer charmed operator."""
 
+from pathlib import Path
+
 from hpc_libs.is_container import is_container
 
 OCI_RUNTIME_INTEGRATION_NAME = "oci-runtime"
+PEER_INTEGRATION_NAME = "apptainer-peers"
+
+INSTALL_RETRY_EVENT = "install-retry"
+INSTALL_RETRY_MAX_ATTEMPTS = 10
+INSTALL_RETRY_BASE_DELAY = 5
+INSTALL_RETRY_MAX_DELAY = 300
+
+TEARDOWN_POLICIES = ("full", "keep-packages", "skip")
+
+UPGRADE_RETRY_EVENT = "upgrade-retry"
+UPGRADE_RETRY_DELAY = 30
 
 APPTAINER_PACKAGES = ["apptainer"] if is_container() else ["apptainer", "apptainer-suid"]
+# The setuid starter only works from the paths it was built for, so versioned
+# installs are always unprivileged.
+APPTAINER_VERSIONED_PACKAGES = ["apptainer"]
+INSTALL_LAYOUTS = ("packages", "versioned")
 APPTAINER_PPA_URL = "https://ppa.launchpadcontent.net/apptainer/ppa/ubuntu/"
+APPTAINER_CONFIG_FILE = Path("/etc/apptainer/apptainer.conf")
+APPTAINER_STATE_FILE = Path("/var/lib/apptainer-operator/apptainer.json")
 APPTAINER_PPA_KEY = """
 -----BEGIN PGP PUBLIC KEY BLOCK-----
 .
@@ -0,0 +1,170 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Wait for the dpkg and apt locks held by other package managers on the unit.
+
+Other charms on the machine, `unattended-upgrades`, and `cloud-init` all take the
+dpkg and apt locks. `apt-get` and `dpkg` fail straight away if a lock is held, so
+package operations are retried with bounded exponential backoff until it is released.
+"""
+
+import fcntl
+import logging
+import os
+import random
+import re
+import struct
+import time
+from collections.abc import Callable, Iterable
+from pathlib import Path
+from typing import TypeVar
+
+_logger = logging.getLogger(__name__)
+_lock_error = re.compile(
+    r"could not get lock|unable to acquire the dpkg frontend lock|unable to lock",
+    re.IGNORECASE,
+)
+# struct flock { short l_type; short l_whence; off_t l_start; off_t l_len; pid_t l_pid; }
+_flock = "hhqqi4x"
+
+T = TypeVar("T")
+
+LOCK_FILES = (
+    Path("/var/lib/dpkg/lock-frontend"),
+    Path("/var/lib/dpkg/lock"),
+    Path("/var/lib/apt/lists/lock"),
+    Path("/var/cache/apt/archives/lock"),
+)
+
+
+class LockTimeoutError(Exception):
+    """Exception raised when the dpkg or apt locks were not released in time."""
+
+    @property
+    def message(self) -> str:
+        """Return message passed as argument to exception."""
+        return self.args[0]
+
+
+def holder(lock: Path) -> int | None:
+    """Get the PID of the process holding a lock file, or `None` if the lock is free."""
+    try:
+        fd = os.open(lock, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+
+    try:
+        request = struct.pack(_flock, fcntl.F_WRLCK, os.SEEK_SET, 0, 0, 0)
+        l_type, _, _, _, l_pid = struct.unpack(_flock, fcntl.fcntl(fd, fcntl.F_GETLK, request))
+    finally:
+        os.close(fd)
+
+    return None if l_type == fcntl.F_UNLCK else l_pid
+
+
+def describe(pid: int) -> str:
+    """Describe a process by its PID and command line."""
+    try:
+        cmdline = Path(f"/proc/{pid}/cmdline").read_bytes().replace(b"\0", b" ").strip()
+    except OSError:
+        return f"pid {pid}"
+
+    return f"pid {pid} ({cmdline.decode(errors='replace')})"
+
+
+def holders(locks: Iterable[Path] = LOCK_FILES) -> dict[Path, int]:
+    """Get the PIDs of the processes holding any of the dpkg and apt locks."""
+    return {lock: pid for lock in locks if (pid := holder(lock)) is not None}
+
+
+def _backoff(attempt: int, base: float, cap: float) -> float:
+    """Get a delay with full jitter for the given retry attempt."""
+    return random.uniform(base, min(cap, base * 2**attempt))
+
+
+def wait(
+    timeout: float = 300, base: float = 0.2, cap: float = 5, locks: Iterable[Path] = LOCK_FILES
+) -> None:
+    """Wait until the dpkg and apt locks are free.
+
+    Args:
+        timeout: Maximum time in seconds to wait for the locks.
+        base: Initial delay in seconds between checks.
+        cap: Maximum delay in seconds between checks. A small cap keeps the time
+            between the lock being released and this function returning short.
+        locks: Lock files to wait for.
+
+    Raises:
+        LockTimeoutError: Raised if the locks are still held after `timeout` seconds.
+    """
+    locks = list(locks)
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while held := holders(locks):
+        if time.monotonic() >= deadline:
+            raise LockTimeoutError(
+                f"timed out after {timeout}s waiting for locks held by "
+                + ", ".join(f"{describe(pid)} on {lock}" for lock, pid in held.items())
+            )
+
+        if attempt == 0:
+            for lock, pid in held.items():
+                _logger.info("waiting for lock %s held by %s", lock, describe(pid))
+
+        time.sleep(_backoff(attempt, base, cap))
+        attempt += 1
+
+
+def retry(
+    func: Callable[..., T],
+    *args,
+    timeout: float = 300,
+    base: float = 0.2,
+    cap: float = 5,
+    **kwargs,
+) -> T:
+    """Call a package operation, retrying it while dpkg or apt locks are held.
+
+    The locks are checked before each call, and the call is retried if it still
+    fails on a lock taken by another process in between.
+
+    Args:
+        func: Package operation to call.
+        *args: Positional arguments to pass to `func`.
+        timeout: Maximum time in seconds to wait for the locks overall.
+        base: Initial delay in seconds between retries.
+        cap: Maximum delay in seconds between retries.
+        **kwargs: Keyword arguments to pass to `func`.
+
+    Raises:
+        LockTimeoutError: Raised if the locks are still held after `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        wait(timeout=max(deadline - time.monotonic(), 0), base=base, cap=cap)
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            stderr = getattr(e, "stderr", None) or b""
+            if isinstance(stderr, bytes):
+                stderr = stderr.decode(errors="replace")
+            if not _lock_error.search(f"{e} {stderr}"):
+                raise
+            if time.monotonic() >= deadline:
+                raise LockTimeoutError(f"timed out after {timeout}s retrying on lock. reason: {e}")
+
+            _logger.info("`%s` failed on a held lock. retrying", getattr(func, "__name__", func))
+            time.sleep(_backoff(attempt, base, cap))
+            attempt += 1
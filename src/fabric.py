@@ -0,0 +1,166 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Bind host fabric libraries and devices into containers for host-optimized MPI.
+
+Containerised MPI jobs only use InfiniBand, Omni-Path, or Slingshot if the host's
+libfabric, UCX, and PMIx libraries and the fabric device nodes are available inside
+the container. Shared libraries are bound into `/.singularity.d/libs`, which Apptainer
+adds to `LD_LIBRARY_PATH` in every container. Directories and device nodes are bound
+at the same path as on the host.
+"""
+
+import logging
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from pathlib import Path
+
+_logger = logging.getLogger(__name__)
+
+AUTO = "auto"
+CONTAINER_LIB_DIR = "/.singularity.d/libs"
+# `bind path` entries in the `apptainer.conf` shipped by the Apptainer packages, used
+# if the site's own entries cannot be read.
+DEFAULT_BIND_PATHS = ("/etc/localtime", "/etc/hosts")
+
+LIBRARY_DIRS = ("usr/lib/x86_64-linux-gnu", "usr/lib64", "usr/lib", "usr/local/lib")
+LIBRARY_PATTERNS = (
+    "libfabric.so.*",
+    "libucp.so.*",
+    "libucs.so.*",
+    "libuct.so.*",
+    "libucm.so.*",
+    "libpmix.so.*",
+    "libibverbs.so.*",
+    "librdmacm.so.*",
+    "libpsm2.so.*",
+)
+# Plugin directories of the fabric libraries, and the variable that points each
+# library at its plugins inside the container.
+PLUGIN_DIRS = {
+    "libfabric": "FI_PROVIDER_PATH",
+    "ucx": "UCX_MODULE_DIR",
+    "pmix": "PMIX_MCA_mca_base_component_path",
+    "libibverbs": "",
+}
+DEVICE_PATTERNS = ("dev/infiniband", "dev/hfi1_*", "dev/cxi*")
+CONFIG_DIRS = ("etc/libibverbs.d",)
+
+
+class FabricError(Exception):
+    """Exception raised when the fabric bind paths are not valid."""
+
+    @property
+    def message(self) -> str:
+        """Return message passed as argument to exception."""
+        return self.args[0]
+
+
+@dataclass(frozen=True)
+class Binds:
+    """Host paths to bind into containers.
+
+    Attributes:
+        paths: Mapping of host paths to their destination inside the container.
+        env: Environment variables to set inside the container.
+    """
+
+    paths: dict[str, str] = field(default_factory=dict)
+    env: dict[str, str] = field(default_factory=dict)
+
+    def bind_paths(self, site: Sequence[str] | None = None) -> list[str]:
+        """Get the `bind path` entries for `apptainer.conf`.
+
+        Args:
+            site: `bind path` entries the site set in `apptainer.conf`, which are kept
+                ahead of the fabric entries. Defaults to the entries shipped by the
+                Apptainer packages.
+        """
+        entries = list(DEFAULT_BIND_PATHS if site is None else site)
+        for src, dst in self.paths.items():
+            if (entry := src if src == dst else f"{src}:{dst}") not in entries:
+                entries.append(entry)
+
+        return entries
+
+    def flags(self) -> list[str]:
+        """Get the `apptainer exec` flags that point the fabric libraries at their plugins."""
+        return [f"--env={name}={value}" for name, value in sorted(self.env.items())]
+
+
+def _is_library(path: Path) -> bool:
+    """Check if a path is a shared library file."""
+    return path.is_file() and ".so" in path.name
+
+
+def discover(root: Path = Path("/")) -> list[Path]:
+    """Discover the fabric libraries, plugin directories, and devices of the host.
+
+    Args:
+        root: Root directory of the host filesystem.
+
+    Returns:
+        Discovered host paths. Libraries found in several library directories are
+        only returned from the first directory in `LIBRARY_DIRS`.
+    """
+    found: list[Path] = []
+    names = set()
+    for lib_dir in (root / d for d in LIBRARY_DIRS):
+        if not lib_dir.is_dir():
+            continue
+        for pattern in LIBRARY_PATTERNS:
+            for lib in sorted(lib_dir.glob(pattern)):
+                if lib.name not in names:
+                    names.add(lib.name)
+                    found.append(lib)
+        for plugin_dir in PLUGIN_DIRS:
+            if (lib_dir / plugin_dir).is_dir() and plugin_dir not in names:
+                names.add(plugin_dir)
+                found.append(lib_dir / plugin_dir)
+
+    for pattern in (*DEVICE_PATTERNS, *CONFIG_DIRS):
+        found.extend(sorted(root.glob(pattern)))
+
+    _logger.debug("discovered fabric paths %s", [str(p) for p in found])
+    return found
+
+
+def binds(paths: list[str], root: Path = Path("/")) -> Binds:
+    """Get the bind mounts for a list of host fabric paths.
+
+    Args:
+        paths: Host paths of fabric libraries, plugin directories, and devices.
+            `auto` is replaced by the paths found by `discover(...)`.
+        root: Root directory of the host filesystem to discover paths in.
+
+    Raises:
+        FabricError: Raised if a path does not exist on the host.
+    """
+    expanded = []
+    for path in paths:
+        expanded.extend(discover(root) if path == AUTO else [Path(path)])
+
+    if missing := [str(p) for p in expanded if not p.exists()]:
+        raise FabricError(f"fabric bind paths {missing} do not exist on the host")
+
+    mounts, env = {}, {}
+    for path in expanded:
+        if _is_library(path):
+            mounts[str(path)] = f"{CONTAINER_LIB_DIR}/{path.name}"
+        else:
+            mounts[str(path)] = str(path)
+            if path.is_dir() and (name := PLUGIN_DIRS.get(path.name)):
+                env[name] = str(path)
+
+    return Binds(paths=mounts, env=env)
@@ -0,0 +1,298 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Verify the integrity of cached images with per-chunk hashes.
+
+Images are split into fixed-size chunks that are hashed in parallel by a pool of
+processes, each hashing memory-mapped slices of the image. The chunk hashes are
+saved to a manifest next to the image, so a corrupted image can be detected later,
+and the corrupted chunks located down to the data objects of the image.
+
+This module must only import from the standard library, so that it can be used by
+the launch wrapper.
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import sif
+
+_logger = logging.getLogger(__name__)
+
+ALGORITHM = "sha256"
+CHUNK_BYTES = 64 * 1024**2
+MANIFEST_VERSION = 1
+
+OK = "ok"
+UNCHANGED = "unchanged"
+CORRUPT = "corrupt"
+UNVERIFIED = "unverified"
+FAILED = "failed"
+
+
+class IntegrityError(Exception):
+    """Exception raised when the integrity of an image could not be verified."""
+
+    @property
+    def message(self) -> str:
+        """Return message passed as argument to exception."""
+        return self.args[0]
+
+
+@dataclass(frozen=True)
+class Verified:
+    """Outcome of verifying an image against its manifest.
+
+    Attributes:
+        path: Path of the image.
+        state: `ok` or `corrupt` if the image was hashed, `unchanged` if it was not
+            hashed because it did not change since it was last verified,
+            `unverified` if it has no manifest, or `failed` if it could not be read.
+        chunks: Number of chunks of the image.
+        corrupt: Indices of the chunks whose hash does not match the manifest.
+        regions: Parts of the image that the corrupt chunks overlap, e.g. the SIF
+            header or a partition.
+    """
+
+    path: str
+    state: str
+    chunks: int = 0
+    corrupt: list[int] = field(default_factory=list)
+    regions: list[str] = field(default_factory=list)
+
+    def dict(self) -> dict[str, str]:
+        """Get the outcome as action results."""
+        results = {"path": self.path, "state": self.state, "chunks": str(self.chunks)}
+        if self.corrupt:
+            results["corrupt"] = ",".join(str(i) for i in self.corrupt)
+        if self.regions:
+            results["regions"] = ", ".join(self.regions)
+        return results
+
+
+def manifest_file(image: Path) -> Path:
+    """Get the manifest file of an image."""
+    return image.with_name(f"{image.name}.manifest")
+
+
+def open_dir(path: str | os.PathLike, uid: int, dir_fd: int | None = None) -> int:
+    """Open a directory that only `uid` may write to, without following a final symlink.
+
+    Returns:
+        File descriptor of the directory.
+
+    Raises:
+        OSError: Raised if the directory could not be opened, or is not owned by
+            `uid` or is writable by other users.
+    """
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW | os.O_CLOEXEC, dir_fd=dir_fd)
+    st = os.fstat(fd)
+    if st.st_uid != uid or st.st_mode & 0o022:
+        os.close(fd)
+        raise OSError(f"{path} is not a directory that only uid {uid} may write to")
+
+    return fd
+
+
+def _stamp(st: os.stat_result) -> list[int]:
+    """Get the fields of a file status that change when the file is written to."""
+    return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+
+def _hash_range(path: str, offset: int, length: int) -> str:
+    """Hash a chunk of a file through a memory-mapped slice."""
+    with (
+        open(path, "rb") as f,
+        mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ, offset=offset) as buf,
+    ):
+        return hashlib.new(ALGORITHM, buf).hexdigest()
+
+
+def _workers() -> int:
+    """Get the number of CPUs the process may run on, e.g. the CPUs of a job step."""
+    return len(os.sched_getaffinity(0))
+
+
+def hash_chunks(path: str | os.PathLike, chunk_size: int = CHUNK_BYTES) -> list[str]:
+    """Hash the chunks of a file in parallel.
+
+    Args:
+        path: Path of the file.
+        chunk_size: Size of the chunks. Must be a multiple of `mmap.ALLOCATIONGRANULARITY`.
+
+    Returns:
+        The hash of each chunk of the file. An empty file has no chunks.
+    """
+    size = os.stat(path).st_size
+    ranges = [(os.fspath(path), o, min(chunk_size, size - o)) for o in range(0, size, chunk_size)]
+    if len(ranges) <= 1 or (workers := min(_workers(), len(ranges))) <= 1:
+        return [_hash_range(*r) for r in ranges]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_hash_range, *zip(*ranges)))
+
+
+def copy(
+    src: str | os.PathLike, dst: str | os.PathLike, chunk_size: int = CHUNK_BYTES
+) -> list[str]:
+    """Copy a file, hashing its chunks as they are copied.
+
+    The source is only read once, so the hashes can be checked against the copy
+    without reading the source again, e.g. from a network filesystem.
+
+    Returns:
+        The hash of each chunk of the source.
+    """
+    chunks = []
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        while data := fsrc.read(chunk_size):
+            chunks.append(hashlib.new(ALGORITHM, data).hexdigest())
+            fdst.write(data)
+
+    return chunks
+
+
+def compare(
+    path: str | os.PathLike, chunks: list[str], chunk_size: int = CHUNK_BYTES
+) -> list[int]:
+    """Get the indices of the chunks of a file whose hash does not match `chunks`.
+
+    Chunks that are missing from either the file or `chunks` do not match.
+    """
+    hashes = hash_chunks(path, chunk_size)
+    return [
+        i
+        for i in range(max(len(hashes), len(chunks)))
+        if i >= len(hashes) or i >= len(chunks) or hashes[i] != chunks[i]
+    ]
+
+
+def save(
+    image: Path, chunks: list[str], chunk_size: int = CHUNK_BYTES, target: Path | None = None
+) -> None:
+    """Save the manifest of an image.
+
+    Args:
+        image: Path of the image.
+        chunks: Hash of each chunk of the image.
+        chunk_size: Size of the chunks.
+        target: Path that the image will be renamed to, if it is a temporary file.
+            The manifest is saved next to `target`.
+    """
+    manifest = manifest_file(target or image)
+    tmp = manifest.with_name(f".{manifest.name}.{os.getpid()}.tmp")
+    data = json.dumps(
+        {
+            "version": MANIFEST_VERSION,
+            "algorithm": ALGORITHM,
+            "chunk_size": chunk_size,
+            "stamp": _stamp(os.stat(image)),
+            "chunks": chunks,
+        }
+    )
+    # Other users may be able to write to the directory, e.g. when the charm verifies a
+    # user's cache as root, so the temporary file is never written through a symlink.
+    tmp.unlink(missing_ok=True)
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW | os.O_CLOEXEC, 0o644)
+    with os.fdopen(fd, "w") as f:
+        f.write(data)
+    os.replace(tmp, manifest)
+
+
+def create(image: Path, chunk_size: int = CHUNK_BYTES, target: Path | None = None) -> list[str]:
+    """Hash an image and save its manifest, see `save(...)`.
+
+    Returns:
+        The hash of each chunk of the image.
+    """
+    chunks = hash_chunks(image, chunk_size)
+    save(image, chunks, chunk_size, target)
+    return chunks
+
+
+def _regions(image: Path, corrupt: list[int], chunk_size: int) -> list[str]:
+    """Get the parts of a SIF image that corrupt chunks overlap."""
+    try:
+        parsed = sif.parse(image)
+    except sif.SIFError:
+        return []
+
+    # The global header and descriptor table come before the first data object.
+    header = min((d.offset for d in parsed.descriptors), default=sif.HEADER.size)
+    parts = [("header", 0, header)] + [
+        (f"{d.type} {d.name or d.id}", d.offset, d.size) for d in parsed.descriptors
+    ]
+    regions = []
+    for start, end in ((i * chunk_size, (i + 1) * chunk_size) for i in corrupt):
+        for name, offset, size in parts:
+            if offset < end and start < offset + size and name not in regions:
+                regions.append(name)
+
+    return regions
+
+
+def verify(image: Path, full: bool = False) -> Verified:
+    """Verify an image against its manifest.
+
+    Cached images are never written to after they are admitted, so an image whose
+    inode, size, and modification time match the manifest is not hashed again
+    unless `full` is set. Images that changed, and all images if `full` is set, are
+    hashed again, and the chunks whose hash does not match the manifest are reported.
+
+    Args:
+        image: Path of the image.
+        full: Hash the image even if it did not change since it was last verified.
+
+    Raises:
+        IntegrityError: Raised if the image or its manifest could not be read.
+    """
+    try:
+        manifest = json.loads(manifest_file(image).read_text())
+    except FileNotFoundError:
+        return Verified(path=str(image), state=UNVERIFIED)
+    except (OSError, ValueError) as e:
+        raise IntegrityError(f"failed to read manifest of {image}. reason: {e}")
+
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("algorithm") != ALGORITHM:
+        return Verified(path=str(image), state=UNVERIFIED)
+
+    chunks, chunk_size = manifest["chunks"], manifest["chunk_size"]
+    try:
+        if not full and _stamp(os.stat(image)) == manifest["stamp"]:
+            return Verified(path=str(image), state=UNCHANGED, chunks=len(chunks))
+
+        corrupt = compare(image, chunks, chunk_size)
+        if not corrupt:
+            # Skip hashing the image on the next verification if it was only touched.
+            save(image, chunks, chunk_size)
+    except OSError as e:
+        raise IntegrityError(f"failed to verify {image}. reason: {e}")
+
+    if corrupt:
+        _logger.warning("image %s is corrupt in chunks %s", image, corrupt)
+        return Verified(
+            path=str(image),
+            state=CORRUPT,
+            chunks=len(chunks),
+            corrupt=corrupt,
+            regions=_regions(image, corrupt, chunk_size),
+        )
+
+    return Verified(path=str(image), state=OK, chunks=len(chunks))
@@ -0,0 +1,595 @@
+#!/usr/bin/env python3
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Launch wrapper for container steps started by Slurm through `oci.conf`.
+
+The wrapper is installed on the unit as `apptainer-launch` and is called as:
+
+    apptainer-launch IMAGE -- apptainer exec [FLAGS...] IMAGE [ARGS...]
+
+It rewrites the launch command before replacing itself with it, so the
+process started by Slurm keeps its PID. This module is run by the system
+Python interpreter, so it must only import from the standard library and the
+modules in `LIB_MODULES`, which are installed next to it.
+
+Images on network filesystems such as Lustre or GPFS are staged into a node-local
+cache first, so that the random reads of the container go to local storage instead
+of the shared filesystem. Images pulled from registries, e.g. `docker://` or
+`oras://` references, are pulled once into the same cache by the first step that
+needs them, while the other steps on the node wait for the pull instead of each
+pulling and converting the image themselves.
+"""
+
+import ctypes
+import fcntl
+import functools
+import hashlib
+import json
+import os
+import pwd
+import shutil
+import socket
+import stat
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import integrity
+
+LIB_DIR = Path("/usr/local/lib/apptainer-operator")
+LIB_MODULES = ("integrity.py", "sif.py")
+BIN_FILE = Path("/usr/local/bin/apptainer-launch")
+STATE_DIR = Path("/var/lib/apptainer-operator")
+POOL_FILE = STATE_DIR / "pool.json"
+LAUNCH_LOG = STATE_DIR / "launch.log"
+STAGE_FILE = STATE_DIR / "stage.json"
+# Summaries of the SIF images in the stage cache, see `sif.index(...)`.
+SIF_INDEX = STATE_DIR / "sif-index.json"
+
+# `f_type` reported by `statfs(2)` for network and parallel filesystems.
+NETWORK_FS_TYPES = {
+    0x0BD00BD0: "lustre",
+    0x47504653: "gpfs",
+    0x19830326: "beegfs",
+    0xAAD7AAEA: "panfs",
+    0x00C36400: "ceph",
+    0x00006969: "nfs",
+    0xFF534D42: "cifs",
+    0xFE534D42: "smb2",
+    0x5346414F: "afs",
+}
+# Bytes hashed from each end of an image to identify its contents. SIF images start
+# with a header that holds the unique ID of the image.
+PARTIAL_HASH_BYTES = 1024**2
+# Image references that `apptainer` pulls and converts to a SIF image on every launch.
+PULL_SCHEMES = ("docker://", "oras://", "library://")
+
+
+def log(event: str, image: str, **fields) -> None:
+    """Append a launch event to the launch log.
+
+    The launch log is created by the charm. Events are dropped if it does not exist
+    so that a missing or unwritable log never prevents a container from launching.
+    """
+    record = {"time": time.time(), "event": event, "image": image, "uid": os.getuid(), **fields}
+    try:
+        fd = os.open(LAUNCH_LOG, os.O_WRONLY | os.O_APPEND)
+    except OSError:
+        return
+
+    try:
+        os.write(fd, (json.dumps(record, separators=(",", ":")) + "\n").encode())
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _instance_running(user: pwd.struct_passwd, name: str) -> bool:
+    """Check if an Apptainer instance is running without forking `apptainer instance list`."""
+    instance = (
+        Path(user.pw_dir)
+        / ".apptainer"
+        / "instances"
+        / "app"
+        / socket.gethostname()
+        / user.pw_name
+        / name
+        / f"{name}.json"
+    )
+    try:
+        pid = json.loads(instance.read_text())["pid"]
+        os.kill(pid, 0)
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+
+    return True
+
+
+def pool(image: str, cmd: list[str]) -> list[str]:
+    """Run the step inside a pre-started instance of the image if one is available.
+
+    Args:
+        image: Image the step is launched from.
+        cmd: Launch command for the step.
+
+    Returns:
+        `apptainer exec instance://...` command if a pool instance of the image is
+        running for the current user, otherwise the unmodified launch command.
+    """
+    try:
+        state = json.loads(POOL_FILE.read_text())
+    except (OSError, ValueError):
+        return cmd
+
+    instances = state.get("instances", {}).get(os.path.realpath(image), [])
+    if not instances or image not in cmd or "exec" not in cmd:
+        return cmd
+
+    try:
+        user = pwd.getpwuid(os.getuid())
+    except KeyError:
+        return cmd
+
+    if user.pw_name == state.get("user"):
+        # Spread steps over the instances, starting from a different one for each step.
+        start = os.getpid() % len(instances)
+        for name in instances[start:] + instances[:start]:
+            if _instance_running(user, name):
+                log("pool-hit", image, instance=name)
+                exec_ = cmd.index("exec")
+                return [*cmd[: exec_ + 1], f"instance://{name}", *cmd[cmd.index(image) + 1 :]]
+
+    log("pool-miss", image)
+    return cmd
+
+
+class _Statfs(ctypes.Structure):
+    """`struct statfs` of 64-bit Linux."""
+
+    _fields_ = [
+        ("f_type", ctypes.c_long),
+        ("f_bsize", ctypes.c_long),
+        ("f_blocks", ctypes.c_ulong),
+        ("f_bfree", ctypes.c_ulong),
+        ("f_bavail", ctypes.c_ulong),
+        ("f_files", ctypes.c_ulong),
+        ("f_ffree", ctypes.c_ulong),
+        ("f_fsid", ctypes.c_int * 2),
+        ("f_namelen", ctypes.c_long),
+        ("f_frsize", ctypes.c_long),
+        ("f_flags", ctypes.c_long),
+        ("f_spare", ctypes.c_long * 4),
+    ]
+
+
+@functools.cache
+def _libc() -> ctypes.CDLL:
+    """Get the C library the interpreter is linked against."""
+    return ctypes.CDLL(None, use_errno=True)
+
+
+def fs_type(path: str) -> int | None:
+    """Get the filesystem type of a path from `statfs(2)`, or `None` if it failed."""
+    buf = _Statfs()
+    if _libc().statfs(os.fsencode(path), ctypes.byref(buf)) != 0:
+        return None
+
+    return buf.f_type & 0xFFFFFFFF
+
+
+def partial_hash(path: str, size: int) -> str:
+    """Get a digest of the size, start, and end of a file, without reading all of it."""
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as f:
+        digest.update(f.read(PARTIAL_HASH_BYTES))
+        f.seek(max(size - PARTIAL_HASH_BYTES, 0))
+        digest.update(f.read(PARTIAL_HASH_BYTES))
+
+    return digest.hexdigest()
+
+
+def _user_cache(cache_dir: Path) -> Path | None:
+    """Get the cache directory of the current user, or `None` if it is not safe to use.
+
+    Each user has their own directory, so that no user can plant an image that
+    another user's steps run.
+    """
+    path = cache_dir / str(os.getuid())
+    try:
+        path.mkdir(mode=0o700, exist_ok=True)
+        st = path.lstat()
+    except OSError:
+        return None
+
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o022:
+        return None
+
+    for sub in ("objects", "index", "locks"):
+        (path / sub).mkdir(mode=0o700, exist_ok=True)
+    return path
+
+
+def _evict(cache: Path, max_bytes: int, incoming: int) -> None:
+    """Remove the least recently used images until `incoming` more bytes fit the cache."""
+    objects = []
+    for entry in os.scandir(cache / "objects"):
+        if not entry.name.endswith(".sif"):
+            continue
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        objects.append((st.st_atime, st.st_size, entry.path))
+
+    total = sum(size for _, size, _ in objects)
+    for _, size, path in sorted(objects):
+        if total + incoming <= max_bytes:
+            break
+        os.unlink(path)
+        integrity.manifest_file(Path(path)).unlink(missing_ok=True)
+        total -= size
+
+    # Index entries of evicted images are dangling.
+    for entry in os.scandir(cache / "index"):
+        if not os.path.exists(entry.path):
+            os.unlink(entry.path)
+
+
+def _link(link: Path, target: Path) -> None:
+    """Atomically point a link at a target."""
+    tmp = link.with_name(f".{link.name}.{os.getpid()}.tmp")
+    tmp.unlink(missing_ok=True)
+    tmp.symlink_to(target)
+    os.replace(tmp, link)
+
+
+def _touch(obj: Path) -> None:
+    """Mark a cached image as recently used, so that it is evicted last.
+
+    Only the access time is updated, as the modification time of the image is part
+    of the stamp in its integrity manifest.
+    """
+    os.utime(obj, ns=(time.time_ns(), obj.stat().st_mtime_ns))
+
+
+def _copy(image: str, obj: Path, st: os.stat_result) -> None:
+    """Copy an image into the cache, unless it changes or is corrupted while it is copied.
+
+    The chunks of the image are hashed as they are read, and the copy is hashed
+    again before it is admitted to the cache, so that the source is only read once.
+    """
+    tmp = obj.with_name(f".{obj.name}.{os.getpid()}.tmp")
+    try:
+        chunks = integrity.copy(image, tmp)
+        after = os.stat(image)
+        if (after.st_size, after.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+            raise OSError(f"{image} changed while it was staged")
+        if corrupt := integrity.compare(tmp, chunks):
+            raise OSError(f"copy of {image} is corrupt in chunks {corrupt}")
+        os.chmod(tmp, 0o600)
+        integrity.save(tmp, chunks, target=obj)
+        os.replace(tmp, obj)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _verify(obj: Path) -> None:
+    """Remove a cached image if it is corrupt.
+
+    Only images that changed since they were admitted to the cache are hashed again.
+    """
+    try:
+        verified = integrity.verify(obj)
+    except integrity.IntegrityError as e:
+        raise OSError(e.message)
+
+    if verified.state == integrity.CORRUPT:
+        obj.unlink()
+        integrity.manifest_file(obj).unlink(missing_ok=True)
+        raise OSError(f"cached image {obj} is corrupt in chunks {verified.corrupt}")
+
+
+def stage(image: str, cmd: list[str]) -> list[str]:
+    """Run the step from a node-local copy of the image if it is on a network filesystem.
+
+    Images are copied once into the cache, and stored under a digest of their size
+    and partial contents so that copies of an image at different paths are cached
+    once. An index keyed by path, size, and modification time means that an image
+    is only read to compute its digest when it is new or has changed.
+
+    Args:
+        image: Image the step is launched from.
+        cmd: Launch command for the step.
+
+    Returns:
+        The launch command with the image replaced by its cached copy, otherwise
+        the unmodified launch command, e.g. if staging is not configured or failed.
+    """
+    try:
+        config = json.loads(STAGE_FILE.read_text())
+        st = os.stat(image)
+    except (OSError, ValueError):
+        return cmd
+
+    if image not in cmd or not stat.S_ISREG(st.st_mode):
+        return cmd
+    if (fs := NETWORK_FS_TYPES.get(fs_type(image) or 0)) is None:
+        return cmd
+
+    if (cache := _user_cache(Path(config["cache_dir"]))) is None:
+        log("stage-error", image, reason="unsafe cache directory")
+        return cmd
+
+    key = f"{os.path.realpath(image)}\0{st.st_size}\0{st.st_mtime_ns}"
+    index = cache / "index" / hashlib.sha256(key.encode()).hexdigest()
+    start = time.monotonic()
+    try:
+        if not index.exists():
+            obj = cache / "objects" / f"{partial_hash(image, st.st_size)}.sif"
+            if obj.exists():
+                _link(index, obj)
+            else:
+                if max_bytes := config.get("max_bytes", 0):
+                    _evict(cache, max_bytes, st.st_size)
+                _copy(image, obj, st)
+                _link(index, obj)
+                log(
+                    "stage-miss",
+                    image,
+                    fs=fs,
+                    bytes=st.st_size,
+                    seconds=round(time.monotonic() - start, 3),
+                )
+                return [str(obj) if arg == image else arg for arg in cmd]
+
+        obj = index.resolve()
+        _verify(obj)
+        _touch(obj)
+    except OSError as e:
+        log("stage-error", image, reason=str(e))
+        return cmd
+
+    log("stage-hit", image, fs=fs)
+    return [str(obj) if arg == image else arg for arg in cmd]
+
+
+def _pull_key(ref: str) -> str:
+    """Get the cache key of an image reference.
+
+    References pinned to a digest are keyed by the digest, so that the same image
+    pulled from different registries or mirrors is only stored once.
+    """
+    if "@sha256:" in ref:
+        return ref.rsplit("@sha256:", 1)[1]
+
+    return hashlib.sha256(ref.encode()).hexdigest()
+
+
+def _apptainer(cmd: list[str]) -> str:
+    """Get the `apptainer` executable of a launch command."""
+    return next((arg for arg in cmd if os.path.basename(arg) == "apptainer"), "apptainer")
+
+
+def _remove_partial(obj: Path) -> None:
+    """Remove images left behind by pulls whose process died before it finished."""
+    for tmp in obj.parent.glob(f".{obj.name}.*.tmp"):
+        try:
+            os.kill(int(tmp.name.split(".")[-2]), 0)
+        except ProcessLookupError:
+            tmp.unlink(missing_ok=True)
+        except (ValueError, OSError):
+            continue
+
+
+def _fresh(obj: Path, ttl: int | None, since: float = float("inf")) -> bool:
+    """Check if an image was pulled less than `ttl` seconds ago, or after `since`.
+
+    Images are always fresh if `ttl` is `None`.
+    """
+    try:
+        mtime = obj.stat().st_mtime
+    except FileNotFoundError:
+        return False
+
+    return ttl is None or time.time() - mtime < ttl or mtime >= since
+
+
+def _pull(apptainer: str, image: str, obj: Path) -> None:
+    """Pull an image into the cache, taking over from pulls that died."""
+    _remove_partial(obj)
+    tmp = obj.with_name(f".{obj.name}.{os.getpid()}.tmp")
+    try:
+        subprocess.run(
+            [apptainer, "pull", "--force", str(tmp), image], stdout=sys.stderr, check=True
+        )
+        os.chmod(tmp, 0o600)
+        # Steps that waited for the pull use the image by its modification time.
+        os.utime(tmp)
+        integrity.create(tmp, target=obj)
+        os.replace(tmp, obj)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def pull(image: str, cmd: list[str]) -> list[str]:
+    """Run the step from a node-local copy of a remote image, pulling it at most once.
+
+    Steps that launch the same remote image at the same time take a lock on the
+    image in the cache. The first step pulls the image, and the others wait for the
+    lock and then run the image it pulled. Locks are `flock(2)` locks, so the kernel
+    releases the lock of a step that dies while pulling, and the next step takes
+    over the pull after removing the partial image that was left behind.
+
+    Images pinned to a digest are kept in the cache until they are evicted. Images
+    referenced by tag are pulled again once they are older than the pull TTL, so
+    that steps launched after a tag moved run the new image.
+
+    Args:
+        image: Image reference the step is launched from.
+        cmd: Launch command for the step.
+
+    Returns:
+        The launch command with the image reference replaced by the pulled image,
+        otherwise the unmodified launch command, e.g. if the pull failed.
+    """
+    if not image.startswith(PULL_SCHEMES) or image not in cmd:
+        return cmd
+
+    try:
+        config = json.loads(STAGE_FILE.read_text())
+    except (OSError, ValueError):
+        return cmd
+
+    if (cache := _user_cache(Path(config["cache_dir"]))) is None:
+        log("pull-error", image, reason="unsafe cache directory")
+        return cmd
+
+    key = _pull_key(image)
+    obj = cache / "objects" / f"pull-{key}.sif"
+    ttl = None if "@sha256:" in image else config.get("pull_ttl", 0)
+    start, now = time.monotonic(), time.time()
+    try:
+        if _fresh(obj, ttl):
+            event = "pull-hit"
+        else:
+            fd = os.open(cache / "locks" / f"{key}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                # Another step pulled the image while this one waited for the lock.
+                if _fresh(obj, ttl, since=now):
+                    event = "pull-wait"
+                else:
+                    if max_bytes := config.get("max_bytes", 0):
+                        _evict(cache, max_bytes, 0)
+                    _pull(_apptainer(cmd), image, obj)
+                    event = "pull-miss"
+            finally:
+                os.close(fd)
+        if ttl is None:
+            _touch(obj)
+    except (OSError, subprocess.CalledProcessError) as e:
+        log("pull-error", image, reason=str(e))
+        return cmd
+
+    log(event, image, seconds=round(time.monotonic() - start, 3))
+    return [str(obj) if arg == image else arg for arg in cmd]
+
+
+def configure_staging(cache_dir: str, max_bytes: int = 0, pull_ttl: int = 0) -> None:
+    """Configure the launch wrapper to stage images on network filesystems.
+
+    Args:
+        cache_dir: Directory on node-local storage to cache images in. Staging is
+            disabled if empty.
+        max_bytes: Maximum size of the images cached for each user, or 0 for no limit.
+        pull_ttl: Seconds that images pulled by tag are reused for.
+    """
+    if not cache_dir:
+        STAGE_FILE.unlink(missing_ok=True)
+        return
+
+    # Users create their own cache directory, like in `/tmp`.
+    path = Path(cache_dir)
+    path.mkdir(parents=True, exist_ok=True)
+    path.chmod(0o1777)
+
+    tmp = STAGE_FILE.with_name(f".{STAGE_FILE.name}.tmp")
+    tmp.write_text(
+        json.dumps({"cache_dir": cache_dir, "max_bytes": max_bytes, "pull_ttl": pull_ttl})
+    )
+    tmp.chmod(0o644)
+    os.replace(tmp, STAGE_FILE)
+
+
+def install(source: Path = Path(__file__)) -> None:
+    """Install the launch wrapper on the unit and create the launch log."""
+    LIB_DIR.mkdir(parents=True, exist_ok=True)
+    shutil.copy(source, LIB_DIR / "launcher.py")
+    (LIB_DIR / "launcher.py").chmod(0o755)
+    for module in LIB_MODULES:
+        shutil.copy(source.parent / module, LIB_DIR / module)
+
+    tmp = BIN_FILE.with_name(f".{BIN_FILE.name}.tmp")
+    tmp.unlink(missing_ok=True)
+    tmp.symlink_to(LIB_DIR / "launcher.py")
+    os.replace(tmp, BIN_FILE)
+
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    rotate_log()
+
+
+def uninstall() -> None:
+    """Remove the launch wrapper, launch logs, and instance pool state from the unit."""
+    BIN_FILE.unlink(missing_ok=True)
+    shutil.rmtree(LIB_DIR, ignore_errors=True)
+    shutil.rmtree(STATE_DIR, ignore_errors=True)
+
+
+def _create_log() -> None:
+    """Create an empty launch log that every user can append to."""
+    fd = os.open(LAUNCH_LOG, os.O_WRONLY | os.O_CREAT, 0o666)
+    os.fchmod(fd, 0o666)
+    os.close(fd)
+
+
+def rotate_log(max_bytes: int = 16 * 1024**2) -> None:
+    """Rotate the launch log once it grows larger than `max_bytes`.
+
+    Only one rotated log is kept, so the launch log uses at most twice `max_bytes`.
+    """
+    try:
+        if LAUNCH_LOG.stat().st_size <= max_bytes:
+            return
+    except FileNotFoundError:
+        pass
+    else:
+        os.replace(LAUNCH_LOG, LAUNCH_LOG.with_name(f"{LAUNCH_LOG.name}.1"))
+
+    _create_log()
+
+
+def main(argv: list[str]) -> int:
+    """Rewrite the launch command and replace the current process with it.
+
+    Returns:
+        A non-zero exit code. `main` only returns if the arguments are invalid or
+        the command could not be executed. On success, the process is replaced.
+    """
+    if len(argv) < 3 or argv[1] != "--":
+        print("usage: apptainer-launch IMAGE -- COMMAND [ARGS...]", file=sys.stderr)
+        return 2
+
+    image, cmd = argv[0], argv[2:]
+    launch = pull(image, stage(image, pool(image, cmd)))
+    # Record the file the step reads the image from, so that it can be kept in page cache.
+    # Pool instances read the image they were started from.
+    path = next(
+        (arg for arg in launch if arg not in cmd and not arg.startswith("instance://")), image
+    )
+    log("launch", image, path=path)
+
+    try:
+        os.execvp(launch[0], launch)
+    except OSError as e:
+        print(f"apptainer-launch: {launch[0]}: {e.strerror}", file=sys.stderr)
+        # Exit codes of a shell for a command that is not found or not executable.
+        return 127 if isinstance(e, FileNotFoundError) else 126
+
+
+if __name__ == "__main__":  # pragma: nocover
+    # `main` only returns on failure, so a return value of 0 must not exit successfully.
+    sys.exit(main(sys.argv[1:]) or 1)
@@ -0,0 +1,218 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pre-create a pool of loop devices, so that container launches do not contend on them.
+
+`apptainer exec` mounts SIF images on loop devices. If no loop device is free, it
+asks the kernel for a new one through `/dev/loop-control` and waits for its device
+node, and launches that start at the same time serialize on this. With a pool of
+loop devices created at install and at every boot, launches only attach a free one.
+
+The pool is recreated at boot by a systemd unit that runs this module with the
+system Python interpreter, so it must only import from the standard library.
+"""
+
+import errno
+import fcntl
+import grp
+import os
+import shutil
+import stat
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+LOOP_MAJOR = 7
+# `ioctl` request of `/dev/loop-control` that adds the loop device of an index.
+LOOP_CTL_ADD = 0x4C80
+# Default of `max loop devices` in `apptainer.conf`.
+DEFAULT_MAX_LOOP_DEVICES = 256
+
+DEV = Path("/dev")
+SYS_BLOCK = Path("/sys/block")
+LIB_DIR = Path("/usr/local/lib/apptainer-operator")
+SYSTEMD_DIR = Path("/etc/systemd/system")
+UNIT_NAME = "apptainer-loop-pool.service"
+WANTED_BY = "multi-user.target"
+
+UNIT = """\
+[Unit]
+Description=Pre-create a pool of loop devices for Apptainer
+After=systemd-udevd.service systemd-modules-load.service
+
+[Service]
+Type=oneshot
+ExecStart=/usr/bin/python3 {script} create {size}
+
+[Install]
+WantedBy={wanted_by}
+"""
+
+
+@dataclass(frozen=True)
+class Usage:
+    """Usage of the loop device pool.
+
+    Attributes:
+        size: Number of loop devices in the pool.
+        present: Number of loop devices in the pool that have a device node.
+        attached: Number of loop devices in the pool that are attached to a file.
+    """
+
+    size: int
+    present: int
+    attached: int
+
+    @property
+    def free(self) -> int:
+        """Get the number of loop devices in the pool that are ready to be attached."""
+        return self.present - self.attached
+
+
+def _disk_gid() -> int:
+    """Get the group that owns block devices, or root if there is no `disk` group."""
+    try:
+        return grp.getgrnam("disk").gr_gid
+    except KeyError:
+        return 0
+
+
+def create(size: int, dev: Path = DEV) -> int:
+    """Create the loop devices `loop0` to `loop<size - 1>` that do not exist yet.
+
+    Each loop device is added to the kernel through `/dev/loop-control`, and its
+    device node is created if `devtmpfs` did not, e.g. in a `/dev` that is not
+    `devtmpfs`.
+
+    Args:
+        size: Number of loop devices in the pool.
+        dev: Directory the device nodes are created in.
+
+    Returns:
+        The number of device nodes that were created.
+
+    Raises:
+        OSError: Raised if a loop device could not be created.
+    """
+    ctl = None
+    if (dev / "loop-control").exists():
+        ctl = os.open(dev / "loop-control", os.O_RDWR | os.O_CLOEXEC)
+
+    created = 0
+    gid = _disk_gid()
+    try:
+        for n in range(size):
+            if ctl is not None:
+                try:
+                    fcntl.ioctl(ctl, LOOP_CTL_ADD, n)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+
+            if (path := dev / f"loop{n}").exists():
+                continue
+            os.mknod(path, 0o660 | stat.S_IFBLK, os.makedev(LOOP_MAJOR, n))
+            os.chown(path, 0, gid)
+            created += 1
+    finally:
+        if ctl is not None:
+            os.close(ctl)
+
+    return created
+
+
+def usage(size: int, dev: Path = DEV, sys_block: Path = SYS_BLOCK) -> Usage:
+    """Get the usage of the loop device pool.
+
+    Args:
+        size: Number of loop devices in the pool.
+        dev: Directory of the device nodes.
+        sys_block: Directory the kernel lists block devices in.
+    """
+    present = attached = 0
+    for n in range(size):
+        present += (dev / f"loop{n}").exists()
+        # The kernel only lists the backing file of loop devices that are attached.
+        attached += (sys_block / f"loop{n}" / "loop" / "backing_file").exists()
+
+    return Usage(size=size, present=present, attached=attached)
+
+
+def max_loop_devices(size: int) -> int:
+    """Get the `max loop devices` of `apptainer.conf` that covers a pool of `size`."""
+    return max(size, DEFAULT_MAX_LOOP_DEVICES)
+
+
+def install(
+    size: int,
+    source: Path = Path(__file__),
+    lib_dir: Path = LIB_DIR,
+    systemd_dir: Path = SYSTEMD_DIR,
+) -> None:
+    """Install the systemd unit that recreates the loop device pool at boot.
+
+    The unit is enabled by linking it into the `.wants` directory of its target,
+    as `systemctl enable` would, so that it runs at the next boot.
+
+    Args:
+        size: Number of loop devices in the pool.
+        source: This module, which the unit runs.
+        lib_dir: Directory this module is installed in.
+        systemd_dir: Directory the unit is installed in.
+
+    Raises:
+        OSError: Raised if the unit could not be installed.
+    """
+    lib_dir.mkdir(parents=True, exist_ok=True)
+    shutil.copy(source, lib_dir / "loopdev.py")
+
+    unit = systemd_dir / UNIT_NAME
+    tmp = unit.with_name(f".{unit.name}.tmp")
+    tmp.write_text(UNIT.format(script=lib_dir / "loopdev.py", size=size, wanted_by=WANTED_BY))
+    os.replace(tmp, unit)
+
+    wants = systemd_dir / f"{WANTED_BY}.wants"
+    wants.mkdir(exist_ok=True)
+    if not (wants / UNIT_NAME).is_symlink():
+        (wants / UNIT_NAME).symlink_to(unit)
+
+
+def uninstall(lib_dir: Path = LIB_DIR, systemd_dir: Path = SYSTEMD_DIR) -> None:
+    """Remove the systemd unit that recreates the loop device pool at boot.
+
+    Loop devices that were created are left in place, as they may be attached.
+    """
+    (systemd_dir / f"{WANTED_BY}.wants" / UNIT_NAME).unlink(missing_ok=True)
+    (systemd_dir / UNIT_NAME).unlink(missing_ok=True)
+    (lib_dir / "loopdev.py").unlink(missing_ok=True)
+
+
+def main(argv: list[str]) -> int:
+    """Create the loop device pool: `loopdev.py create SIZE`."""
+    if len(argv) != 2 or argv[0] != "create" or not argv[1].isdigit():
+        print("usage: loopdev.py create SIZE", file=sys.stderr)
+        return 2
+
+    try:
+        created = create(int(argv[1]))
+    except OSError as e:
+        print(f"failed to create loop devices. reason: {e}", file=sys.stderr)
+        return 1
+
+    print(f"created {created} of {argv[1]} loop devices")
+    return 0
+
+
+if __name__ == "__main__":  # pragma: nocover
+    sys.exit(main(sys.argv[1:]))
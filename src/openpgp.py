@@ -0,0 +1,231 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Import ASCII-armored OpenPGP public keys into apt without forking `gpg`.
+
+`apt.import_key` runs `gpg` twice to fingerprint and dearmor a key. The armor
+decoding (RFC 4880 section 6) and v4 fingerprint (RFC 4880 section 12.2) are
+simple enough to compute directly, so `gpg` is only used for keys that cannot be
+handled here, such as v5 keys. `gpg` is then run with a timeout in a throwaway home
+directory, so it neither hangs the hook nor touches the keyrings of the unit.
+"""
+
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import struct
+import subprocess
+import tempfile
+from pathlib import Path
+
+import charms.operator_libs_linux.v0.apt as apt
+
+import runner
+
+_logger = logging.getLogger(__name__)
+
+_BEGIN = "-----BEGIN PGP PUBLIC KEY BLOCK-----"
+_END = "-----END PGP PUBLIC KEY BLOCK-----"
+_CRC24_INIT = 0xB704CE
+_CRC24_POLY = 0x1864CFB
+_PUBLIC_KEY_TAG = 6
+
+TRUSTED_GPG_DIR = Path("/etc/apt/trusted.gpg.d")
+
+
+class OpenPGPError(Exception):
+    """Exception raised when an OpenPGP key could not be decoded."""
+
+    @property
+    def message(self) -> str:
+        """Return message passed as argument to exception."""
+        return self.args[0]
+
+
+def crc24(data: bytes) -> int:
+    """Compute the CRC-24 checksum of the data in an ASCII-armored block."""
+    crc = _CRC24_INIT
+    for byte in data:
+        crc ^= byte << 16
+        for _ in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= _CRC24_POLY
+
+    return crc & 0xFFFFFF
+
+
+def dearmor(key: str) -> bytes:
+    """Decode an ASCII-armored public key block into its binary form.
+
+    The result is byte-identical to the output of `gpg --dearmor`.
+
+    Raises:
+        OpenPGPError: Raised if the armor is malformed or its checksum does not match.
+    """
+    lines = [line.strip() for line in key.strip().splitlines()]
+    try:
+        body = lines[lines.index(_BEGIN) + 1 : lines.index(_END)]
+    except ValueError:
+        raise OpenPGPError("ASCII armor markers missing from OpenPGP key")
+
+    # Armor headers end at the first blank line. Some key servers write `.` instead.
+    for i, line in enumerate(body):
+        if line in ("", "."):
+            body = body[i + 1 :]
+            break
+        if ": " not in line:
+            break
+
+    checksum = None
+    if body and body[-1].startswith("=") and len(body[-1]) == 5:
+        checksum = body.pop()
+
+    try:
+        data = base64.b64decode("".join(body), validate=True)
+        expected = (
+            int.from_bytes(base64.b64decode(checksum[1:], validate=True), "big")
+            if checksum
+            else None
+        )
+    except binascii.Error as e:
+        raise OpenPGPError(f"invalid radix-64 data in OpenPGP key. reason: {e}")
+
+    if expected is not None and crc24(data) != expected:
+        raise OpenPGPError(f"OpenPGP key checksum mismatch: {crc24(data):06x} != {expected:06x}")
+
+    return data
+
+
+def _packet(data: bytes) -> tuple[int, bytes]:
+    """Get the tag and body of the first packet in binary OpenPGP data."""
+    if not data or not data[0] & 0x80:
+        raise OpenPGPError("invalid OpenPGP packet header")
+
+    header = data[0]
+    if header & 0x40:
+        # New format packet header.
+        tag, first = header & 0x3F, data[1]
+        if first < 192:
+            offset, length = 2, first
+        elif first < 224:
+            offset, length = 3, ((first - 192) << 8) + data[2] + 192
+        elif first == 255:
+            offset, length = 6, struct.unpack(">I", data[2:6])[0]
+        else:
+            raise OpenPGPError("partial body lengths are not valid for key packets")
+    else:
+        # Old format packet header.
+        tag, length_type = (header >> 2) & 0x0F, header & 0x03
+        if length_type == 3:
+            raise OpenPGPError("indeterminate lengths are not valid for key packets")
+        size = 1 << length_type
+        offset, length = 1 + size, int.from_bytes(data[1 : 1 + size], "big")
+
+    body = data[offset : offset + length]
+    if len(body) != length:
+        raise OpenPGPError("truncated OpenPGP packet")
+
+    return tag, body
+
+
+def fingerprint(data: bytes) -> str:
+    """Compute the fingerprint of the primary key in a binary OpenPGP public key block.
+
+    Raises:
+        OpenPGPError: Raised if the block does not start with a v4 public key packet.
+    """
+    try:
+        tag, body = _packet(data)
+    except (IndexError, struct.error):
+        raise OpenPGPError("truncated OpenPGP packet header")
+
+    if tag != _PUBLIC_KEY_TAG:
+        raise OpenPGPError(f"expected a public key packet, got packet with tag {tag}")
+    if not body:
+        raise OpenPGPError("empty OpenPGP public key packet")
+    if body[0] != 4:
+        raise OpenPGPError(f"unsupported OpenPGP key version {body[0]}")
+
+    return hashlib.sha1(b"\x99" + struct.pack(">H", len(body)) + body).hexdigest().upper()
+
+
+def _gpg(key: str) -> tuple[bytes, str]:
+    """Dearmor and fingerprint a key with `gpg`, for keys that cannot be decoded here.
+
+    Raises:
+        GPGKeyError: Raised if `gpg` failed to dearmor the key or found no key in it.
+        CommandTimeoutError: Raised if `gpg` did not finish in time.
+    """
+    with tempfile.TemporaryDirectory() as home:
+        armored, keyring = Path(home) / "key.asc", Path(home) / "key.gpg"
+        # `gpg` only accepts a blank line after the armor headers, not the `.` that
+        # some key servers write.
+        lines = ["" if line.strip() == "." else line for line in key.strip().splitlines()]
+        armored.write_text("\n".join(lines) + "\n")
+        gpg = ["gpg", "--homedir", home, "--batch", "--yes"]
+        try:
+            runner.run([*gpg, "--dearmor", "--output", str(keyring), str(armored)])
+            listing = runner.run([*gpg, "--with-colons", "--show-keys", str(keyring)]).stdout
+            data = keyring.read_bytes()
+        except (OSError, subprocess.CalledProcessError) as e:
+            stderr = getattr(e, "stderr", "") or ""
+            raise apt.GPGKeyError(f"failed to import key with gpg. reason: {e} {stderr}")
+
+    # The first fingerprint listed is that of the primary key.
+    fingerprints = [f.split(":")[9] for f in listing.splitlines() if f.startswith("fpr:")]
+    if not fingerprints:
+        raise apt.GPGKeyError("failed to import key with gpg. reason: no public key found")
+
+    return data, fingerprints[0]
+
+
+def import_key(key: str, key_dir: Path = TRUSTED_GPG_DIR) -> Path:
+    """Write an ASCII-armored public key to apt's trusted keyring directory.
+
+    The key is written as `<fingerprint>.gpg`, as `apt.import_key` would write it,
+    and is only rewritten if its contents have changed. `gpg` is used as a fallback
+    for keys that cannot be decoded here.
+
+    Returns:
+        Path to the binary keyring file.
+
+    Raises:
+        GPGKeyError: Raised if `gpg` failed to import a key that could not be decoded here.
+        CommandTimeoutError: Raised if `gpg` did not finish in time.
+        OSError: Raised if the keyring file could not be written.
+    """
+    try:
+        data = dearmor(key)
+        fpr = fingerprint(data)
+    except OpenPGPError as e:
+        _logger.warning("falling back to gpg to import key. reason: %s", e.message)
+        data, fpr = _gpg(key)
+
+    file = key_dir / f"{fpr}.gpg"
+
+    try:
+        if file.read_bytes() == data:
+            return file
+    except FileNotFoundError:
+        pass
+
+    _logger.info("writing OpenPGP key %s to %s", file.stem, file)
+    tmp = file.with_name(f".{file.name}.tmp")
+    tmp.write_bytes(data)
+    tmp.chmod(0o644)
+    os.replace(tmp, file)
+    return file
@@ -0,0 +1,208 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Manage a pool of pre-started Apptainer instances for short-lived job steps."""
+
+import hashlib
+import json
+import logging
+import os
+import subprocess
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+
+import apptainer
+import launcher
+import runner
+
+_logger = logging.getLogger(__name__)
+
+INSTANCE_PREFIX = "apptainer-pool-"
+
+
+class PoolError(Exception):
+    """Exception raised when the instance pool could not be managed."""
+
+    @property
+    def message(self) -> str:
+        """Return message passed as argument to exception."""
+        return self.args[0]
+
+
+@dataclass(frozen=True)
+class PoolStats:
+    """Hit-rate metrics of the instance pool."""
+
+    hits: int
+    misses: int
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of launches of pooled images that ran inside a pool instance."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def instance_names(image: str, size: int) -> list[str]:
+    """Get the names of the pool instances of an image."""
+    digest = hashlib.sha1(os.path.realpath(image).encode()).hexdigest()[:8]
+    return [f"{INSTANCE_PREFIX}{digest}-{i}" for i in range(size)]
+
+
+def _apptainer(user: str, *args: str) -> str:
+    """Run the `apptainer` of the active install as `user`."""
+    cmd = ["runuser", "-u", user, "--", apptainer.binary(), *args]
+    try:
+        result = runner.run(cmd, runner.CONTAINER)
+    except runner.CommandTimeoutError as e:
+        raise PoolError(e.message)
+    except (OSError, subprocess.CalledProcessError) as e:
+        stderr = getattr(e, "stderr", "") or ""
+        raise PoolError(f"command `apptainer {' '.join(args)}` failed. reason: {e} {stderr}")
+
+    return result.stdout
+
+
+def _instances(user: str) -> dict[str, int]:
+    """Get the PID of each pool instance running as `user`, keyed by instance name."""
+    try:
+        instances = json.loads(_apptainer(user, "instance", "list", "--json"))["instances"]
+        return {
+            i["instance"]: int(i.get("pid", 0))
+            for i in instances
+            if i["instance"].startswith(INSTANCE_PREFIX)
+        }
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise PoolError(f"failed to list running instances. reason: {e}")
+
+
+def running(user: str) -> set[str]:
+    """Get the names of the pool instances running as `user`."""
+    return set(_instances(user))
+
+
+def pids(user: str) -> set[int]:
+    """Get the PIDs of the pool instances running as `user`.
+
+    Pool instances are managed by the charm, so they are told apart from the
+    containers of jobs by their PIDs.
+    """
+    return {pid for pid in _instances(user).values() if pid}
+
+
+def _stop_previous(user: str, pool_file: Path) -> None:
+    """Stop the pool instances of the user the pool last ran as, if it was another user.
+
+    Instances of a user are only listed as that user, so the instances of a previous
+    pool user would keep running after the pool user is changed.
+    """
+    try:
+        previous = json.loads(pool_file.read_text()).get("user", "")
+    except (OSError, ValueError, AttributeError):
+        return
+
+    if not previous or previous == user:
+        return
+
+    try:
+        names = running(previous)
+    except PoolError as e:
+        _logger.warning(e.message)
+        return
+
+    for name in sorted(names):
+        _logger.info("stopping pool instance %s of previous pool user %s", name, previous)
+        try:
+            _apptainer(previous, "instance", "stop", name)
+        except PoolError as e:
+            _logger.warning(e.message)
+
+
+def reconcile(
+    images: list[str], size: int, user: str, flags: list[str], pool_file: Path = launcher.POOL_FILE
+) -> dict[str, list[str]]:
+    """Start and stop pool instances so that each image has `size` running instances.
+
+    Args:
+        images: Allow-listed images to keep instances of.
+        size: Number of instances to keep per image. The pool is drained if 0.
+        user: User the instances run as. Only this user's steps run inside the pool,
+            and the pool is drained if unset. The instances of the previous user in
+            `pool_file` are stopped if the user changed.
+        flags: Runtime flags to start the instances with.
+        pool_file: File the launch wrapper reads the pool from.
+
+    Returns:
+        Mapping of resolved image paths to their running pool instances.
+
+    Raises:
+        PoolError: Raised if the running instances could not be listed, or the pool
+            could not be written to `pool_file`.
+    """
+    _stop_previous(user, pool_file)
+    current = running(user) if user else set()
+    desired = (
+        {os.path.realpath(image): instance_names(image, size) for image in images} if user else {}
+    )
+    wanted = {name for names in desired.values() for name in names}
+
+    for name in sorted(current - wanted):
+        _logger.info("stopping pool instance %s", name)
+        try:
+            _apptainer(user, "instance", "stop", name)
+        except PoolError as e:
+            _logger.warning(e.message)
+
+    pool = {}
+    for image, names in desired.items():
+        pool[image] = []
+        for name in names:
+            if name not in current:
+                _logger.info("starting pool instance %s of image %s", name, image)
+                try:
+                    _apptainer(user, "instance", "start", *flags, image, name)
+                except PoolError as e:
+                    _logger.warning(e.message)
+                    continue
+
+            pool[image].append(name)
+
+    try:
+        tmp = pool_file.with_name(f".{pool_file.name}.tmp")
+        tmp.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_text(json.dumps({"user": user, "instances": pool}))
+        tmp.chmod(0o644)
+        os.replace(tmp, pool_file)
+    except OSError as e:
+        raise PoolError(f"failed to write instance pool to {pool_file}. reason: {e}")
+
+    return pool
+
+
+def stats(launch_log: Path = launcher.LAUNCH_LOG) -> PoolStats:
+    """Count pool hits and misses recorded in the current and rotated launch logs."""
+    events = Counter()
+    for log in (launch_log.with_name(f"{launch_log.name}.1"), launch_log):
+        try:
+            with log.open() as f:
+                for line in f:
+                    try:
+                        events[json.loads(line)["event"]] += 1
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            continue
+
+    return PoolStats(hits=events["pool-hit"], misses=events["pool-miss"])
@@ -0,0 +1,199 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Enumerate the Apptainer containers running on the unit from `/proc`.
+
+`/proc` is scanned once. Only `stat` is read for every process; `cmdline` and
+`cgroup` are read only for the processes that belong to a container.
+"""
+
+import os
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+_CLK_TCK = os.sysconf("SC_CLK_TCK")
+_slurm_step = re.compile(r"/job_(\d+)/step_([^/]+)")
+
+# Each container is supervised by an Apptainer `starter` process, which renames
+# itself to `Apptainer runtime parent` (truncated to 15 bytes in `comm`).
+STARTERS = ("starter", "starter-suid", "Apptainer runti")
+
+
+@dataclass(frozen=True)
+class Process:
+    """Process read from `/proc/<pid>/stat`."""
+
+    pid: int
+    ppid: int
+    comm: str
+    rss: int
+    cpu_time: float
+
+
+@dataclass
+class Container:
+    """Running Apptainer container.
+
+    Attributes:
+        pid: PID of the outermost `starter` process of the container.
+        job: Slurm job step the container was launched by, e.g. `1234.0`, if any.
+        command: Command line of the containerised process.
+        processes: Processes of the container, including its `starter` processes.
+    """
+
+    pid: int
+    job: str | None = None
+    command: str = ""
+    processes: list[Process] = field(default_factory=list)
+
+    @property
+    def rss(self) -> int:
+        """Resident memory of the container in bytes."""
+        return sum(p.rss for p in self.processes)
+
+    @property
+    def cpu_time(self) -> float:
+        """User and system CPU time consumed by the container in seconds."""
+        return sum(p.cpu_time for p in self.processes)
+
+    def dict(self) -> dict[str, str]:
+        """Get the container as action results."""
+        return {
+            "job": self.job or "",
+            "command": self.command,
+            "processes": str(len(self.processes)),
+            "rss-mib": f"{self.rss / 1024**2:.1f}",
+            "cpu-seconds": f"{self.cpu_time:.1f}",
+        }
+
+
+def _read(path: str) -> bytes:
+    """Read a small file from `/proc` in a single system call."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, 65536)
+    finally:
+        os.close(fd)
+
+
+def _parse_stat(stat: bytes) -> Process:
+    """Parse the contents of `/proc/<pid>/stat`."""
+    # `comm` may contain spaces and parentheses, so split around its last `)`.
+    pid, _, rest = stat.partition(b" (")
+    comm, _, rest = rest.rpartition(b") ")
+    fields = rest.split()
+    return Process(
+        pid=int(pid),
+        ppid=int(fields[1]),
+        comm=comm.decode(errors="replace"),
+        rss=int(fields[21]) * _PAGE_SIZE,
+        cpu_time=(int(fields[11]) + int(fields[12])) / _CLK_TCK,
+    )
+
+
+def _job(cgroup: bytes) -> str | None:
+    """Get the Slurm job step of a process from its `/proc/<pid>/cgroup`."""
+    if match := _slurm_step.search(cgroup.decode(errors="replace")):
+        return f"{match[1]}.{match[2]}"
+
+    return None
+
+
+def _container(
+    pid: int,
+    processes: dict[int, Process],
+    children: dict[int, list[int]],
+    starters: set[int],
+    proc: Path,
+) -> Container:
+    """Collect the processes of the container supervised by a `starter` process."""
+    container = Container(pid=pid)
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        container.processes.append(processes[current])
+        stack.extend(children.get(current, []))
+        if container.command or current in starters:
+            continue
+        try:
+            cmdline = _read(f"{proc}/{current}/cmdline")
+        except OSError:
+            continue
+        container.command = cmdline.rstrip(b"\0").replace(b"\0", b" ").decode(errors="replace")
+
+    try:
+        container.job = _job(_read(f"{proc}/{pid}/cgroup"))
+    except OSError:
+        pass
+
+    return container
+
+
+def scan(proc: Path = Path("/proc")) -> list[Container]:
+    """Get the Apptainer containers running on the unit.
+
+    Args:
+        proc: Mount point of `procfs`.
+
+    Returns:
+        Running containers, ordered by the PID of their outermost `starter` process.
+    """
+    processes: dict[int, Process] = {}
+    children: defaultdict[int, list[int]] = defaultdict(list)
+    starters = set()
+    with os.scandir(proc) as entries:
+        for entry in entries:
+            if not entry.name.isdigit():
+                continue
+            try:
+                stat = _read(f"{entry.path}/stat")
+                process = _parse_stat(stat)
+            except (OSError, ValueError, IndexError):
+                # The process exited while `/proc` was being scanned.
+                continue
+
+            processes[process.pid] = process
+            children[process.ppid].append(process.pid)
+            if process.comm in STARTERS:
+                starters.add(process.pid)
+
+    return [
+        _container(pid, processes, children, starters, proc)
+        for pid in sorted(starters)
+        if processes[pid].ppid not in starters
+    ]
+
+
+def executables(proc: Path = Path("/proc")) -> set[Path]:
+    """Get the executables of every process running on the unit.
+
+    Args:
+        proc: Mount point of `procfs`.
+    """
+    exes = set()
+    with os.scandir(proc) as entries:
+        for entry in entries:
+            if not entry.name.isdigit():
+                continue
+            try:
+                exe = os.readlink(f"{entry.path}/exe")
+            except OSError:
+                # Kernel threads have no executable, and processes may exit mid-scan.
+                continue
+            exes.add(Path(exe.removesuffix(" (deleted)")))
+
+    return exes
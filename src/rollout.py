@@ -0,0 +1,85 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Plan rolling upgrades of Apptainer across the units of the application."""
+
+import json
+import uuid
+from dataclasses import asdict, dataclass, field
+
+
+@dataclass
+class Rollout:
+    """Rolling upgrade of the application, coordinated by the leader unit.
+
+    Units are upgraded in batches. A batch is drained, upgraded, and then resumed
+    once every unit in it has upgraded. At most `concurrency` batches are in
+    progress at once, so the upgrade throughput of the application is
+    `batch_size * concurrency` units at a time.
+
+    Attributes:
+        id: Unique identifier of the rolling upgrade.
+        batches: Names of the units in each batch, in upgrade order.
+        concurrency: Maximum number of batches in progress at once.
+        drained: Indices of the batches that have been drained.
+        resumed: Indices of the batches that have been resumed.
+        held: State and reason of the Slurm nodes that were already out of service
+            when their batch was drained, keyed by node name. These nodes are left
+            as they were, and are not resumed.
+    """
+
+    id: str
+    batches: list[list[str]]
+    concurrency: int = 1
+    drained: list[int] = field(default_factory=list)
+    resumed: list[int] = field(default_factory=list)
+    held: dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def plan(cls, units: list[str], batch_size: int, concurrency: int) -> "Rollout":
+        """Plan a rolling upgrade of `units` in batches of `batch_size` units."""
+        units = sorted(units, key=lambda unit: int(unit.rsplit("/", 1)[-1]))
+        batches = [units[i : i + batch_size] for i in range(0, len(units), batch_size)]
+        return cls(id=uuid.uuid4().hex[:8], batches=batches, concurrency=concurrency)
+
+    @classmethod
+    def from_json(cls, data: str) -> "Rollout":
+        """Load a rolling upgrade from JSON."""
+        return cls(**json.loads(data))
+
+    def json(self) -> str:
+        """Dump the rolling upgrade as JSON."""
+        return json.dumps(asdict(self))
+
+    def complete(self, index: int, upgraded: set[str]) -> bool:
+        """Check if every unit in a batch has upgraded."""
+        return set(self.batches[index]) <= upgraded
+
+    def active(self, upgraded: set[str]) -> list[int]:
+        """Get the indices of the batches that should be in progress.
+
+        Args:
+            upgraded: Names of the units that have completed the upgrade.
+        """
+        pending = [i for i in range(len(self.batches)) if not self.complete(i, upgraded)]
+        return pending[: self.concurrency]
+
+    def authorized(self, unit: str) -> bool:
+        """Check if a unit is in a drained batch that has not been resumed yet."""
+        return any(unit in self.batches[i] for i in self.drained if i not in self.resumed)
+
+    @property
+    def finished(self) -> bool:
+        """Check if every batch has been resumed."""
+        return len(self.resumed) == len(self.batches)
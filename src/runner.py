@@ -0,0 +1,155 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run external commands with timeouts.
+
+A hung mirror, a stuck NFS mount on `$PATH`, or a wedged `dpkg` would otherwise
+block the Juju agent of the unit indefinitely. Every command gets a timeout from
+the class of work it does. Commands run in their own process group so that the
+whole group, including children such as `dpkg` under `apt-get`, is killed if the
+timeout expires.
+"""
+
+import logging
+import os
+import shlex
+import signal
+import subprocess
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+_logger = logging.getLogger(__name__)
+
+# Classes of commands, and the time in seconds each class is allowed to run for.
+QUERY = "query"
+SYSTEM = "system"
+CONTAINER = "container"
+PACKAGE = "package"
+TIMEOUTS = {QUERY: 30.0, SYSTEM: 120.0, CONTAINER: 600.0, PACKAGE: 1800.0}
+# Time in seconds a process group has to exit after `SIGTERM` before it is killed.
+KILL_GRACE = 5.0
+
+
+class CommandTimeoutError(Exception):
+    """Exception raised when an external command did not finish in time."""
+
+    def __init__(self, cmd: list[str], timeout: float) -> None:
+        super().__init__(f"command `{shlex.join(cmd)}` timed out after {timeout:g}s")
+        self.cmd = cmd
+        self.timeout = timeout
+
+    @property
+    def message(self) -> str:
+        """Return message passed as argument to exception."""
+        return self.args[0]
+
+    @property
+    def name(self) -> str:
+        """Get the name of the command that timed out."""
+        return Path(self.cmd[0]).name
+
+
+def _kill(proc: subprocess.Popen) -> None:
+    """Terminate the process group of a process, and kill it if it does not exit."""
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            return
+        try:
+            proc.wait(timeout=KILL_GRACE)
+            return
+        except subprocess.TimeoutExpired:
+            continue
+
+
+@contextmanager
+def popen(
+    cmd: list[str], kind: str = QUERY, timeout: float | None = None, **kwargs
+) -> Iterator[subprocess.Popen]:
+    """Start a command in its own process group, and kill the group if it times out.
+
+    Args:
+        cmd: Command to run.
+        kind: Class of the command, used to look up its timeout in `TIMEOUTS`.
+        timeout: Time in seconds the command may run for. Overrides `kind`.
+        **kwargs: Keyword arguments to pass to `subprocess.Popen`.
+
+    Raises:
+        CommandTimeoutError: Raised on exit if the command was killed on timeout.
+        OSError: Raised if the command could not be started.
+    """
+    timeout = TIMEOUTS[kind] if timeout is None else timeout
+    proc = subprocess.Popen(cmd, start_new_session=True, **kwargs)
+    expired = threading.Event()
+
+    def _expire() -> None:
+        expired.set()
+        _logger.warning("command `%s` timed out after %gs. killing it", shlex.join(cmd), timeout)
+        _kill(proc)
+
+    watchdog = threading.Timer(timeout, _expire)
+    watchdog.daemon = True
+    watchdog.start()
+    try:
+        with proc:
+            yield proc
+    finally:
+        watchdog.cancel()
+        if expired.is_set():
+            raise CommandTimeoutError(cmd, timeout)
+
+
+def run(
+    cmd: list[str],
+    kind: str = QUERY,
+    timeout: float | None = None,
+    check: bool = True,
+    env: dict[str, str] | None = None,
+    cwd: Path | None = None,
+) -> subprocess.CompletedProcess[str]:
+    """Run a command to completion and capture its output.
+
+    Args:
+        cmd: Command to run.
+        kind: Class of the command, used to look up its timeout in `TIMEOUTS`.
+        timeout: Time in seconds the command may run for. Overrides `kind`.
+        check: Raise `CalledProcessError` if the command exits non-zero.
+        env: Environment of the command. Defaults to the environment of the charm.
+        cwd: Working directory of the command. Defaults to the charm's working directory.
+
+    Raises:
+        CommandTimeoutError: Raised if the command did not finish in time.
+        CalledProcessError: Raised if `check` is set and the command failed.
+        OSError: Raised if the command could not be started.
+    """
+    with popen(
+        cmd,
+        kind,
+        timeout,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        env=env,
+        cwd=cwd,
+    ) as proc:
+        stdout, stderr = proc.communicate()
+
+    result = subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+    if check:
+        result.check_returncode()
+
+    return result
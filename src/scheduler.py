@@ -0,0 +1,106 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Schedule custom charm events with one-shot systemd timers.
+
+A scheduled event is dispatched to the charm by `juju-exec` when the timer fires,
+so a retry runs at its backoff deadline instead of waiting for an unrelated hook
+to re-emit a deferred event.
+"""
+
+import logging
+import random
+import shlex
+import subprocess
+from pathlib import Path
+
+import runner
+
+_logger = logging.getLogger(__name__)
+
+JUJU_EXEC = "/usr/bin/juju-exec"
+
+
+class SchedulerError(Exception):
+    """Exception raised when a charm event could not be scheduled."""
+
+    @property
+    def message(self) -> str:
+        """Return message passed as argument to exception."""
+        return self.args[0]
+
+
+def timer_name(unit: str, event: str) -> str:
+    """Get the name of the systemd unit that dispatches `event` to `unit`."""
+    return f"juju-{unit.replace('/', '-')}-{event}"
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """Get an exponential backoff delay with jitter for a retry attempt.
+
+    Args:
+        attempt: Number of failed attempts so far, starting from 1.
+        base: Delay in seconds after the first failed attempt.
+        cap: Maximum delay in seconds.
+    """
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return random.uniform(delay / 2, delay)
+
+
+def cancel(unit: str, event: str) -> None:
+    """Cancel a scheduled event if it has not fired yet."""
+    name = timer_name(unit, event)
+    for cmd in (["systemctl", "stop", f"{name}.timer"], ["systemctl", "reset-failed", name]):
+        try:
+            runner.run(cmd, runner.SYSTEM, check=False)
+        except (OSError, runner.CommandTimeoutError) as e:
+            _logger.debug("failed to run `%s`. reason: %s", shlex.join(cmd), e)
+
+
+def schedule(unit: str, event: str, delay: float, charm_dir: Path) -> None:
+    """Dispatch a custom charm event once `delay` seconds have passed.
+
+    Any event of the same name that is already scheduled is replaced.
+
+    Args:
+        unit: Name of the unit to dispatch the event to, e.g. `apptainer/0`.
+        event: Name of the custom event to dispatch, e.g. `install-retry`.
+        delay: Time in seconds to wait before dispatching the event.
+        charm_dir: Directory of the charm on the unit.
+
+    Raises:
+        SchedulerError: Raised if the timer could not be started.
+    """
+    name = timer_name(unit, event)
+    dispatch = f"JUJU_DISPATCH_PATH=hooks/{event} {shlex.quote(str(charm_dir / 'dispatch'))}"
+    cmd = [
+        "systemd-run",
+        f"--unit={name}",
+        f"--description=Dispatch {event} event to {unit}",
+        f"--on-active={max(delay, 1):.0f}s",
+        "--timer-property=AccuracySec=1s",
+        JUJU_EXEC,
+        unit,
+        dispatch,
+    ]
+
+    cancel(unit, event)
+    _logger.info("scheduling %s event for %s in %.0fs", event, unit, delay)
+    try:
+        runner.run(cmd, runner.SYSTEM)
+    except runner.CommandTimeoutError as e:
+        raise SchedulerError(f"failed to schedule {event} event. reason: {e.message}")
+    except (OSError, subprocess.CalledProcessError) as e:
+        stderr = getattr(e, "stderr", "") or ""
+        raise SchedulerError(f"failed to schedule {event} event. reason: {e} {stderr}".strip())
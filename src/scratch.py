@@ -0,0 +1,147 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Manage node-local scratch storage for Apptainer temporary files."""
+
+import logging
+import os
+import re
+import subprocess
+import time
+from pathlib import Path
+
+import runner
+
+_logger = logging.getLogger(__name__)
+_size = re.compile(r"^\d+[kmgKMG%]?$")
+
+
+class ScratchError(Exception):
+    """Exception raised when scratch storage could not be set up on the unit."""
+
+    @property
+    def message(self) -> str:
+        """Return message passed as argument to exception."""
+        return self.args[0]
+
+
+def _mount_options(path: Path) -> tuple[str, str] | None:
+    """Get the filesystem type and super block options of the mount at `path`."""
+    with open("/proc/self/mountinfo") as f:
+        for line in f:
+            # Format: id parent dev root mount-point options [tags...] - type source options
+            fields, _, rest = line.partition(" - ")
+            if fields.split()[4] == str(path):
+                fstype, _, options = rest.split()[:3]
+                return fstype, options
+
+    return None
+
+
+def setup(path: Path, size: str = "") -> None:
+    """Set up a directory for Apptainer temporary files.
+
+    The directory is world-writable with the sticky bit set, like `/tmp`, so that
+    every user launching containers can use it.
+
+    Args:
+        path: Directory on node-local storage, such as an NVMe mount.
+        size: If set, mount a tmpfs capped to this size at `path`, e.g. `64G` or `50%`.
+
+    Raises:
+        ScratchError: Raised if the directory or tmpfs could not be set up.
+    """
+    if size and not _size.match(size):
+        raise ScratchError(f"invalid scratch size `{size}`. expected a size like `64G` or `50%`")
+
+    try:
+        path.mkdir(parents=True, exist_ok=True)
+        if size:
+            mount = _mount_options(path)
+            if mount is None:
+                _logger.info("mounting %s tmpfs at %s", size, path)
+                runner.run(
+                    ["mount", "-t", "tmpfs", "-o", f"size={size},mode=1777", "tmpfs", str(path)],
+                    runner.SYSTEM,
+                )
+            elif mount[0] == "tmpfs":
+                _logger.info("resizing tmpfs at %s to %s", path, size)
+                runner.run(["mount", "-o", f"remount,size={size}", str(path)], runner.SYSTEM)
+            else:
+                raise ScratchError(f"cannot mount tmpfs at {path}. {mount[0]} already mounted")
+
+        path.chmod(0o1777)
+    except OSError as e:
+        raise ScratchError(f"failed to set up scratch directory {path}. reason: {e}")
+    except subprocess.CalledProcessError as e:
+        raise ScratchError(f"failed to set up scratch directory {path}. reason: {e.stderr}")
+    except runner.CommandTimeoutError as e:
+        raise ScratchError(f"failed to set up scratch directory {path}. reason: {e.message}")
+
+
+def teardown(path: Path) -> None:
+    """Undo `setup(...)` by unmounting the tmpfs at `path`, if any.
+
+    The directory itself is left in place, since it may be on storage managed by
+    the site, such as an NVMe mount.
+
+    Raises:
+        ScratchError: Raised if the tmpfs could not be unmounted.
+    """
+    try:
+        mount = _mount_options(path)
+        if mount is None or mount[0] != "tmpfs":
+            return
+
+        _logger.info("unmounting tmpfs at %s", path)
+        runner.run(["umount", str(path)], runner.SYSTEM)
+    except OSError as e:
+        raise ScratchError(f"failed to tear down scratch directory {path}. reason: {e}")
+    except subprocess.CalledProcessError as e:
+        raise ScratchError(f"failed to tear down scratch directory {path}. reason: {e.stderr}")
+    except runner.CommandTimeoutError as e:
+        raise ScratchError(f"failed to tear down scratch directory {path}. reason: {e.message}")
+
+
+def throughput(path: Path, size: int = 64 * 1024**2, block: int = 1024**2) -> float:
+    """Measure the sequential write throughput of a directory in MiB/s.
+
+    Data is written to a temporary file and flushed with `fsync` before the
+    file is removed, so the result reflects the storage rather than the page cache.
+
+    Args:
+        path: Directory to measure.
+        size: Number of bytes to write.
+        block: Size of each write.
+
+    Raises:
+        ScratchError: Raised if the test file could not be written.
+    """
+    target = path / f".throughput-{os.getpid()}"
+    data = os.urandom(block)
+    try:
+        fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            start = time.perf_counter()
+            for _ in range(size // block):
+                os.write(fd, data)
+            os.fsync(fd)
+            elapsed = time.perf_counter() - start
+        finally:
+            os.close(fd)
+            target.unlink()
+    except OSError as e:
+        raise ScratchError(f"failed to measure write throughput of {path}. reason: {e}")
+
+    return size / 1024**2 / max(elapsed, 1e-9)
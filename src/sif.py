@@ -0,0 +1,322 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Read the global header and descriptors of SIF images without forking `apptainer`.
+
+A SIF image starts with a 128-byte global header, followed by a table of fixed-size
+descriptors that describe the data objects of the image: the definition file,
+labels, partitions, signatures, and so on. The image is memory-mapped and the
+header and descriptors are unpacked in place, so only the pages of the descriptor
+table are read, however large the image is.
+
+This module must only import from the standard library, so that it can be used by
+the launch wrapper.
+"""
+
+import json
+import logging
+import mmap
+import os
+import stat
+import struct
+import uuid
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+_logger = logging.getLogger(__name__)
+
+MAGIC = b"SIF_MAGIC\0"
+# launch script, magic, version, arch, ID, created, modified, descriptors free, total,
+# offset, size, data offset, size.
+HEADER = struct.Struct("<32s10s3s3s16s8q")
+# data type, used, ID, group ID, linked ID, offset, size, size with padding, created,
+# modified, UID, GID, name. The fields are followed by 384 bytes of type-specific data.
+DESCRIPTOR = struct.Struct("<i?III7q128s")
+DESCRIPTOR_SIZE = DESCRIPTOR.size + 384
+# fs type, partition type, arch of partition descriptors.
+PARTITION = struct.Struct("<ii3s")
+# hash type, signing entity of signature descriptors.
+SIGNATURE = struct.Struct("<i20s")
+
+# Group and linked IDs of descriptors have this bit set.
+GROUP_MASK = 0xF0000000
+
+DATA_TYPES = {
+    0x4001: "deffile",
+    0x4002: "envvar",
+    0x4003: "labels",
+    0x4004: "partition",
+    0x4005: "signature",
+    0x4006: "generic-json",
+    0x4007: "generic",
+    0x4008: "crypto-message",
+    0x4009: "sbom",
+    0x400A: "oci-root-index",
+    0x400B: "oci-blob",
+}
+FS_TYPES = {1: "squashfs", 2: "ext3", 3: "immutable-object", 4: "raw", 5: "encrypted-squashfs"}
+PARTITION_TYPES = {1: "system", 2: "primary", 3: "data", 4: "overlay"}
+HASH_TYPES = {1: "sha256", 2: "sha384", 3: "sha512", 4: "blake2s", 5: "blake2b"}
+ARCHES = {
+    b"01": "386",
+    b"02": "amd64",
+    b"03": "arm",
+    b"04": "arm64",
+    b"05": "ppc64",
+    b"06": "ppc64le",
+    b"07": "mips",
+    b"08": "mipsle",
+    b"09": "mips64",
+    b"10": "mips64le",
+    b"11": "s390x",
+}
+
+INDEX_VERSION = 1
+
+
+class SIFError(Exception):
+    """Exception raised when a file is not a valid SIF image."""
+
+    @property
+    def message(self) -> str:
+        """Return message passed as argument to exception."""
+        return self.args[0]
+
+
+@dataclass(frozen=True, slots=True)
+class Descriptor:
+    """A data object of a SIF image.
+
+    Attributes:
+        id: ID of the data object.
+        type: Type of the data object, e.g. `partition` or `signature`.
+        name: Name of the data object.
+        offset: Offset of the data object in the image.
+        size: Size of the data object in bytes.
+        group: ID of the group of the data object, or 0 if it is not in a group.
+        link: ID of the data object or group that the data object is linked to, if any.
+        created: Creation time of the data object as a UNIX timestamp.
+        fs: Filesystem of a partition, e.g. `squashfs`.
+        partition: Type of a partition, e.g. `primary`.
+        arch: Architecture of a partition.
+        hash: Hash algorithm of a signature, e.g. `sha256`.
+        entity: Fingerprint of the key of a signature.
+    """
+
+    id: int
+    type: str
+    name: str
+    offset: int
+    size: int
+    group: int = 0
+    link: int = 0
+    created: int = 0
+    fs: str = ""
+    partition: str = ""
+    arch: str = ""
+    hash: str = ""
+    entity: str = ""
+
+
+@dataclass(frozen=True, slots=True)
+class Image:
+    """Global header and data objects of a SIF image.
+
+    Attributes:
+        id: Unique ID of the image.
+        arch: Architecture of the image.
+        created: Creation time of the image as a UNIX timestamp.
+        modified: Modification time of the image as a UNIX timestamp.
+        descriptors: Data objects of the image, ordered by their position in the
+            descriptor table.
+    """
+
+    id: str
+    arch: str
+    created: int
+    modified: int
+    descriptors: tuple[Descriptor, ...]
+
+    def primary(self) -> Descriptor | None:
+        """Get the primary system partition of the image."""
+        return next((d for d in self.descriptors if d.partition == "primary"), None)
+
+    def signed(self) -> bool:
+        """Check if the image has a signature."""
+        return any(d.type == "signature" for d in self.descriptors)
+
+    def summary(self) -> dict:
+        """Get a JSON-serializable summary of the image."""
+        primary = self.primary()
+        return {
+            "id": self.id,
+            "arch": self.arch,
+            "created": self.created,
+            "modified": self.modified,
+            "primary": {"fs": primary.fs, "offset": primary.offset, "size": primary.size}
+            if primary
+            else None,
+            "signed": self.signed(),
+            "descriptors": [asdict(d) for d in self.descriptors],
+        }
+
+
+def _str(raw: bytes) -> str:
+    """Decode a NUL-padded string field."""
+    return raw.split(b"\0", 1)[0].decode(errors="replace")
+
+
+def _descriptor(buf, offset: int) -> Descriptor | None:
+    """Unpack the descriptor at an offset of a buffer, or `None` if it is unused."""
+    (
+        datatype,
+        used,
+        id_,
+        group,
+        link,
+        data_offset,
+        size,
+        _,
+        created,
+        _,
+        _,
+        _,
+        name,
+    ) = DESCRIPTOR.unpack_from(buf, offset)
+    if not used:
+        return None
+
+    fields = {}
+    if datatype == 0x4004:
+        fs, part, arch = PARTITION.unpack_from(buf, offset + DESCRIPTOR.size)
+        fields = {
+            "fs": FS_TYPES.get(fs, str(fs)),
+            "partition": PARTITION_TYPES.get(part, str(part)),
+            "arch": ARCHES.get(arch[:2], _str(arch)),
+        }
+    elif datatype == 0x4005:
+        hash_, entity = SIGNATURE.unpack_from(buf, offset + DESCRIPTOR.size)
+        fields = {"hash": HASH_TYPES.get(hash_, str(hash_)), "entity": entity.hex()}
+
+    return Descriptor(
+        id=id_,
+        type=DATA_TYPES.get(datatype, hex(datatype)),
+        name=_str(name),
+        offset=data_offset,
+        size=size,
+        group=group & ~GROUP_MASK,
+        link=link & ~GROUP_MASK,
+        created=created,
+        **fields,
+    )
+
+
+def parse(path: str | os.PathLike) -> Image:
+    """Parse the global header and descriptors of a SIF image.
+
+    Args:
+        path: Path of the image.
+
+    Raises:
+        SIFError: Raised if the file is not a SIF image, or its descriptor table is
+            not inside the file.
+    """
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                raise SIFError(f"{path} is not a SIF image")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                return _parse(buf, size, path)
+    except OSError as e:
+        raise SIFError(f"failed to read SIF image {path}. reason: {e}")
+
+
+def _parse(buf: mmap.mmap, size: int, path: str | os.PathLike) -> Image:
+    """Parse the global header and descriptors of a memory-mapped SIF image."""
+    (_, magic, _, arch, id_, created, modified, _, total, offset, length, _, _) = (
+        HEADER.unpack_from(buf)
+    )
+    if magic != MAGIC:
+        raise SIFError(f"{path} is not a SIF image")
+    if total < 0 or offset < HEADER.size or offset + total * DESCRIPTOR_SIZE > size:
+        raise SIFError(f"descriptor table of SIF image {path} is truncated")
+    if total * DESCRIPTOR_SIZE > length:
+        raise SIFError(f"descriptor table of SIF image {path} is larger than its header")
+
+    descriptors = (_descriptor(buf, offset + i * DESCRIPTOR_SIZE) for i in range(total))
+    return Image(
+        id=str(uuid.UUID(bytes=id_)),
+        arch=ARCHES.get(arch[:2], _str(arch)),
+        created=created,
+        modified=modified,
+        descriptors=tuple(d for d in descriptors if d is not None),
+    )
+
+
+def index(cache_dir: Path, index_file: Path) -> dict[str, dict]:
+    """Summarize the SIF images in a directory tree.
+
+    Summaries are saved to `index_file`, keyed by the path of each image with its
+    inode, size, and modification time. Images whose inode, size, and modification
+    time have not changed since the last call are not parsed again.
+
+    Args:
+        cache_dir: Directory to find SIF images in.
+        index_file: File to save the summaries in.
+
+    Returns:
+        Summary of each image, see `Image.summary()`, keyed by the path of the image.
+        Files that are not SIF images are left out.
+    """
+    try:
+        saved = json.loads(index_file.read_text())
+        if saved.get("version") != INDEX_VERSION:
+            saved = {}
+    except (OSError, ValueError):
+        saved = {}
+    previous = saved.get("images", {})
+
+    images, parsed = {}, 0
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path, follow_symlinks=False)
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+
+            stamp = [st.st_ino, st.st_size, st.st_mtime_ns]
+            if (entry := previous.get(path)) and entry["stamp"] == stamp:
+                images[path] = entry
+                continue
+
+            # Files that are not SIF images are indexed too, so they are not read again.
+            try:
+                summary = parse(path).summary()
+            except SIFError as e:
+                _logger.debug(e.message)
+                summary = None
+
+            images[path] = {"stamp": stamp, "summary": summary}
+            parsed += 1
+
+    _logger.debug("indexed %d files in %s. parsed %d", len(images), cache_dir, parsed)
+    index_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp = index_file.with_name(f".{index_file.name}.tmp")
+    tmp.write_text(json.dumps({"version": INDEX_VERSION, "images": images}))
+    os.replace(tmp, index_file)
+    return {path: entry["summary"] for path, entry in images.items() if entry["summary"]}
@@ -0,0 +1,107 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Drain and resume Slurm compute nodes with `scontrol`."""
+
+import logging
+import re
+import socket
+import subprocess
+
+import runner
+
+_logger = logging.getLogger(__name__)
+_field = re.compile(r"(?:^|\s)(NodeName|State)=(\S+)")
+# Reasons contain spaces, and end with the user and time they were set, e.g. `[root@...]`.
+_reason = re.compile(r"\sReason=(.*?)(?:\s\[[^\]]*\])?(?=\s\w+=|$)")
+
+# Node states and state flags of nodes that are out of service.
+OUT_OF_SERVICE = frozenset({"DOWN", "DRAIN", "DRAINED", "DRAINING", "FAIL", "FAILING", "MAINT"})
+
+
+class SlurmOpsError(Exception):
+    """Exception raised when a Slurm operation on the unit has failed."""
+
+    @property
+    def message(self) -> str:
+        """Return message passed as argument to exception."""
+        return self.args[0]
+
+
+def nodename() -> str:
+    """Get the Slurm node name of the unit's machine."""
+    return socket.gethostname().split(".")[0]
+
+
+def _scontrol(nodes: list[str], operation: str, *args: str) -> str:
+    """Run `scontrol` on nodes, and return its output."""
+    cmd = ["scontrol", *args]
+    _logger.info("running `%s`", " ".join(cmd))
+    try:
+        return runner.run(cmd, runner.SYSTEM).stdout
+    except FileNotFoundError as e:
+        raise SlurmOpsError(f"failed to {operation} nodes `{nodes}`. reason: {e}")
+    except runner.CommandTimeoutError as e:
+        raise SlurmOpsError(f"failed to {operation} nodes `{nodes}`. reason: {e.message}")
+    except subprocess.CalledProcessError as e:
+        raise SlurmOpsError(f"failed to {operation} nodes `{nodes}`. reason: {e.stderr.strip()}")
+
+
+def _update(nodes: list[str], *args: str) -> None:
+    """Update the state of nodes with `scontrol update`."""
+    _scontrol(nodes, "update", "update", f"nodename={','.join(nodes)}", *args)
+
+
+def out_of_service(nodes: list[str]) -> dict[str, str]:
+    """Get the nodes that are drained, down, or otherwise out of service.
+
+    Returns:
+        The state and reason of each node that is out of service, keyed by node
+        name, e.g. `IDLE+DRAIN: disk failure`.
+
+    Raises:
+        SlurmOpsError: Raised if `scontrol` fails to show the nodes.
+    """
+    states = {}
+    output = _scontrol(nodes, "show", "--oneline", "show", "node", ",".join(nodes))
+    for line in output.splitlines():
+        fields = dict(_field.findall(line))
+        if "NodeName" not in fields or "State" not in fields:
+            continue
+        # States are suffixed with flags like `*` if the node is not responding.
+        if {re.sub(r"\W", "", s) for s in fields["State"].split("+")} & OUT_OF_SERVICE:
+            state = fields["State"]
+            if (match := _reason.search(line)) and match[1]:
+                state = f"{state}: {match[1]}"
+            states[fields["NodeName"]] = state
+
+    return states
+
+
+def drain(nodes: list[str], reason: str) -> None:
+    """Drain nodes so that no new jobs are scheduled on them.
+
+    Raises:
+        SlurmOpsError: Raised if `scontrol` fails to drain the nodes.
+    """
+    _update(nodes, "state=drain", f"reason={reason}")
+
+
+def resume(nodes: list[str]) -> None:
+    """Resume drained nodes so that jobs are scheduled on them again.
+
+    Raises:
+        SlurmOpsError: Raised if `scontrol` fails to resume the nodes.
+    """
+    _update(nodes, "state=resume")
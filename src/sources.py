@@ -0,0 +1,112 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Manage individual apt sources without parsing every source file on the unit.
+
+`apt.RepositoryMapping` parses `sources.list` and every file in `sources.list.d`
+when it is created, and fails on the first file it cannot parse. Nodes built from
+images often carry dozens of vendor repositories, so the charm instead reads only
+the source files it is asked about, and writes only its own source file.
+"""
+
+import logging
+import os
+from pathlib import Path
+
+import charms.operator_libs_linux.v0.apt as apt
+
+_logger = logging.getLogger(__name__)
+
+APT_DIR = Path("/etc/apt")
+
+
+def filename(repo: apt.DebianRepository, apt_dir: Path = APT_DIR) -> Path:
+    """Get the source file of a repository, named as `add-apt-repository` would name it."""
+    prefix = Path(apt.DebianRepository.prefix_from_uri(repo.uri)).name
+    return apt_dir / "sources.list.d" / f"{prefix}-{repo.release.replace('/', '-')}.list"
+
+
+def line(repo: apt.DebianRepository) -> str:
+    """Get the one-line-style definition of a repository, as `add-apt-repository` writes it."""
+    return (
+        f"{'' if repo.enabled else '# '}{repo.repotype} "
+        + f"{repo.make_options_string(include_signed_by=False)}{repo.uri} {repo.release} "
+        + " ".join(repo.groups)
+    ).rstrip()
+
+
+def identifier(repo: apt.DebianRepository) -> str:
+    """Get the key of a repository in `apt.RepositoryMapping`."""
+    return f"{repo.repotype}-{repo.uri}-{repo.release}"
+
+
+def _write(file: Path, content: str) -> bool:
+    """Atomically replace the contents of a source file if they have changed."""
+    try:
+        if file.read_text() == content:
+            return False
+    except FileNotFoundError:
+        pass
+
+    tmp = file.with_name(f".{file.name}.tmp")
+    tmp.parent.mkdir(parents=True, exist_ok=True)
+    tmp.write_text(content)
+    tmp.chmod(0o644)
+    os.replace(tmp, file)
+    return True
+
+
+def add(repo: apt.DebianRepository, apt_dir: Path = APT_DIR) -> bool:
+    """Add a repository in its own source file without touching any other source file.
+
+    Args:
+        repo: Repository to add.
+        apt_dir: apt configuration directory.
+
+    Returns:
+        True if the source file was changed, otherwise False.
+
+    Raises:
+        OSError: Raised if the source file could not be written.
+    """
+    file = filename(repo, apt_dir)
+    changed = _write(file, line(repo) + "\n")
+    if changed:
+        _logger.info("added repository `%s` to %s", identifier(repo), file)
+
+    return changed
+
+
+def disable(repo: apt.DebianRepository, apt_dir: Path = APT_DIR) -> bool:
+    """Disable a repository added with `add(...)` by commenting it out in its source file.
+
+    Returns:
+        True if the source file was changed, otherwise False.
+
+    Raises:
+        OSError: Raised if the source file could not be written.
+    """
+    file = filename(repo, apt_dir)
+    try:
+        current = file.read_text().splitlines()
+    except FileNotFoundError:
+        return False
+
+    enabled = line(repo).lstrip("# ")
+    lines = [f"# {entry}" if entry.strip() == enabled else entry for entry in current]
+    changed = _write(file, "\n".join(lines) + "\n")
+    if changed:
+        _logger.info("disabled repository `%s` in %s", identifier(repo), file)
+
+    return changed
@@ -0,0 +1,245 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Allocate subordinate user and group ID ranges for `--fakeroot` in bulk.
+
+`apptainer config fakeroot --add` and `usermod --add-subuids` rewrite `/etc/subuid`
+and `/etc/subgid` once per user, which does not scale to the tens of thousands of
+directory users of a cluster. Ranges are instead allocated for every user in one
+pass, and each file is rewritten once.
+"""
+
+import bisect
+import logging
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+_logger = logging.getLogger(__name__)
+_username = re.compile(r"^[^:\s]+$")
+
+SUBUID_FILE = Path("/etc/subuid")
+SUBGID_FILE = Path("/etc/subgid")
+# Defaults used by `useradd` in `/etc/login.defs`.
+DEFAULT_START = 100000
+DEFAULT_COUNT = 65536
+# Highest ID usable by a subordinate range. `(uid_t) -1` is reserved.
+MAX_ID = 2**32 - 2
+
+
+class SubIDError(Exception):
+    """Exception raised when subordinate ID ranges could not be allocated."""
+
+    @property
+    def message(self) -> str:
+        """Return message passed as argument to exception."""
+        return self.args[0]
+
+
+@dataclass(frozen=True)
+class Range:
+    """Subordinate ID range of a user.
+
+    Attributes:
+        user: Name of the user that owns the range.
+        start: First subordinate ID of the range.
+        count: Number of subordinate IDs in the range.
+    """
+
+    user: str
+    start: int
+    count: int
+
+    @property
+    def end(self) -> int:
+        """Get the first ID after the range."""
+        return self.start + self.count
+
+    def __str__(self) -> str:
+        """Get the range as a line of `/etc/subuid` or `/etc/subgid`."""
+        return f"{self.user}:{self.start}:{self.count}"
+
+
+def parse(text: str) -> list[Range]:
+    """Parse the contents of `/etc/subuid` or `/etc/subgid`.
+
+    Blank lines, comments, and malformed lines are ignored, as by `newuidmap`.
+    """
+    ranges = []
+    for line in text.splitlines():
+        fields = line.strip().split(":")
+        if len(fields) != 3 or not fields[0] or fields[0].startswith("#"):
+            continue
+        try:
+            ranges.append(Range(fields[0], int(fields[1]), int(fields[2])))
+        except ValueError:
+            _logger.debug("ignoring malformed subordinate ID entry `%s`", line)
+
+    return ranges
+
+
+def read_users(file: Path) -> list[str]:
+    """Read a list of users, one per line, ignoring blank lines and `#` comments.
+
+    Raises:
+        SubIDError: Raised if a line is not a valid user name.
+        OSError: Raised if the file could not be read.
+    """
+    users = []
+    for lineno, line in enumerate(file.read_text().splitlines(), start=1):
+        user = line.split("#", 1)[0].strip()
+        if not user:
+            continue
+        if not _username.match(user):
+            raise SubIDError(f"invalid user name `{user}` on line {lineno} of {file}")
+        users.append(user)
+
+    return users
+
+
+def allocate(
+    users: list[str],
+    existing: list[Range],
+    start: int = DEFAULT_START,
+    count: int = DEFAULT_COUNT,
+) -> list[Range]:
+    """Allocate subordinate ID ranges for users that do not have one.
+
+    New ranges are placed in the lowest gaps at or above `start` that do not overlap
+    any existing range, so existing allocations never move.
+
+    Args:
+        users: Users that need a subordinate ID range.
+        existing: Ranges that are already allocated.
+        start: Lowest subordinate ID to allocate.
+        count: Number of subordinate IDs in each new range.
+
+    Returns:
+        The new ranges, in the order of `users`.
+
+    Raises:
+        SubIDError: Raised if the subordinate ID space is exhausted.
+    """
+    owned = {r.user for r in existing}
+    taken = sorted((r.start, r.end) for r in existing)
+    # Merge overlapping ranges so the gaps between them can be walked in one pass.
+    merged: list[list[int]] = []
+    for lo, hi in taken:
+        if merged and lo <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], hi)
+        else:
+            merged.append([lo, hi])
+
+    ranges = []
+    cursor = start
+    i = bisect.bisect_left([hi for _, hi in merged], cursor + 1)
+    for user in dict.fromkeys(users):
+        if user in owned:
+            continue
+        # Skip past every existing range that overlaps the candidate range.
+        while i < len(merged) and merged[i][0] < cursor + count:
+            cursor = max(cursor, merged[i][1])
+            i += 1
+        if cursor + count - 1 > MAX_ID:
+            raise SubIDError(
+                f"subordinate ID space exhausted after allocating {len(ranges)} "
+                + f"of {len(users)} ranges of {count} IDs"
+            )
+        ranges.append(Range(user, cursor, count))
+        cursor += count
+
+    return ranges
+
+
+def _append(file: Path, text: str, ranges: list[Range]) -> None:
+    """Atomically rewrite a subordinate ID file with ranges appended to its contents."""
+    if text and not text.endswith("\n"):
+        text += "\n"
+
+    tmp = file.with_name(f".{file.name}.tmp")
+    tmp.write_text(text + "".join(f"{r}\n" for r in ranges))
+    tmp.chmod(0o644)
+    os.replace(tmp, file)
+
+
+def sync(
+    users: list[str],
+    start: int = DEFAULT_START,
+    count: int = DEFAULT_COUNT,
+    subuid_file: Path = SUBUID_FILE,
+    subgid_file: Path = SUBGID_FILE,
+) -> list[Range]:
+    """Allocate subordinate user and group ID ranges for every user in one pass.
+
+    Existing entries of both files are kept as is, including entries of users that
+    are not in `users`. New ranges are allocated from the IDs that are free in both
+    files, so a new user gets the same range in each file. A user with a range in
+    only one file gets that range in the other file too, unless it overlaps a range
+    there, in which case a new range is allocated in the other file only.
+
+    Args:
+        users: Users that need to be able to run containers with `--fakeroot`.
+        start: Lowest subordinate ID to allocate.
+        count: Number of subordinate IDs in each new range.
+        subuid_file: Path to `/etc/subuid`.
+        subgid_file: Path to `/etc/subgid`.
+
+    Returns:
+        The ranges added to either file.
+
+    Raises:
+        SubIDError: Raised if the subordinate ID space is exhausted.
+        OSError: Raised if either file could not be read or written.
+    """
+    texts, ranges = {}, {}
+    for file in (subuid_file, subgid_file):
+        try:
+            texts[file] = file.read_text()
+        except FileNotFoundError:
+            texts[file] = ""
+        ranges[file] = parse(texts[file])
+
+    copied: dict[Path, list[Range]] = {subuid_file: [], subgid_file: []}
+    for file, other in ((subuid_file, subgid_file), (subgid_file, subuid_file)):
+        owned = {r.user for r in ranges[file]}
+        first = {}
+        for r in ranges[other]:
+            first.setdefault(r.user, r)
+        for user in dict.fromkeys(users):
+            if user in owned or (r := first.get(user)) is None:
+                continue
+            if not any(r.start < o.end and o.start < r.end for o in ranges[file]):
+                ranges[file].append(r)
+                copied[file].append(r)
+
+    # A user only keeps its allocation if it has a range in both files. The ranges of
+    # users missing from either file still reserve their IDs.
+    complete = {r.user for r in ranges[subuid_file]} & {r.user for r in ranges[subgid_file]}
+    existing = [
+        r if r.user in complete else Range("", r.start, r.count)
+        for file in (subuid_file, subgid_file)
+        for r in ranges[file]
+    ]
+    new = allocate(users, existing, start, count)
+    added = copied[subuid_file] + copied[subgid_file] + new
+    if not added:
+        return []
+
+    for file in (subuid_file, subgid_file):
+        owned = {r.user for r in ranges[file]}
+        _append(file, texts[file], copied[file] + [r for r in new if r.user not in owned])
+
+    _logger.info("allocated subordinate ID ranges for %d users", len(added))
+    return added
@@ -0,0 +1,282 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Raise the kernel limits that bursts of container launches run into.
+
+Large job arrays and MPI jobs with many ranks start hundreds of containers at once.
+Each container with `--userns` creates a user namespace, watches files with inotify,
+holds open files, and mounts its image on a loop device. The limits for these are
+raised to values computed from the core count of the machine and the configured
+maximum number of concurrent containers, through a managed `sysctl.d` drop-in and
+the `loop` module options in `modprobe.d`. Limits are only ever raised, never lowered.
+
+Parameters of modules that are built into the kernel, such as `loop` on Ubuntu, can
+not be set in `modprobe.d`, so they are skipped. Loop devices are then pre-created by
+the loop device pool instead.
+
+Inside a system container, only limits that are namespaced to the container are
+tuned. The others belong to the host.
+"""
+
+import logging
+import os
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+
+import runner
+
+_logger = logging.getLogger(__name__)
+
+HEADER = "# Managed by the apptainer charm. Changes will be overwritten.\n"
+SYSCTL_FILE = Path("/etc/sysctl.d/60-apptainer-operator.conf")
+MODPROBE_FILE = Path("/etc/modprobe.d/60-apptainer-operator-loop.conf")
+PROC_SYS = Path("/proc/sys")
+SYS_MODULE = Path("/sys/module")
+MODULES_BUILTIN = Path("/lib/modules") / os.uname().release / "modules.builtin"
+
+
+class TuningError(Exception):
+    """Exception raised when the kernel limits could not be tuned."""
+
+    @property
+    def message(self) -> str:
+        """Return message passed as argument to exception."""
+        return self.args[0]
+
+
+@dataclass(frozen=True)
+class Knob:
+    """A kernel limit to raise.
+
+    Attributes:
+        name: Name of the sysctl, or of the parameter of `module`.
+        value: Recommended minimum value.
+        host_only: True if the limit is global to the host, and can not be set
+            inside a system container.
+        module: Kernel module the limit is a parameter of, if it is not a sysctl.
+    """
+
+    name: str
+    value: int
+    host_only: bool = False
+    module: str = ""
+
+    def live(self, proc_sys: Path = PROC_SYS, sys_module: Path = SYS_MODULE) -> int | None:
+        """Get the live value of the limit, or `None` if the kernel does not have it."""
+        if self.module:
+            path = sys_module / self.module / "parameters" / self.name
+        else:
+            path = proc_sys / self.name.replace(".", "/")
+        try:
+            return int(path.read_text().split()[0])
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def builtin(
+        self, sys_module: Path = SYS_MODULE, modules_builtin: Path = MODULES_BUILTIN
+    ) -> bool:
+        """Check if the limit is a parameter of a module that is built into the kernel.
+
+        A loaded module has an `initstate` in sysfs, and a built-in one does not. A
+        module that is not in sysfs at all is looked up in `modules.builtin`.
+        """
+        if not self.module:
+            return False
+        if (sys_module / self.module).exists():
+            return not (sys_module / self.module / "initstate").exists()
+        try:
+            lines = modules_builtin.read_text().splitlines()
+        except OSError:
+            return False
+
+        return any(
+            Path(line.strip()).name.removesuffix(".ko").replace("-", "_") == self.module
+            for line in lines
+        )
+
+
+def recommend(cores: int, containers: int, loops: int = 0) -> list[Knob]:
+    """Get the recommended kernel limits.
+
+    Args:
+        cores: Number of cores of the machine.
+        containers: Maximum number of containers running at the same time.
+        loops: Number of loop devices that are pre-created.
+    """
+    return [
+        # Nested and fakeroot containers create more than one namespace each.
+        Knob("user.max_user_namespaces", max(15000, 8 * containers)),
+        Knob("fs.inotify.max_user_instances", max(1024, 4 * containers)),
+        Knob("fs.file-max", max(1048576, 65536 * cores + 16384 * containers), host_only=True),
+        # Each SIF image is mounted on its own loop device, and overlay images on another.
+        Knob("max_loop", max(256, 2 * containers, loops), host_only=True, module="loop"),
+    ]
+
+
+def _write(file: Path, content: str) -> bool:
+    """Atomically replace the contents of a file if they have changed."""
+    try:
+        if file.read_text() == content:
+            return False
+    except FileNotFoundError:
+        pass
+
+    file.parent.mkdir(parents=True, exist_ok=True)
+    tmp = file.with_name(f".{file.name}.tmp")
+    tmp.write_text(content)
+    os.replace(tmp, file)
+    return True
+
+
+def _managed(file: Path) -> dict[str, int]:
+    """Get the values set by a managed drop-in, keyed by sysctl or module parameter."""
+    values = {}
+    try:
+        lines = file.read_text().splitlines()
+    except FileNotFoundError:
+        return {}
+
+    for line in lines:
+        if line.startswith("options "):
+            # Format: options <module> <name>=<value> ...
+            _, module, *params = line.split()
+            for param in params:
+                name, _, value = param.partition("=")
+                values[f"{module}.{name}"] = int(value)
+        elif "=" in line and not line.startswith("#"):
+            name, _, value = line.partition("=")
+            values[name.strip()] = int(value)
+
+    return values
+
+
+def apply(
+    knobs: list[Knob],
+    container: bool = False,
+    sysctl_file: Path = SYSCTL_FILE,
+    modprobe_file: Path = MODPROBE_FILE,
+    proc_sys: Path = PROC_SYS,
+    sys_module: Path = SYS_MODULE,
+    modules_builtin: Path = MODULES_BUILTIN,
+) -> list[Knob]:
+    """Raise the kernel limits to at least their recommended values.
+
+    Limits that are already higher are kept at their live value. Sysctls are applied
+    immediately. Module parameters take effect the next time the module is loaded,
+    which for a loaded `loop` module means the next boot.
+
+    Args:
+        knobs: Kernel limits to raise.
+        container: True if the unit is a system container, in which case host-only
+            limits are skipped.
+        sysctl_file: Managed `sysctl.d` drop-in.
+        modprobe_file: Managed `modprobe.d` drop-in.
+        proc_sys: Directory the live sysctls are read from.
+        sys_module: Directory the live module parameters are read from.
+        modules_builtin: List of the modules built into the running kernel.
+
+    Returns:
+        The limits that were skipped, because they belong to the host, the kernel
+        does not have them, or their module is built into the kernel.
+
+    Raises:
+        TuningError: Raised if the drop-ins could not be written or applied.
+    """
+    sysctls, options, skipped = [], {}, []
+    for knob in knobs:
+        live = knob.live(proc_sys, sys_module)
+        if (
+            (container and knob.host_only)
+            or (live is None and not knob.module)
+            or knob.builtin(sys_module, modules_builtin)
+        ):
+            _logger.info("skipping kernel limit %s on this unit", knob.name)
+            skipped.append(knob)
+            continue
+
+        value = max(knob.value, live or 0)
+        if knob.module:
+            options.setdefault(knob.module, []).append(f"{knob.name}={value}")
+        else:
+            sysctls.append(f"{knob.name} = {value}")
+
+    try:
+        changed = _write(sysctl_file, HEADER + "".join(f"{s}\n" for s in sysctls))
+        if options:
+            _write(
+                modprobe_file,
+                HEADER + "".join(f"options {m} {' '.join(p)}\n" for m, p in options.items()),
+            )
+        else:
+            modprobe_file.unlink(missing_ok=True)
+        if changed or drift(sysctl_file, modprobe_file, proc_sys, sys_module):
+            _logger.info("applying kernel limits from %s", sysctl_file)
+            runner.run(["sysctl", "--load", str(sysctl_file)], runner.SYSTEM)
+    except (OSError, runner.CommandTimeoutError) as e:
+        raise TuningError(f"failed to tune kernel limits. reason: {e}")
+    except subprocess.CalledProcessError as e:
+        raise TuningError(f"failed to tune kernel limits. reason: {e.stderr.strip()}")
+
+    return skipped
+
+
+def drift(
+    sysctl_file: Path = SYSCTL_FILE,
+    modprobe_file: Path = MODPROBE_FILE,
+    proc_sys: Path = PROC_SYS,
+    sys_module: Path = SYS_MODULE,
+    modules_builtin: Path = MODULES_BUILTIN,
+) -> list[str]:
+    """Get the managed kernel limits whose live value is below the managed value.
+
+    A module parameter of 0, such as `max_loop=0`, means that there is no limit.
+    Parameters of built-in modules are never applied from `modprobe.d`, so they are
+    not reported.
+
+    Returns:
+        Names of the drifted limits. Module parameters are prefixed with the module.
+    """
+    knobs = [Knob(name, value) for name, value in _managed(sysctl_file).items()]
+    for name, value in _managed(modprobe_file).items():
+        module, _, param = name.partition(".")
+        knobs.append(Knob(param, value, module=module))
+
+    drifted = []
+    for knob in knobs:
+        live = knob.live(proc_sys, sys_module)
+        if knob.builtin(sys_module, modules_builtin):
+            continue
+        if live is None or (knob.module and live == 0):
+            continue
+        if live < knob.value:
+            drifted.append(f"{knob.module}.{knob.name}" if knob.module else knob.name)
+
+    return drifted
+
+
+def remove(sysctl_file: Path = SYSCTL_FILE, modprobe_file: Path = MODPROBE_FILE) -> None:
+    """Remove the managed drop-ins.
+
+    The live limits are left as they are until the next boot, as their values
+    before they were raised are not known.
+
+    Raises:
+        TuningError: Raised if a drop-in could not be removed.
+    """
+    try:
+        sysctl_file.unlink(missing_ok=True)
+        modprobe_file.unlink(missing_ok=True)
+    except OSError as e:
+        raise TuningError(f"failed to remove kernel tuning drop-ins. reason: {e}")
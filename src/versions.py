@@ -0,0 +1,274 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Install Apptainer versions side by side, and switch between them atomically.
+
+Each version is unpacked from its packages, or extracted from a relocatable tarball,
+into its own directory under `/opt/apptainer`, and the active version is chosen by
+the `current` symlink:
+
+    /opt/apptainer/1.3.6/usr/bin/apptainer
+    /opt/apptainer/1.4.0/usr/bin/apptainer
+    /opt/apptainer/current -> 1.4.0
+    /opt/apptainer/previous -> 1.3.6
+
+Switching versions replaces `current` with a single `rename(2)`, so new launches
+use the new version while running containers keep the version they started with.
+Old versions are only removed once no process runs one of their executables.
+"""
+
+import logging
+import os
+import shutil
+import tarfile
+from pathlib import Path
+
+import procscan
+import runner
+
+_logger = logging.getLogger(__name__)
+
+ROOT = Path("/opt/apptainer")
+CURRENT = "current"
+PREVIOUS = "previous"
+
+
+class VersionsError(Exception):
+    """Exception raised when a versioned Apptainer install could not be changed."""
+
+    @property
+    def message(self) -> str:
+        """Return message passed as argument to exception."""
+        return self.args[0]
+
+
+def binary(root: Path = ROOT) -> Path:
+    """Get the path of the `apptainer` binary of the active version."""
+    return root / CURRENT / "usr" / "bin" / "apptainer"
+
+
+def config_file(root: Path = ROOT) -> Path:
+    """Get the path of the `apptainer.conf` of the active version."""
+    return root / CURRENT / "etc" / "apptainer" / "apptainer.conf"
+
+
+def _target(link: Path) -> str | None:
+    """Get the version a link points to, if it exists."""
+    try:
+        return os.readlink(link)
+    except OSError:
+        return None
+
+
+def active(root: Path = ROOT) -> str | None:
+    """Get the active version, or `None` if no version is active."""
+    return _target(root / CURRENT)
+
+
+def previous(root: Path = ROOT) -> str | None:
+    """Get the version that was active before the active version, if any."""
+    return _target(root / PREVIOUS)
+
+
+def installed(root: Path = ROOT) -> list[str]:
+    """Get the versions that are unpacked, in no particular order."""
+    try:
+        return [
+            entry.name
+            for entry in os.scandir(root)
+            if entry.is_dir(follow_symlinks=False) and not entry.name.startswith(".")
+        ]
+    except FileNotFoundError:
+        return []
+
+
+def download(packages: list[str], dest: Path) -> list[Path]:
+    """Download packages from the apt sources of the unit without installing them.
+
+    Raises:
+        CalledProcessError: Raised if `apt-get` failed to download a package.
+        CommandTimeoutError: Raised if `apt-get` did not finish in time.
+    """
+    dest.mkdir(parents=True, exist_ok=True)
+    runner.run(["apt-get", "download", *packages], runner.PACKAGE, cwd=dest)
+    return sorted(dest.glob("*.deb"))
+
+
+def field(deb: Path, name: str) -> str:
+    """Get a control field of a package, e.g. `Version`.
+
+    Raises:
+        CalledProcessError: Raised if the package could not be read.
+    """
+    return runner.run(["dpkg-deb", "--field", str(deb), name]).stdout.strip()
+
+
+def unpack(debs: list[Path], root: Path = ROOT) -> str:
+    """Unpack packages into the directory of their version, unless it is unpacked already.
+
+    The packages are unpacked into a temporary directory that is renamed into
+    place, so a version directory is always complete.
+
+    Args:
+        debs: Packages to unpack. The version of the first package is the version
+            of the install.
+        root: Directory the versions are unpacked in.
+
+    Returns:
+        The unpacked version.
+
+    Raises:
+        CalledProcessError: Raised if a package could not be unpacked.
+        OSError: Raised if the version directory could not be created.
+    """
+    version = field(debs[0], "Version")
+    target = root / version
+    if target.is_dir():
+        return version
+
+    tmp = root / f".{version}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    for deb in debs:
+        runner.run(["dpkg-deb", "--extract", str(deb), str(tmp)], runner.SYSTEM)
+    os.rename(tmp, target)
+    _logger.info("unpacked apptainer %s into %s", version, target)
+    return version
+
+
+def extract(tarball: Path, root: Path = ROOT) -> str:
+    """Extract a relocatable Apptainer tree into the directory of its version.
+
+    The tarball holds the same tree as the packages, with `usr/bin/apptainer` and
+    `etc/apptainer/apptainer.conf`, optionally below a single top-level directory.
+    The version is that reported by the extracted `apptainer` binary.
+
+    Args:
+        tarball: Tarball to extract.
+        root: Directory the versions are unpacked in.
+
+    Returns:
+        The extracted version.
+
+    Raises:
+        VersionsError: Raised if the tarball could not be read, or holds no Apptainer tree.
+        CalledProcessError: Raised if the extracted `apptainer` binary failed to run.
+        OSError: Raised if the version directory could not be created.
+    """
+    tmp = root / ".tarball.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    try:
+        try:
+            with tarfile.open(tarball) as tar:
+                tar.extractall(tmp, filter="data")
+        except tarfile.TarError as e:
+            raise VersionsError(f"failed to extract `{tarball}`. reason: {e}")
+
+        top = tmp
+        if not (top / "usr").is_dir() and len(entries := list(tmp.iterdir())) == 1:
+            top = entries[0]
+        if not (binary := top / "usr" / "bin" / "apptainer").is_file():
+            raise VersionsError(f"`{tarball}` does not contain `usr/bin/apptainer`")
+
+        version = runner.run([str(binary), "--version"]).stdout.split()[-1]
+        if not (root / version).is_dir():
+            os.rename(top, root / version)
+            _logger.info("extracted apptainer %s into %s", version, root / version)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    return version
+
+
+def _link(link: Path, version: str) -> None:
+    """Atomically point a link at a version."""
+    tmp = link.with_name(f".{link.name}.tmp")
+    tmp.unlink(missing_ok=True)
+    tmp.symlink_to(version)
+    os.replace(tmp, link)
+
+
+def activate(version: str, root: Path = ROOT) -> None:
+    """Make a version the active version.
+
+    The version that was active is kept as the previous version, so that it can
+    be switched back to with `rollback(...)`.
+
+    Raises:
+        VersionsError: Raised if the version is not unpacked.
+        OSError: Raised if the links could not be replaced.
+    """
+    if not (root / version).is_dir():
+        raise VersionsError(f"apptainer {version} is not unpacked in {root}")
+
+    if (current := active(root)) == version:
+        return
+    if current:
+        _link(root / PREVIOUS, current)
+    _link(root / CURRENT, version)
+    _logger.info("activated apptainer %s in place of %s", version, current)
+
+
+def deactivate(root: Path = ROOT) -> None:
+    """Remove the links to the active and previous versions, so that none is active.
+
+    Raises:
+        OSError: Raised if the links could not be removed.
+    """
+    for link in (CURRENT, PREVIOUS):
+        (root / link).unlink(missing_ok=True)
+
+
+def rollback(root: Path = ROOT) -> str:
+    """Switch back to the previous version.
+
+    Returns:
+        The version that is now active.
+
+    Raises:
+        VersionsError: Raised if there is no previous version to switch back to.
+        OSError: Raised if the links could not be replaced.
+    """
+    if not (version := previous(root)):
+        raise VersionsError("no previous apptainer version to roll back to")
+
+    activate(version, root)
+    return version
+
+
+def gc(root: Path = ROOT, proc: Path = Path("/proc")) -> list[str]:
+    """Remove the versions that are neither active, previous, nor in use.
+
+    A version is in use while a process runs one of its executables, such as the
+    `starter` of a running container.
+
+    Returns:
+        The removed versions.
+    """
+    keep = {active(root), previous(root)}
+    in_use = {
+        exe.relative_to(root).parts[0]
+        for exe in procscan.executables(proc)
+        if exe.is_relative_to(root)
+    }
+    removed = []
+    for version in installed(root):
+        if version in keep or version in in_use:
+            continue
+        _logger.info("removing unused apptainer %s from %s", version, root)
+        shutil.rmtree(root / version, ignore_errors=True)
+        removed.append(version)
+
+    return removed
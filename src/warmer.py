@@ -0,0 +1,277 @@
+# Copyright 2025 Vantage Compute Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Keep frequently launched images in page cache.
+
+The first launch of a multi-GB image after it was evicted from page cache reads
+the image from disk or the network, which dominates the startup of short steps.
+The warmer ranks images by how often they were launched, and asks the kernel to
+read the top images into page cache with `posix_fadvise(POSIX_FADV_WILLNEED)`
+until a memory budget is used. Warming stops while the node is under memory
+pressure, as reported by PSI, so it never competes with jobs for memory.
+"""
+
+import ctypes
+import functools
+import json
+import logging
+import mmap
+import os
+import stat
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+
+import launcher
+
+_logger = logging.getLogger(__name__)
+
+PSI_FILE = Path("/proc/pressure/memory")
+# Share of time in the last 10 seconds that some tasks stalled on memory, in percent,
+# above which images are not warmed.
+MAX_PRESSURE = 10.0
+# Images are read ahead in chunks, so that memory pressure is checked while a large
+# image is warmed.
+CHUNK_BYTES = 256 * 1024**2
+
+WARMED = "warmed"
+OVER_BUDGET = "over-budget"
+PRESSURE = "memory-pressure"
+FAILED = "failed"
+
+
+@dataclass(frozen=True)
+class Image:
+    """An image to keep in page cache.
+
+    Attributes:
+        path: Path of the image file.
+        launches: Number of launches of the image recorded in the launch log.
+        root: Directory the image file must be in, if the image was only found in
+            the launch log.
+    """
+
+    path: str
+    launches: int
+    root: str = ""
+
+
+@dataclass(frozen=True)
+class Warmed:
+    """Outcome of warming an image.
+
+    Attributes:
+        path: Path of the image file.
+        size: Size of the image in bytes.
+        resident: Fraction of the image in page cache after warming.
+        state: `warmed`, or why the image was not warmed.
+    """
+
+    path: str
+    size: int
+    resident: float
+    state: str
+
+    def dict(self) -> dict[str, str]:
+        """Get the outcome as action results."""
+        return {
+            "path": self.path,
+            "size": str(self.size),
+            "resident": f"{self.resident:.1%}",
+            "state": self.state,
+        }
+
+
+def rank(
+    images: list[str], top: int, cache_dir: str = "", launch_log: Path = launcher.LAUNCH_LOG
+) -> list[Image]:
+    """Rank images to keep in page cache.
+
+    Every user can write to the launch log, so the paths in it are not resolved, and
+    only the launched images in the stage cache are ranked after `images`.
+
+    Args:
+        images: Images to always keep in page cache, ranked first in the given order.
+        top: Number of the most launched images in the launch logs to rank after `images`.
+        cache_dir: Stage cache of the launch wrapper. No launched images are ranked
+            if unset.
+        launch_log: Launch log of the launch wrapper.
+
+    Returns:
+        Images in the order they are warmed in.
+    """
+    launches = Counter()
+    for log in (launch_log.with_name(f"{launch_log.name}.1"), launch_log):
+        try:
+            with log.open() as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        if record["event"] == "launch":
+                            launches[os.path.normpath(record["path"])] += 1
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            continue
+
+    ranked = {}
+    for path in (os.path.normpath(p) for p in images):
+        ranked.setdefault(path, Image(path=path, launches=launches[path]))
+
+    prefix = os.path.join(os.path.normpath(cache_dir), "") if cache_dir else None
+    for path, count in launches.most_common():
+        if top <= 0 or prefix is None:
+            break
+        if path not in ranked and path.startswith(prefix):
+            ranked[path] = Image(path=path, launches=count, root=os.path.realpath(cache_dir))
+            top -= 1
+
+    return list(ranked.values())
+
+
+def pressure(psi_file: Path = PSI_FILE) -> float:
+    """Get the share of time that some tasks stalled on memory in the last 10 seconds.
+
+    Returns:
+        The `some avg10` value of the memory PSI in percent, or 0 if PSI is not
+        available, e.g. if the kernel was built without it.
+    """
+    try:
+        for line in psi_file.read_text().splitlines():
+            kind, *fields = line.split()
+            if kind == "some":
+                return float(dict(f.split("=", 1) for f in fields)["avg10"])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    return 0.0
+
+
+@functools.cache
+def _libc() -> ctypes.CDLL:
+    """Get the C library with the signatures of `mmap(2)`, `mincore(2)`, and `munmap(2)`."""
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.mmap.restype = ctypes.c_void_p
+    libc.mmap.argtypes = [
+        ctypes.c_void_p,
+        ctypes.c_size_t,
+        ctypes.c_int,
+        ctypes.c_int,
+        ctypes.c_int,
+        ctypes.c_long,
+    ]
+    libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_char_p]
+    libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    return libc
+
+
+def _open(path: str, root: str = "") -> int:
+    """Open a regular file without blocking on FIFOs or following a final symlink.
+
+    Paths may come from the launch log, which every user can write to. The file is
+    checked with `lstat(2)` before it is opened, and the opened file must be the
+    same file, and be in `root` once the symlinks of its parent directories are
+    resolved by the kernel.
+    """
+    st = os.lstat(path)
+    if not stat.S_ISREG(st.st_mode):
+        raise OSError(f"{path} is not a regular file")
+
+    fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK | os.O_NOFOLLOW | os.O_CLOEXEC)
+    try:
+        opened = os.fstat(fd)
+        if (opened.st_dev, opened.st_ino) != (st.st_dev, st.st_ino):
+            raise OSError(f"{path} was replaced while it was opened")
+        if root and os.path.commonpath([os.readlink(f"/proc/self/fd/{fd}"), root]) != root:
+            raise OSError(f"{path} is not in {root}")
+    except OSError:
+        os.close(fd)
+        raise
+
+    return fd
+
+
+def _resident(fd: int, size: int) -> float:
+    """Get the fraction of an open file that is in page cache with `mincore(2)`."""
+    if size == 0:
+        return 1.0
+
+    libc = _libc()
+    addr = libc.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+    if addr in (None, ctypes.c_void_p(-1).value):
+        raise OSError(ctypes.get_errno(), "mmap failed")
+
+    try:
+        pages = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+        vec = ctypes.create_string_buffer(pages)
+        if libc.mincore(addr, size, vec) != 0:
+            raise OSError(ctypes.get_errno(), "mincore failed")
+    finally:
+        libc.munmap(addr, size)
+
+    return sum(b & 1 for b in vec.raw) / pages
+
+
+def warm(
+    images: list[Image],
+    max_bytes: int,
+    max_pressure: float = MAX_PRESSURE,
+    psi_file: Path = PSI_FILE,
+) -> list[Warmed]:
+    """Read images into page cache in rank order until the memory budget is used.
+
+    Images that do not fit in the remaining budget are skipped, so that smaller
+    images ranked after them are still warmed. With a budget of 0, no image is
+    warmed and only the page cache residency of the images is reported.
+
+    Args:
+        images: Ranked images to warm.
+        max_bytes: Memory budget for the warmed images.
+        max_pressure: Memory pressure above which warming stops, see `pressure(...)`.
+        psi_file: Memory PSI file of the kernel.
+
+    Returns:
+        The outcome of warming each image.
+    """
+    warmed, used = [], 0
+    for image in images:
+        try:
+            fd = _open(image.path, image.root)
+        except OSError as e:
+            _logger.warning("failed to warm image %s. reason: %s", image.path, e)
+            warmed.append(Warmed(image.path, 0, 0.0, FAILED))
+            continue
+
+        try:
+            size = os.fstat(fd).st_size
+            state = OVER_BUDGET if used + size > max_bytes else WARMED
+            offset = 0
+            while state == WARMED and offset < size:
+                if (psi := pressure(psi_file)) > max_pressure:
+                    _logger.info("memory pressure %.2f%%. not warming %s", psi, image.path)
+                    state = PRESSURE
+                    break
+                os.posix_fadvise(fd, offset, CHUNK_BYTES, os.POSIX_FADV_WILLNEED)
+                offset += CHUNK_BYTES
+            if state == WARMED:
+                used += size
+            warmed.append(Warmed(image.path, size, _resident(fd, size), state))
+        except OSError as e:
+            _logger.warning("failed to warm image %s. reason: %s", image.path, e)
+            warmed.append(Warmed(image.path, 0, 0.0, FAILED))
+        finally:
+            os.close(fd)
+
+    _logger.debug("warmed %d bytes of images into page cache", used)
+    return warmed
@@ -23,6 +23,7 @@ from pytest_mock import MockerFixture
 from slurmutils import OCIConfig
 
 import apptainer
+import backends
 import constants
 from charm import ApptainerCharm
 
@@ -51,12 +52,13 @@ def mock_ociconfig() -> OCIConfig:
 def mock_is_container(request, mocker: MockerFixture) -> None:
     mocker.patch("hpc_libs.is_container.is_container", request.param)
 
-    # The `apptainer` and `constants` modules must be reloaded because the value of
+    # The `apptainer`, `backends`, and `constants` modules must be reloaded because the value of
     # `APPTAINER_PACKAGES` constant is calculated when the unit tests are collected by
     # `pytest` before the patch to the `is_container` function is applied.
     # Reloading the modules within the test forces the `APPTAINER_PACKAGES` constant to be
     # re-calculated using the mocked return value of `is_container`.
     reload(constants)
+    reload(backends)
     reload(apptainer)
 
 
@@ -14,13 +14,23 @@
 
 """Unit tests for `apptainer` charm module."""
 
+import os
 import subprocess
+from pathlib import Path
 
 import charms.operator_libs_linux.v0.apt as apt
 import pytest
 from pytest_mock import MockerFixture
 
 import apptainer
+import aptrun
+import archive
+import backends
+import dpkglock
+import openpgp
+import runner
+import sources
+import versions
 
 
 def test_apptainer_ops_error() -> None:
@@ -42,15 +52,33 @@ def test_apptainer_ops_error() -> None:
 )
 def test_install(mocker: MockerFixture, mock_is_container, expected) -> None:
     """Test `apptainer.install()` function."""
-    mocker.patch.object(apt, "RepositoryMapping")
+    mocker.patch.object(dpkglock, "holders", return_value={})
+    mocker.patch.object(apt, "RepositoryMapping", side_effect=AssertionError("parsed sources"))
     mocker.patch.object(apt, "DebianRepository")
-    mocker.patch.object(apt, "update")
-    mock_add_package = mocker.patch.object(apt, "add_package")
-    mock_add_package.side_effect = [None, apt.PackageError("failed to install apptainer!!")]
+    mock_add_source = mocker.patch.object(sources, "add")
+    mock_import_key = mocker.patch.object(openpgp, "import_key")
+    mock_run = mocker.patch.object(aptrun, "run")
+    mock_run.side_effect = [
+        None,
+        None,
+        None,
+        aptrun.AptError(
+            100, ["apt-get", "install"], stderr="E: Unable to locate package apptainer-suid"
+        ),
+    ]
 
     # Test `apptainer.install()` succeeds without errors.
     apptainer.install()
-    assert mock_add_package.call_args[0][0] == expected
+    assert mock_run.call_args_list[0][0][0] == ["update"]
+    assert mock_run.call_args[0][0] == [
+        "install",
+        "--yes",
+        "--no-upgrade",
+        "--option=Dpkg::Options::=--force-confold",
+        *expected,
+    ]
+    mock_add_source.assert_called_once()
+    mock_import_key.assert_called_once()
 
     # Test `apptainer.install()` fails with the appropriate error message.
     with pytest.raises(apptainer.ApptainerOpsError) as exec_info:
@@ -59,7 +87,8 @@ def test_install(mocker: MockerFixture, mock_is_container, expected) -> None:
     assert exec_info.type == apptainer.ApptainerOpsError
     assert exec_info.value.args[0] == (
         f"failed to install apptainer packages `{expected}`. "
-        + "reason: failed to install apptainer!!"
+        + "reason: `apt-get install` failed with exit status 100: "
+        + "E: Unable to locate package apptainer-suid"
     )
 
 
@@ -73,22 +102,35 @@ def test_install(mocker: MockerFixture, mock_is_container, expected) -> None:
 )
 def test_upgrade(mocker: MockerFixture, mock_is_container, expected) -> None:
     """Test `apptainer.upgrade()` function."""
-    mock_deb_package = mocker.patch.object(apt.DebianPackage, "from_installed_package")
+    mocker.patch.object(dpkglock, "holders", return_value={})
+    mock_save = mocker.patch.object(archive, "save")
+    mock_unhold = mocker.patch.object(archive, "unhold")
+    mock_run = mocker.patch.object(aptrun, "run")
+    mock_run.side_effect = [
+        None,
+        subprocess.CalledProcessError(100, [], stderr="E: Unable to fetch some archives\n"),
+    ]
+    progress = []
 
     # Test `apptainer.upgrade()` succeeds without errors.
-    apptainer.upgrade()
+    apptainer.upgrade(lambda *args: progress.append(args))
+    assert mock_run.call_args[0][0][-len(expected) :] == expected
+    assert "--only-upgrade" in mock_run.call_args[0][0]
+    mock_run.call_args[0][1]("downloading", 50.0)
+    assert progress == [("downloading", 50.0)]
+    # The installed packages are archived before they are upgraded.
+    mock_save.assert_called_once_with(apptainer.APPTAINER_PACKAGES)
+    # Packages held by a rollback are released before they are upgraded.
+    mock_unhold.assert_called_once_with(apptainer.APPTAINER_PACKAGES)
 
     # Test `apptainer.upgrade()` fails with the appropriate error message.
-    mock_deb_package.side_effect = [
-        apt.PackageError("apptainer is not installed on the system :("),
-    ]
     with pytest.raises(apptainer.ApptainerOpsError) as exec_info:
         apptainer.upgrade()
 
     assert exec_info.type == apptainer.ApptainerOpsError
     assert exec_info.value.args[0] == (
         f"failed to upgrade packages `{expected}` to the latest version. "
-        + "reason: apptainer is not installed on the system :("
+        + "reason: E: Unable to fetch some archives"
     )
 
 
@@ -102,15 +144,26 @@ def test_upgrade(mocker: MockerFixture, mock_is_container, expected) -> None:
 )
 def test_remove(mocker: MockerFixture, mock_is_container, expected) -> None:
     """Test `apptainer.remove()` function."""
-    mock_remove_package = mocker.patch.object(apt, "remove_package")
-    mock_remove_package.side_effect = [
+    mocker.patch.object(dpkglock, "holders", return_value={})
+    mock_run = mocker.patch.object(runner, "run")
+    mock_run.side_effect = [
         None,
-        apt.PackageNotFoundError("no `apptainer` package found to remove :("),
+        subprocess.CalledProcessError(
+            100, [], stderr="E: Unable to locate package apptainer-suid\n"
+        ),
     ]
 
-    # Test `apptainer.remove()` succeeds without errors.
+    # Test `apptainer.remove()` removes all packages in a single transaction.
     apptainer.remove()
-    assert mock_remove_package.call_args[0][0] == expected
+    mock_run.assert_called_once()
+    assert mock_run.call_args[0][0] == [
+        "apt-get",
+        "remove",
+        "--yes",
+        "--quiet",
+        "--allow-change-held-packages",
+        *expected,
+    ]
 
     # Test `apptainer.remove()` fails with the appropriate error message.
     with pytest.raises(apptainer.ApptainerOpsError) as exec_info:
@@ -119,13 +172,32 @@ def test_remove(mocker: MockerFixture, mock_is_container, expected) -> None:
     assert exec_info.type == apptainer.ApptainerOpsError
     assert exec_info.value.args[0] == (
         f"failed to remove apptainer packages `{expected}`. "
-        + "reason: no `apptainer` package found to remove :("
+        + "reason: E: Unable to locate package apptainer-suid"
     )
 
 
+def test_cleanup(mocker: MockerFixture, tmp_path: Path) -> None:
+    """Test `apptainer.cleanup(...)` function."""
+    config_file = tmp_path / "apptainer.conf"
+    config_file.write_text("sessiondir max size = 64\n")
+    state_file = tmp_path / "apptainer.json"
+    state_file.write_text("{}")
+    mocker.patch.object(apptainer, "APPTAINER_CONFIG_FILE", config_file)
+
+    apptainer.update_config({"sessiondir max size": "128"}, file=config_file)
+    apptainer.cleanup(state_file)
+
+    assert config_file.read_text() == "sessiondir max size = 64\n"
+    assert not state_file.exists()
+
+    # Test that cleaning up twice, or after Apptainer was purged, succeeds.
+    config_file.unlink()
+    apptainer.cleanup(state_file)
+
+
 def test_version(mocker: MockerFixture) -> None:
     """Test `apptainer.version()` function."""
-    mock_run = mocker.patch.object(subprocess, "run")
+    mock_run = mocker.patch.object(runner, "run")
     mock_run.side_effect = [
         subprocess.CompletedProcess([], returncode=0, stdout="apptainer version 1.3.4"),
         FileNotFoundError("[Error 2] No such file or directory: 'apptainer'"),
@@ -161,7 +233,14 @@ def test_version(mocker: MockerFixture) -> None:
 
 def test_installed(mocker: MockerFixture) -> None:
     """Test `apptainer.installed()` function."""
-    mock_deb_package = mocker.patch.object(apt.DebianPackage, "from_installed_package")
+    mock_run = mocker.patch.object(runner, "run")
+    mock_run.side_effect = [
+        subprocess.CompletedProcess([], returncode=0, stdout="installed"),
+        subprocess.CompletedProcess([], returncode=0, stdout="installed"),
+        subprocess.CompletedProcess([], returncode=0, stdout="config-files"),
+        subprocess.CompletedProcess([], returncode=1, stdout=""),
+        runner.CommandTimeoutError(["dpkg-query"], 30),
+    ]
     mock_which = mocker.patch("shutil.which")
     mock_which.side_effect = ["/usr/bin/apptainer", None]
 
@@ -171,7 +250,193 @@ def test_installed(mocker: MockerFixture) -> None:
     # Test `apptainer.installed()` when `apptainer` package is installed, but not on `$PATH`.
     assert apptainer.installed() is False
 
-    mock_deb_package.side_effect = [apt.PackageNotFoundError("apptainer not found :(")]
+    # Test `apptainer.installed()` when `apptainer` package is removed or not installed.
+    assert apptainer.installed() is False
+    assert apptainer.installed() is False
 
-    # Test `apptainer.installed()` when `apptainer` package is not installed.
+    # Test `apptainer.installed()` when `dpkg-query` hangs.
     assert apptainer.installed() is False
+
+
+def test_binary(mocker: MockerFixture) -> None:
+    """Test `apptainer.binary()` and `apptainer.config_file()` functions."""
+    # Test that commands and configuration resolve through the active version.
+    mocker.patch.object(versions, "active", return_value="1.4.0")
+    assert apptainer.binary() == "/opt/apptainer/current/usr/bin/apptainer"
+    assert apptainer.config_file() == Path("/opt/apptainer/current/etc/apptainer/apptainer.conf")
+    mocker.patch.object(versions, "active", return_value=None)
+    assert apptainer.binary() == "apptainer"
+    assert apptainer.config_file() == apptainer.APPTAINER_CONFIG_FILE
+
+
+def test_rollback(mocker: MockerFixture, tmp_path: Path) -> None:
+    """Test `apptainer.rollback(...)` function."""
+    state_file = tmp_path / "state.json"
+    stamped = tmp_path / "sources.list"
+    stamped.write_text("deb http://ppa.launchpad.net/apptainer/ppa/ubuntu noble main\n")
+    apptainer._save_state(
+        state_file, {"packages": {"digest": "digest", "stamps": {str(stamped): [0, 0, 0]}}}
+    )
+    mocker.patch.object(versions, "active", return_value=None)
+    mocker.patch.object(archive, "installed_version", return_value="1.4.0")
+    mocker.patch.object(archive, "versions", return_value=["1.4.0", "1.3.6", "1.3.5"])
+    mock_restore = mocker.patch.object(archive, "restore")
+
+    # Test that the newest archived version other than the installed one is reinstalled.
+    assert apptainer.rollback(state_file=state_file) == "1.3.6"
+    mock_restore.assert_called_once_with("1.3.6")
+    assert apptainer._load_state(state_file)["packages"]["stamps"] == {
+        str(stamped): apptainer._stamp(stamped)
+    }
+
+    assert apptainer.rollback("1.3.5", state_file=state_file) == "1.3.5"
+    mock_restore.assert_called_with("1.3.5")
+
+    # Test that rolling back fails if there is nothing to roll back to.
+    mocker.patch.object(archive, "versions", return_value=["1.4.0"])
+    with pytest.raises(apptainer.ApptainerOpsError) as exec_info:
+        apptainer.rollback(state_file=state_file)
+
+    assert exec_info.value.message == "no archived apptainer version to roll back to"
+
+    mock_restore.side_effect = archive.ArchiveError("apptainer 1.2.0 is not in the archive")
+    with pytest.raises(apptainer.ApptainerOpsError) as exec_info:
+        apptainer.rollback("1.2.0", state_file=state_file)
+
+    assert exec_info.value.message == (
+        "failed to roll back apptainer. reason: apptainer 1.2.0 is not in the archive"
+    )
+
+    # Test that versioned installs switch back to the previous version.
+    mocker.patch.object(versions, "active", return_value="1.4.0")
+    mocker.patch.object(versions, "rollback", return_value="1.3.6")
+    assert apptainer.rollback(state_file=state_file) == "1.3.6"
+    with pytest.raises(apptainer.ApptainerOpsError):
+        apptainer.rollback("1.3.5", state_file=state_file)
+
+
+def test_update_config(tmp_path: Path) -> None:
+    """Test `apptainer.update_config(...)` function."""
+    config = tmp_path / "apptainer.conf"
+    original = "allow setuid = yes\n# sessiondir max size = 64\nsessiondir max size = 64\n"
+    config.write_text(original)
+
+    # Test that managed options override options set in the rest of the file.
+    assert apptainer.update_config(
+        {"sessiondir max size": "1024", "bind path": ["/opt/a", "/opt/b"]}, file=config
+    )
+    assert config.read_text() == (
+        "allow setuid = yes\n"
+        "# sessiondir max size = 64\n"
+        "#juju# sessiondir max size = 64\n"
+        "# BEGIN juju managed options\n"
+        "sessiondir max size = 1024\n"
+        "bind path = /opt/a\n"
+        "bind path = /opt/b\n"
+        "# END juju managed options\n"
+    )
+
+    # Test that the file is not rewritten if nothing has changed.
+    assert not apptainer.update_config(
+        {"sessiondir max size": "1024", "bind path": ["/opt/a", "/opt/b"]}, file=config
+    )
+
+    # Test that the site's values of an option are read back, including overridden ones.
+    assert apptainer.site_config("sessiondir max size", file=config) == ["64"]
+    assert apptainer.site_config("bind path", file=config) == []
+    assert apptainer.site_config("bind path", file=tmp_path / "missing.conf") is None
+
+    # Test that the original file is restored once no options are managed.
+    assert apptainer.update_config({}, file=config)
+    assert config.read_text() == original
+
+    # Test that a missing configuration file is reported.
+    with pytest.raises(apptainer.ApptainerOpsError):
+        apptainer.update_config({}, file=tmp_path / "missing.conf")
+
+
+def test_reconcile(mocker: MockerFixture, tmp_path: Path) -> None:
+    """Test `apptainer.reconcile(...)` and `apptainer.reconciled(...)` functions."""
+    state_file = tmp_path / "state" / "apptainer.json"
+    key, source = tmp_path / "ppa.gpg", tmp_path / "ppa.list"
+    dpkg_list = tmp_path / "apptainer.list"
+    config_file = tmp_path / "apptainer.conf"
+    config_file.write_text("allow setuid = yes\n")
+    mocker.patch("distro.codename", return_value="noble")
+    mocker.patch.object(apptainer, "APPTAINER_CONFIG_FILE", config_file)
+
+    def _add_ppa(_):
+        key.write_bytes(b"key")
+        source.write_text("deb ...\n")
+        return [key, source]
+
+    def _install_packages(_):
+        dpkg_list.write_text("/usr/bin/apptainer\n")
+        return [dpkg_list]
+
+    mock_add_ppa = mocker.patch.object(backends, "_add_ppa", side_effect=_add_ppa)
+    mock_install = mocker.patch.object(backends.PPA, "_install", side_effect=_install_packages)
+
+    assert apptainer.reconciled(state_file) is False
+    assert apptainer.reconcile({"sessiondir max size": "64"}, state_file) == [
+        "ppa",
+        "packages",
+        "config",
+    ]
+    assert "sessiondir max size = 64" in config_file.read_text()
+    assert apptainer.reconciled(state_file) is True
+
+    # Test that nothing is applied if nothing has changed.
+    assert apptainer.reconcile({"sessiondir max size": "64"}, state_file) == []
+    assert mock_add_ppa.call_count == 1
+    assert mock_install.call_count == 1
+
+    # Test that only the steps whose inputs or files have changed are applied.
+    assert apptainer.reconcile({"sessiondir max size": "128"}, state_file) == ["config"]
+
+    # Test that the managed options are applied again once an upgrade or another tarball
+    # activates a version with a stock `apptainer.conf`.
+    stock = tmp_path / "stock.conf"
+    stock.write_text("allow setuid = yes\n")
+    os.replace(stock, config_file)
+    assert apptainer.reconcile({"sessiondir max size": "128"}, state_file) == ["config"]
+    assert "sessiondir max size = 128" in config_file.read_text()
+
+    dpkg_list.unlink()
+    assert apptainer.reconciled(state_file) is False
+    assert apptainer.reconcile(None, state_file) == ["packages"]
+    source.write_text("deb ... main universe\n")
+    assert apptainer.reconcile(None, state_file) == ["ppa"]
+
+    # Test that a failed step is reported, and that the steps before it are cached.
+    source.unlink()
+    dpkg_list.unlink()
+    mock_install.side_effect = apt.PackageError("failed to install apptainer!!")
+    with pytest.raises(apptainer.ApptainerOpsError) as exec_info:
+        apptainer.reconcile(None, state_file)
+
+    assert exec_info.value.message == (
+        "failed to reconcile apptainer packages. reason: failed to install apptainer!!"
+    )
+    mock_add_ppa.reset_mock()
+    with pytest.raises(apptainer.ApptainerOpsError):
+        apptainer.reconcile(None, state_file)
+
+    mock_add_ppa.assert_not_called()
+
+    # Test that the backend and the outcome of its last operation are recorded.
+    assert apptainer.report(state_file) == {
+        "backend": "ppa",
+        "installed": "false",
+        "layout": "packages",
+        "operation": "install",
+        "succeeded": "false",
+        "seconds": "0.0",
+    }
+
+    # Test that switching backends reinstalls Apptainer, without the PPA step.
+    mocker.patch.object(backends.Tarball, "_install", side_effect=_install_packages)
+    tarball = backends.get("tarball", str(tmp_path / "apptainer.tar.gz"))
+    assert apptainer.reconcile(None, state_file, backend=tarball) == ["packages"]
+    assert apptainer.reconciled(state_file) is True
+    assert apptainer.report(state_file)["backend"] == "tarball"
@@ -0,0 +1,82 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `aptrun` charm module."""
+
+from pathlib import Path
+
+import pytest
+
+import aptrun
+
+FAKE_APT_GET = """#!/bin/sh
+echo "Reading package lists..."
+echo "dlstatus:1:10.0:Retrieving file 1 of 2"
+echo "dlstatus:1:10.4:Retrieving file 1 of 2"
+echo "dlstatus:2:60.0:Retrieving file 2 of 2"
+echo "pmstatus:apptainer:0.0:Preparing apptainer (amd64)"
+echo "pmstatus:apptainer:50.0:Unpacking apptainer (amd64)"
+i=0
+while [ $i -lt 200 ]; do echo "Setting up line $i"; i=$((i + 1)); done
+if [ "$FAIL" = 1 ]; then
+    echo "E: Sub-process /usr/bin/dpkg returned an error code (1)" >&2
+    exit 100
+fi
+"""
+
+
+@pytest.fixture
+def apt_get(tmp_path: Path, monkeypatch) -> str:
+    """Create a fake `apt-get` that reports progress on its status file descriptor."""
+    script = tmp_path / "apt-get"
+    script.write_text(FAKE_APT_GET)
+    script.chmod(0o755)
+    monkeypatch.delenv("FAIL", raising=False)
+    return str(script)
+
+
+def test_run(apt_get: str, monkeypatch) -> None:
+    """Test `aptrun.run(...)` function."""
+    progress = []
+    aptrun.run(["install", "apptainer"], lambda *args: progress.append(args), apt_get=apt_get)
+
+    # Progress is throttled within a phase, but every phase change is reported.
+    assert progress == [("downloading", 10.0), ("installing", 0.0)]
+
+    progress.clear()
+    aptrun.run(["install"], lambda *args: progress.append(args), interval=0, apt_get=apt_get)
+    assert progress == [
+        ("downloading", 10.0),
+        ("downloading", 60.0),
+        ("installing", 0.0),
+        ("installing", 50.0),
+    ]
+
+    # Test that only the last lines of output are kept if `apt-get` fails.
+    monkeypatch.setenv("FAIL", "1")
+    with pytest.raises(aptrun.AptError) as exec_info:
+        aptrun.run(["install", "--yes", "apptainer"], tail=5, apt_get=apt_get)
+
+    assert exec_info.value.returncode == 100
+    assert exec_info.value.stderr.splitlines() == [
+        "Setting up line 196",
+        "Setting up line 197",
+        "Setting up line 198",
+        "Setting up line 199",
+        "E: Sub-process /usr/bin/dpkg returned an error code (1)",
+    ]
+    assert str(exec_info.value) == (
+        "`apt-get install` failed with exit status 100: "
+        + "E: Sub-process /usr/bin/dpkg returned an error code (1)"
+    )
@@ -0,0 +1,130 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `archive` charm module."""
+
+import os
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+import archive
+import dpkglock
+import runner
+
+
+def test_installed_version(mocker: MockerFixture) -> None:
+    """Test `archive.installed_version(...)` function."""
+    mock_run = mocker.patch.object(runner, "run")
+    mock_run.side_effect = [
+        subprocess.CompletedProcess([], 0, stdout="installed 1.3.6-1~noble"),
+        subprocess.CompletedProcess([], 0, stdout="config-files 1.3.6-1~noble"),
+        subprocess.CompletedProcess([], 1, stdout=""),
+    ]
+
+    assert archive.installed_version("apptainer") == "1.3.6-1~noble"
+    assert archive.installed_version("apptainer") is None
+    assert archive.installed_version("apptainer") is None
+
+
+def test_save(mocker: MockerFixture, tmp_path: Path) -> None:
+    """Test `archive.save(...)` function."""
+    archive_dir, cache_dir = tmp_path / "archive", tmp_path / "cache"
+    cache_dir.mkdir()
+    (cache_dir / "apptainer_1%3a1.3.6_amd64.deb").write_bytes(b"apptainer")
+    installed = {"apptainer": "1:1.3.6", "apptainer-suid": "1:1.3.6"}
+    mocker.patch.object(archive, "installed_version", side_effect=installed.get)
+
+    # `apptainer-suid` is not in the apt cache, so it is rebuilt with `dpkg-repack`.
+    def _repack(cmd, *_, cwd, **__):
+        (cwd / f"{cmd[1]}_1%3a1.3.6_amd64.deb").write_bytes(b"repacked")
+
+    mock_run = mocker.patch.object(runner, "run", side_effect=_repack)
+    mocker.patch.object(shutil, "which", return_value="/usr/bin/dpkg-repack")
+
+    assert archive.save(["apptainer", "apptainer-suid"], archive_dir, cache_dir) == "1:1.3.6"
+    assert sorted(p.name for p in (archive_dir / "1:1.3.6").iterdir()) == [
+        "apptainer-suid_1%3a1.3.6_amd64.deb",
+        "apptainer_1%3a1.3.6_amd64.deb",
+    ]
+    assert mock_run.call_args[0][0] == ["dpkg-repack", "apptainer-suid"]
+
+    # Test that only the most recently archived versions are kept.
+    for i, version in enumerate(("1.2.0", "1.3.0", "1.3.5")):
+        (archive_dir / version).mkdir()
+        os.utime(archive_dir / version, (i, i))
+    assert archive.save(["apptainer", "apptainer-suid"], archive_dir, cache_dir, keep=3)
+    assert archive.versions(archive_dir) == ["1:1.3.6", "1.3.5", "1.3.0"]
+
+    # Test that nothing is archived if Apptainer is not installed.
+    installed.clear()
+    assert archive.save(["apptainer"], archive_dir, cache_dir) is None
+
+    # Test that `dpkg-repack` is installed if it is missing.
+    mocker.patch.object(dpkglock, "holders", return_value={})
+    mocker.patch.object(shutil, "which", return_value=None)
+    mock_run.side_effect = lambda cmd, *args, cwd=None, **kwargs: (
+        _repack(cmd, cwd=cwd) if cwd else None
+    )
+    installed["apptainer"] = "1.3.7"
+    assert archive.save(["apptainer"], archive_dir, tmp_path / "empty") == "1.3.7"
+    assert [call[0][0][:2] for call in mock_run.call_args_list[-2:]] == [
+        ["apt-get", "install"],
+        ["dpkg-repack", "apptainer"],
+    ]
+
+    # Test that a failure to repack is reported, and leaves no partial archive behind.
+    installed["apptainer"] = "1.4.0"
+    mock_run.side_effect = subprocess.CalledProcessError(1, [], stderr="dpkg-repack: not found")
+    with pytest.raises(archive.ArchiveError):
+        archive.save(["apptainer"], archive_dir, cache_dir)
+
+    assert not (archive_dir / "1.4.0").exists()
+    assert not (archive_dir / ".1.4.0.tmp").exists()
+
+
+def test_restore(mocker: MockerFixture, tmp_path: Path) -> None:
+    """Test `archive.restore(...)` function."""
+    mocker.patch.object(dpkglock, "holders", return_value={})
+    mock_run = mocker.patch.object(runner, "run")
+    deb = tmp_path / "1.3.6" / "apptainer_1.3.6_amd64.deb"
+    deb.parent.mkdir()
+    deb.touch()
+
+    archive.restore("1.3.6", tmp_path)
+    assert [call[0][0] for call in mock_run.call_args_list] == [
+        ["dpkg", "--install", "--force-confold", str(deb)],
+        # Test that the reinstalled packages are held.
+        ["apt-mark", "hold", "apptainer"],
+    ]
+
+    archive.unhold(["apptainer"])
+    assert mock_run.call_args[0][0] == ["apt-mark", "unhold", "apptainer"]
+
+    with pytest.raises(archive.ArchiveError) as exec_info:
+        archive.restore("1.2.0", tmp_path)
+
+    assert exec_info.value.message == f"apptainer 1.2.0 is not in the archive {tmp_path}"
+
+    mock_run.side_effect = subprocess.CalledProcessError(1, [], stderr="dpkg: error processing\n")
+    with pytest.raises(archive.ArchiveError) as exec_info:
+        archive.restore("1.3.6", tmp_path)
+
+    assert (
+        exec_info.value.message
+        == "failed to reinstall apptainer 1.3.6. reason: dpkg: error processing"
+    )
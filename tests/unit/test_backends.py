@@ -0,0 +1,153 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `backends` charm module."""
+
+import subprocess
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+import aptrun
+import archive
+import backends
+import dpkglock
+import runner
+import versions
+
+
+def test_get() -> None:
+    """Test `backends.get(...)` function."""
+    backend = backends.get("local-debs", "/srv/apptainer")
+    assert isinstance(backend, backends.LocalDebs)
+    assert backend.spec() == {
+        "name": "local-debs",
+        "source": "/srv/apptainer",
+        "layout": "packages",
+    }
+    assert backends.get(**backend.spec()).spec() == backend.spec()
+
+    with pytest.raises(backends.BackendError) as exec_info:
+        backends.get("snap")
+
+    assert exec_info.value.message == (
+        "unknown install backend `snap`. expected one of ['ppa', 'local-debs', 'tarball']"
+    )
+
+
+def test_ppa_versioned(mocker: MockerFixture, tmp_path: Path) -> None:
+    """Test installing Apptainer side by side with the `versioned` layout of the PPA."""
+    mocker.patch.object(dpkglock, "holders", return_value={})
+    mock_run = mocker.patch.object(aptrun, "run")
+    mocker.patch.object(versions, "download", return_value=[tmp_path / "apptainer.deb"])
+    mocker.patch.object(versions, "field", return_value="squashfs-tools, fuse2fs")
+    mocker.patch.object(versions, "unpack", return_value="1.4.0")
+    mock_activate = mocker.patch.object(versions, "activate")
+    mock_gc = mocker.patch.object(versions, "gc")
+
+    backend = backends.PPA(layout="versioned")
+    assert backend.install() == [versions.ROOT / "1.4.0" / "usr" / "bin" / "apptainer"]
+    # Dependencies are installed system-wide before the version is activated.
+    assert [call[0][0] for call in mock_run.call_args_list] == [
+        ["update"],
+        ["satisfy", "--yes", "squashfs-tools, fuse2fs"],
+    ]
+    mock_activate.assert_called_once_with("1.4.0")
+    mock_gc.assert_called_once()
+    assert backend.last is not None
+    assert (backend.last.backend, backend.last.operation, backend.last.ok) == (
+        "ppa",
+        "install",
+        True,
+    )
+
+
+def test_local_debs(mocker: MockerFixture, tmp_path: Path) -> None:
+    """Test installing Apptainer from packages in a local directory."""
+    mocker.patch.object(dpkglock, "holders", return_value={})
+    mocker.patch.object(versions, "deactivate")
+    mock_save = mocker.patch.object(archive, "save")
+    mocker.patch.object(archive, "unhold")
+    mock_run = mocker.patch.object(aptrun, "run")
+    deb = tmp_path / "apptainer_1.4.0_amd64.deb"
+    deb.write_bytes(b"apptainer")
+    backend = backends.get("local-debs", str(tmp_path))
+
+    files = backend.install()
+    assert mock_run.call_args[0][0] == [
+        "install",
+        "--yes",
+        "--no-upgrade",
+        "--option=Dpkg::Options::=--force-confold",
+        str(deb),
+    ]
+    assert [f.name for f in files] == ["apptainer.list"]
+
+    # Test that the install is repeated when a package is replaced.
+    inputs = backend.inputs()
+    deb.write_bytes(b"apptainer 1.4.1")
+    assert backend.inputs() != inputs
+
+    # Test that the installed packages are archived before they are upgraded.
+    backend.upgrade()
+    mock_save.assert_called_once()
+    assert "--no-upgrade" not in mock_run.call_args[0][0]
+    assert backend.last is not None and backend.last.operation == "upgrade"
+
+    # Test that the install fails, and is reported as failed, without any packages.
+    deb.unlink()
+    with pytest.raises(backends.BackendError) as exec_info:
+        backend.install()
+
+    assert exec_info.value.message == f"no packages found in `{tmp_path}`"
+    assert backend.last is not None and backend.last.ok is False
+    assert backend.inputs() == []
+
+
+def test_tarball(mocker: MockerFixture, tmp_path: Path) -> None:
+    """Test installing Apptainer from a relocatable tarball."""
+    mock_retry = mocker.patch.object(dpkglock, "retry")
+    mock_extract = mocker.patch.object(versions, "extract", return_value="1.4.0")
+    mock_activate = mocker.patch.object(versions, "activate")
+    mocker.patch.object(versions, "gc")
+    tarball = tmp_path / "apptainer.tar.gz"
+    tarball.write_bytes(b"tarball")
+    backend = backends.get("tarball", str(tarball))
+
+    assert backend.steps()[0][0] == "packages"
+    assert backend.install() == [versions.ROOT / "1.4.0" / "usr" / "bin" / "apptainer"]
+    mock_extract.assert_called_once_with(tarball)
+    mock_activate.assert_called_once_with("1.4.0")
+    # The tarball is installed without taking the dpkg lock.
+    mock_retry.assert_not_called()
+
+    mock_deactivate = mocker.patch.object(versions, "deactivate")
+    backend.remove()
+    mock_deactivate.assert_called_once()
+
+    with pytest.raises(backends.BackendError):
+        backends.get("tarball").install()
+
+
+def test_remove(mocker: MockerFixture) -> None:
+    """Test removing the Apptainer packages."""
+    mocker.patch.object(dpkglock, "holders", return_value={})
+    mock_run = mocker.patch.object(runner, "run")
+    mock_run.side_effect = subprocess.CalledProcessError(100, [], stderr="E: dpkg was interrupted")
+
+    with pytest.raises(subprocess.CalledProcessError):
+        backends.get("local-debs", "/srv/apptainer").remove()
+
+    assert mock_run.call_args[0][0][:3] == ["apt-get", "remove", "--yes"]
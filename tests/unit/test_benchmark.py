@@ -0,0 +1,121 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `benchmark` charm module."""
+
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+import benchmark
+import runner
+import versions
+
+
+@pytest.fixture(scope="function")
+def mock_apptainer(tmp_path: Path) -> Path:
+    """Create a stand-in `apptainer` executable that fails when asked to run `false`."""
+    apptainer = tmp_path / "bin" / "apptainer"
+    apptainer.parent.mkdir()
+    apptainer.write_text(
+        "#!/bin/sh\n"
+        'echo "DEBUG   Attaching loop device" >&2\n'
+        'echo "DEBUG   Attached loop device /dev/loop0" >&2\n'
+        'for arg; do [ "$arg" = false ] && exit 1; done\n'
+        "exit 0\n"
+    )
+    apptainer.chmod(0o755)
+    return apptainer
+
+
+def test_percentile() -> None:
+    """Test `benchmark.percentile(...)` function."""
+    values = [float(i) for i in range(1, 101)]
+
+    assert benchmark.percentile(values, 50) == 50.0
+    assert benchmark.percentile(values, 95) == 95.0
+    assert benchmark.percentile(values, 99) == 99.0
+    assert benchmark.percentile([3.0], 99) == 3.0
+    assert benchmark.percentile([], 50) == 0.0
+
+
+def test_command() -> None:
+    """Test `benchmark.command(...)` function."""
+    assert benchmark.command("apptainer exec --userns %r %@", "/tmp/a.sif", ["true", "-v"]) == [
+        "apptainer",
+        "exec",
+        "--userns",
+        "/tmp/a.sif",
+        "true",
+        "-v",
+    ]
+
+
+def test_build_image(mocker: MockerFixture, tmp_path: Path) -> None:
+    """Test `benchmark.build_image(...)` function under the versioned layout."""
+    mocker.patch.object(versions, "active", return_value="1.4.0")
+    mock_run = mocker.patch.object(runner, "run")
+    mock_run.return_value = subprocess.CompletedProcess([], returncode=0, stdout="")
+
+    image = benchmark.build_image(tmp_path)
+
+    assert image == tmp_path / "benchmark.sif"
+    assert (tmp_path / "rootfs" / str(shutil.which("true")).lstrip("/")).is_file()
+    assert mock_run.call_args[0][0] == [
+        str(versions.binary()),
+        "build",
+        "--force",
+        str(image),
+        str(tmp_path / "rootfs"),
+    ]
+
+
+def test_launch(mock_apptainer: Path) -> None:
+    """Test `benchmark.launch(...)` function."""
+    sample = benchmark.launch([str(mock_apptainer), "exec", "image.sif", "true"])
+    assert sample.returncode == 0
+    assert sample.latency > 0
+    assert sample.loop_wait == 0
+
+    sample = benchmark.launch([str(mock_apptainer), "exec", "image.sif", "true"], debug=True)
+    assert sample.returncode == 0
+    assert sample.loop_wait >= 0
+
+    sample = benchmark.launch([str(mock_apptainer), "exec", "image.sif", "false"])
+    assert sample.returncode == 1
+
+    sample = benchmark.launch(["/nonexistent/apptainer", "exec", "image.sif", "true"])
+    assert sample.returncode == -1
+
+
+def test_run(mock_apptainer: Path) -> None:
+    """Test `benchmark.run(...)` function."""
+    reports = benchmark.run(f"{mock_apptainer} exec --userns %r %@", "image.sif", 5, 2)
+
+    assert set(reports) == {"serial", "concurrent"}
+    for report in reports.values():
+        assert report.launches == 5
+        assert report.failures == 0
+        assert report.p50 <= report.p95 <= report.p99
+        assert set(report.dict()) == {
+            "launches",
+            "failures",
+            "p50-ms",
+            "p95-ms",
+            "p99-ms",
+            "loop-wait-ms",
+        }
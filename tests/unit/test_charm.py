@@ -14,6 +14,9 @@
 
 """Unit tests for the `apptainer` charm."""
 
+import dataclasses
+import json
+import os
 from collections import defaultdict
 
 import ops
@@ -23,33 +26,134 @@ from ops import testing
 from slurmutils import OCIConfig
 
 import apptainer
-from constants import OCI_RUNTIME_INTEGRATION_NAME
+import backends
+import benchmark
+import integrity
+import launcher
+import loopdev
+import pool
+import procscan
+import runner
+import scheduler
+import scratch
+import slurm
+import subid
+import tuning
+import warmer
+from constants import OCI_RUNTIME_INTEGRATION_NAME, PEER_INTEGRATION_NAME
+from rollout import Rollout
 
 
 @pytest.mark.parametrize(
-    "mock_install,expected",
+    "mock_install,attempts,expected",
     (
-        pytest.param(lambda: None, ops.ActiveStatus(), id="success"),
+        pytest.param(lambda: None, 0, ops.ActiveStatus(), id="success"),
         pytest.param(
             lambda: (_ for _ in ()).throw(apptainer.ApptainerOpsError("install failed")),
-            ops.BlockedStatus("Failed to install Apptainer. See `juju debug-log` for details."),
+            0,
+            ops.WaitingStatus("Failed to install Apptainer. Retrying (1/10)"),
             id="fail",
         ),
+        pytest.param(
+            lambda: (_ for _ in ()).throw(apptainer.ApptainerOpsError("install failed")),
+            9,
+            ops.BlockedStatus(
+                "Failed to install Apptainer after 10 attempts. See `juju debug-log` for details."
+            ),
+            id="fail after retry budget",
+        ),
+        pytest.param(
+            lambda: (_ for _ in ()).throw(runner.CommandTimeoutError(["apt-get", "update"], 1800)),
+            0,
+            ops.BlockedStatus("`apt-get` timed out installing Apptainer. Retrying (1/10)"),
+            id="timeout",
+        ),
     ),
 )
-def test_on_install(monkeypatch, mock_charm, mock_install, expected) -> None:
+def test_on_install(monkeypatch, mock_charm, mock_install, attempts, expected) -> None:
     """Test the `_on_install` event handler."""
-    monkeypatch.setattr(apptainer, "install", mock_install)
+    scheduled = []
+    monkeypatch.setattr(apptainer, "reconcile", lambda *_, **__: mock_install())
     monkeypatch.setattr(apptainer, "installed", lambda: True)
     monkeypatch.setattr(apptainer, "version", lambda: "1.3.4")
+    monkeypatch.setattr(scheduler, "schedule", lambda *args: scheduled.append(args))
+    monkeypatch.setattr(scheduler, "cancel", lambda *_: None)
 
-    state = mock_charm.run(mock_charm.on.install(), testing.State())
+    stored = testing.StoredState(
+        owner_path="ApptainerCharm",
+        content={"install_attempts": attempts, "install_retry_at": 0.0},
+    )
+    state = mock_charm.run(mock_charm.on.install(), testing.State(stored_states={stored}))
 
     assert state.unit_status == expected
-    if isinstance(expected, ops.BlockedStatus):
-        assert len(state.deferred) == 1
+    # Verify that failed installs are retried by a timer instead of deferring the event.
+    assert len(state.deferred) == 0
+    content = state.get_stored_state("_stored", owner_path="ApptainerCharm").content
+    if expected.message.endswith("Retrying (1/10)"):
+        assert content["install_attempts"] == 1
+        assert content["install_retry_at"] > 0
+        assert [(unit, event) for unit, event, *_ in scheduled] == [
+            ("apptainer/0", "install-retry")
+        ]
     else:
-        assert len(state.deferred) == 0
+        assert content["install_attempts"] == (0 if attempts == 0 else 10)
+        assert scheduled == []
+
+
+def test_on_install_retry_unavailable(monkeypatch, mock_charm) -> None:
+    """Test that the install event is deferred if the retry timer cannot be started."""
+
+    def _schedule(*_):
+        raise scheduler.SchedulerError("systemd-run not found")
+
+    monkeypatch.setattr(
+        apptainer,
+        "reconcile",
+        lambda *_, **__: (_ for _ in ()).throw(apptainer.ApptainerOpsError("install failed")),
+    )
+    monkeypatch.setattr(apptainer, "installed", lambda: False)
+    monkeypatch.setattr(scheduler, "schedule", _schedule)
+
+    state = mock_charm.run(mock_charm.on.install(), testing.State())
+
+    assert state.unit_status == ops.WaitingStatus("Failed to install Apptainer. Retrying (1/10)")
+    assert len(state.deferred) == 1
+
+
+def test_on_install_retry(monkeypatch, mock_charm) -> None:
+    """Test that the `install-retry` event dispatched by the timer retries the install."""
+    reconciled, installed = [], []
+    monkeypatch.setattr(apptainer, "reconcile", lambda o, **_: reconciled.append(o))
+    monkeypatch.setattr(apptainer, "installed", lambda: True)
+    monkeypatch.setattr(apptainer, "version", lambda: "1.3.4")
+    monkeypatch.setattr(scheduler, "cancel", lambda *_: None)
+    monkeypatch.setattr(launcher, "install", lambda: installed.append(True))
+    monkeypatch.setattr(pool, "reconcile", lambda *_, **__: {})
+
+    oci_runtime_integration = testing.Relation(
+        endpoint=OCI_RUNTIME_INTEGRATION_NAME,
+        interface="slurm-oci-runtime",
+        remote_app_name="slurmctld",
+    )
+    stored = testing.StoredState(
+        owner_path="ApptainerCharm",
+        content={"install_attempts": 3, "install_retry_at": 1.0},
+    )
+    state = testing.State(relations={oci_runtime_integration}, stored_states={stored}, leader=True)
+    # `ctx.on.custom(...)` only runs events of charm libraries, so the event is emitted on
+    # the charm like the dispatch of the timer, inside a hook the charm does not observe.
+    with mock_charm(mock_charm.on.leader_elected(), state) as manager:
+        manager.charm.on.install_retry.emit()
+        state = manager.run()
+
+    assert state.unit_status == ops.ActiveStatus()
+    assert state.workload_version == "1.3.4"
+    # Verify that the unit is configured like in `config-changed` once Apptainer is installed.
+    assert len(reconciled) == 2
+    assert installed == [True]
+    assert "ociconfig" in state.get_relation(oci_runtime_integration.id).local_app_data
+    content = state.get_stored_state("_stored", owner_path="ApptainerCharm").content
+    assert content["install_attempts"] == 0
 
 
 @pytest.mark.parametrize(
@@ -66,13 +170,67 @@ def test_on_install(monkeypatch, mock_charm, mock_install, expected) -> None:
 def test_on_stop(monkeypatch, mock_charm, mock_remove, expected) -> None:
     """Test the `_on_stop` event handler."""
     monkeypatch.setattr(apptainer, "remove", mock_remove)
+    monkeypatch.setattr(apptainer, "cleanup", lambda: None)
     monkeypatch.setattr(apptainer, "installed", lambda: False)
+    monkeypatch.setattr(launcher, "uninstall", lambda: None)
+    monkeypatch.setattr(pool, "reconcile", lambda *_, **__: {})
+    monkeypatch.setattr(procscan, "scan", lambda: [])
+    monkeypatch.setattr(scheduler, "cancel", lambda *_: None)
 
     state = mock_charm.run(mock_charm.on.stop(), testing.State())
 
     assert state.unit_status == expected
 
 
+@pytest.mark.parametrize(
+    "policy,expected",
+    (
+        pytest.param(
+            "full",
+            ["scan", "pool", "scratch", "remove", "cleanup", "uninstall"],
+            id="full",
+        ),
+        pytest.param(
+            "keep-packages", ["pool", "scratch", "cleanup", "uninstall"], id="keep-packages"
+        ),
+        pytest.param("skip", [], id="skip"),
+    ),
+)
+def test_on_stop_teardown_policy(monkeypatch, mock_charm, policy, expected) -> None:
+    """Test that the `_on_stop` event handler follows the teardown policy."""
+    calls = []
+    monkeypatch.setattr(apptainer, "remove", lambda: calls.append("remove"))
+    monkeypatch.setattr(apptainer, "cleanup", lambda: calls.append("cleanup"))
+    monkeypatch.setattr(apptainer, "installed", lambda: True)
+    monkeypatch.setattr(launcher, "uninstall", lambda: calls.append("uninstall"))
+    monkeypatch.setattr(pool, "reconcile", lambda *_, **__: calls.append("pool") or {})
+    monkeypatch.setattr(procscan, "scan", lambda: calls.append("scan") or [])
+    monkeypatch.setattr(scheduler, "cancel", lambda *_: None)
+    monkeypatch.setattr(scratch, "teardown", lambda _: calls.append("scratch"))
+
+    mock_charm.run(
+        mock_charm.on.stop(),
+        testing.State(
+            config={"teardown-policy": policy, "tmp-dir": "/scratch/apptainer", "tmp-size": "8G"}
+        ),
+    )
+
+    assert calls == expected
+
+
+def test_on_stop_busy(monkeypatch, mock_charm) -> None:
+    """Test that Apptainer is not removed while containers are running."""
+    removed = []
+    monkeypatch.setattr(apptainer, "remove", lambda: removed.append(True))
+    monkeypatch.setattr(pool, "reconcile", lambda *_, **__: {})
+    monkeypatch.setattr(procscan, "scan", lambda: [procscan.Container(pid=4242)])
+
+    state = mock_charm.run(mock_charm.on.stop(), testing.State())
+
+    assert state.unit_status == ops.BlockedStatus("Apptainer not removed: 1 containers running")
+    assert removed == []
+
+
 @pytest.mark.parametrize(
     "leader", (pytest.param(True, id="unit_leader"), pytest.param(False, id="not_unit_leader"))
 )
@@ -134,11 +292,840 @@ def test_on_upgrade(
     expected_version,
 ) -> None:
     """Test the `_on_upgrade` action event handler."""
-    monkeypatch.setattr(apptainer, "upgrade", mock_upgrade)
+    monkeypatch.setattr(apptainer, "upgrade", lambda _: mock_upgrade())
+    monkeypatch.setattr(apptainer, "reconcile", lambda *_, **__: [])
     monkeypatch.setattr(apptainer, "version", mock_version)
     monkeypatch.setattr(apptainer, "installed", lambda: True)
+    monkeypatch.setattr(pool, "reconcile", lambda *_, **__: {})
+    monkeypatch.setattr(procscan, "scan", lambda: [])
 
     state = mock_charm.run(mock_charm.on.action("upgrade"), testing.State())
 
     assert state.unit_status == expected_status
     assert state.workload_version == expected_version
+
+
+def test_on_upgrade_busy(monkeypatch, mock_charm) -> None:
+    """Test that the `upgrade` action is gated on running containers."""
+    upgraded = []
+    monkeypatch.setattr(apptainer, "upgrade", lambda _: upgraded.append(True))
+    monkeypatch.setattr(apptainer, "reconcile", lambda *_, **__: [])
+    monkeypatch.setattr(apptainer, "version", lambda: "1.4.0")
+    monkeypatch.setattr(apptainer, "installed", lambda: True)
+    monkeypatch.setattr(pool, "reconcile", lambda *_, **__: {})
+    monkeypatch.setattr(procscan, "scan", lambda: [procscan.Container(pid=4242)])
+
+    with pytest.raises(testing.ActionFailed) as exec_info:
+        mock_charm.run(mock_charm.on.action("upgrade", params={"force": False}), testing.State())
+
+    assert exec_info.value.message == (
+        "1 containers are running. Drain the node first, or run with `force=true`"
+    )
+    assert upgraded == []
+
+    # Verify that `force` upgrades regardless.
+    state = mock_charm.run(
+        mock_charm.on.action("upgrade", params={"force": True}), testing.State()
+    )
+
+    assert upgraded == [True]
+    assert state.workload_version == "1.4.0"
+
+
+def test_on_upgrade_pool(monkeypatch, mock_charm) -> None:
+    """Test that pool instances do not gate the `upgrade` action, and are stopped first."""
+    calls = []
+    monkeypatch.setattr(apptainer, "upgrade", lambda _: calls.append("upgrade"))
+    monkeypatch.setattr(apptainer, "reconcile", lambda o, **_: calls.append(("config", o)) or [])
+    monkeypatch.setattr(apptainer, "version", lambda: "1.4.0")
+    monkeypatch.setattr(apptainer, "installed", lambda: True)
+    monkeypatch.setattr(pool, "pids", lambda _: {4243})
+    monkeypatch.setattr(
+        pool, "reconcile", lambda *_, **kwargs: calls.append(("stop", kwargs["user"])) or {}
+    )
+    instance = procscan.Container(
+        pid=4242,
+        processes=[
+            procscan.Process(4242, 1, "starter", 0, 0.0),
+            procscan.Process(4243, 4242, "sinit", 0, 0.0),
+        ],
+    )
+    job = procscan.Container(pid=4342, processes=[procscan.Process(4342, 1, "starter", 0, 0.0)])
+    state = testing.State(config={"warm-pool-user": "workflow"})
+
+    monkeypatch.setattr(procscan, "scan", lambda: [instance, job])
+    with pytest.raises(testing.ActionFailed):
+        mock_charm.run(mock_charm.on.action("upgrade", params={"force": False}), state)
+
+    # Verify that the pool is left running if the upgrade does not go ahead.
+    assert calls == []
+
+    monkeypatch.setattr(procscan, "scan", lambda: [instance])
+    mock_charm.run(mock_charm.on.action("upgrade", params={"force": False}), state)
+
+    # Verify that the managed options are applied to the upgraded install.
+    assert calls == [("stop", "workflow"), "upgrade", ("config", {})]
+
+
+def test_on_rollback(monkeypatch, mock_charm) -> None:
+    """Test the `_on_rollback` action event handler."""
+    rolled_back = []
+    monkeypatch.setattr(apptainer, "rollback", lambda v: rolled_back.append(v) or "1.3.6")
+    monkeypatch.setattr(apptainer, "version", lambda: "1.3.6")
+    monkeypatch.setattr(apptainer, "installed", lambda: True)
+    monkeypatch.setattr(pool, "reconcile", lambda *_, **__: {})
+    monkeypatch.setattr(procscan, "scan", lambda: [])
+
+    state = mock_charm.run(mock_charm.on.action("rollback"), testing.State())
+
+    assert mock_charm.action_results == {"version": "1.3.6"}
+    assert state.workload_version == "1.3.6"
+    assert state.unit_status == ops.ActiveStatus()
+
+    mock_charm.run(mock_charm.on.action("rollback", params={"version": "1.3.5"}), testing.State())
+    assert rolled_back == [None, "1.3.5"]
+
+    # Test that the action fails if there is nothing to roll back to.
+    def _fail(_):
+        raise apptainer.ApptainerOpsError("no archived apptainer version to roll back to")
+
+    monkeypatch.setattr(apptainer, "rollback", _fail)
+    with pytest.raises(testing.ActionFailed) as exec_info:
+        mock_charm.run(mock_charm.on.action("rollback"), testing.State())
+
+    assert exec_info.value.message == "no archived apptainer version to roll back to"
+
+
+@pytest.mark.parametrize(
+    "mock_run,expected",
+    (
+        pytest.param(
+            lambda *_, **__: {
+                "serial": benchmark.LatencyReport(10, 0, 0.1, 0.2, 0.3, 0.0),
+                "concurrent": benchmark.LatencyReport(10, 1, 0.2, 0.4, 0.5, 0.01),
+            },
+            {
+                "serial": {
+                    "launches": "10",
+                    "failures": "0",
+                    "p50-ms": "100.0",
+                    "p95-ms": "200.0",
+                    "p99-ms": "300.0",
+                    "loop-wait-ms": "0.0",
+                },
+                "concurrent": {
+                    "launches": "10",
+                    "failures": "1",
+                    "p50-ms": "200.0",
+                    "p95-ms": "400.0",
+                    "p99-ms": "500.0",
+                    "loop-wait-ms": "10.0",
+                },
+            },
+            id="success",
+        ),
+        pytest.param(
+            lambda *_, **__: (_ for _ in ()).throw(benchmark.BenchmarkError("benchmark failed")),
+            None,
+            id="fail",
+        ),
+    ),
+)
+def test_on_benchmark(monkeypatch, mock_charm, mock_ociconfig, mock_run, expected) -> None:
+    """Test the `_on_benchmark` action event handler."""
+    run_time_runs = []
+
+    def _run(run_time_run, *args, **kwargs):
+        run_time_runs.append(run_time_run)
+        return mock_run(run_time_run, *args, **kwargs)
+
+    monkeypatch.setattr(benchmark, "run", _run)
+    monkeypatch.setattr(apptainer, "installed", lambda: True)
+
+    action = mock_charm.on.action(
+        "benchmark", params={"iterations": 10, "concurrency": 2, "image": "/tmp/bench.sif"}
+    )
+    if expected is None:
+        with pytest.raises(testing.ActionFailed) as exec_info:
+            mock_charm.run(action, testing.State())
+
+        assert exec_info.value.message == "benchmark failed"
+    else:
+        mock_charm.run(action, testing.State())
+        assert mock_charm.action_results == expected
+
+    # Verify that the benchmark uses the published `RunTimeRun` command.
+    assert run_time_runs == [mock_ociconfig.run_time_run]
+
+
+@pytest.mark.parametrize(
+    "mock_throughput,expected",
+    (
+        pytest.param(lambda *_: 2000.0, ops.ActiveStatus(), id="success"),
+        pytest.param(
+            lambda *_: 50.0,
+            ops.BlockedStatus("Write throughput of /mnt/nvme/apptainer is too low (50 MiB/s)"),
+            id="slow storage",
+        ),
+    ),
+)
+def test_on_config_changed(monkeypatch, mock_charm, mock_throughput, expected) -> None:
+    """Test the `_on_config_changed` event handler."""
+    options = []
+    monkeypatch.setattr(apptainer, "installed", lambda: True)
+    monkeypatch.setattr(apptainer, "reconcile", lambda o, **_: options.append(o))
+    monkeypatch.setattr(scratch, "setup", lambda *_, **__: None)
+    monkeypatch.setattr(scratch, "throughput", mock_throughput)
+    monkeypatch.setattr(launcher, "install", lambda: None)
+    monkeypatch.setattr(pool, "reconcile", lambda *_, **__: {})
+
+    oci_runtime_integration = testing.Relation(
+        endpoint=OCI_RUNTIME_INTEGRATION_NAME,
+        interface="slurm-oci-runtime",
+        remote_app_name="slurmctld",
+    )
+    state = mock_charm.run(
+        mock_charm.on.config_changed(),
+        testing.State(
+            config={
+                "tmp-dir": "/mnt/nvme/apptainer",
+                "sessiondir-max-size": 1024,
+                "tmp-min-throughput": 500,
+            },
+            relations={oci_runtime_integration},
+            leader=True,
+        ),
+    )
+
+    assert state.unit_status == expected
+    integration = state.get_relation(oci_runtime_integration.id)
+    if isinstance(expected, ops.ActiveStatus):
+        assert options == [{"sessiondir max size": "1024"}]
+        # Verify that the scratch directory is exported to container launches.
+        config = OCIConfig.from_json(integration.local_app_data["ociconfig"])
+        assert config.run_time_run == (
+            "env APPTAINER_TMPDIR=/mnt/nvme/apptainer apptainer exec --userns %r %@"
+        )
+    else:
+        assert options == []
+        assert integration.local_app_data == {}
+
+
+def test_on_config_changed_throughput_cached(monkeypatch, mock_charm) -> None:
+    """Test that scratch throughput is only measured again when its inputs change."""
+    rates = []
+
+    def _throughput(*_):
+        rates.append(rates[-1] * 2 if rates else 250.0)
+        return rates[-1]
+
+    monkeypatch.setattr(apptainer, "installed", lambda: True)
+    monkeypatch.setattr(apptainer, "reconcile", lambda *_, **__: None)
+    monkeypatch.setattr(scratch, "setup", lambda *_, **__: None)
+    monkeypatch.setattr(scratch, "throughput", _throughput)
+    monkeypatch.setattr(launcher, "install", lambda: None)
+    monkeypatch.setattr(pool, "reconcile", lambda *_, **__: {})
+
+    config = {"tmp-dir": "/mnt/nvme/apptainer", "tmp-min-throughput": 400}
+    state = mock_charm.run(mock_charm.on.config_changed(), testing.State(config=config))
+    assert isinstance(state.unit_status, ops.BlockedStatus)
+
+    # A failed measurement is not cached, so it is taken again.
+    state = mock_charm.run(mock_charm.on.config_changed(), state)
+    assert state.unit_status == ops.ActiveStatus()
+    state = mock_charm.run(mock_charm.on.config_changed(), state)
+    assert state.unit_status == ops.ActiveStatus()
+    assert rates == [250.0, 500.0]
+
+    config = {**config, "tmp-min-throughput": 600}
+    state = mock_charm.run(
+        mock_charm.on.config_changed(), dataclasses.replace(state, config=config)
+    )
+    assert state.unit_status == ops.ActiveStatus()
+    assert rates == [250.0, 500.0, 1000.0]
+
+
+def test_on_config_changed_timeout(monkeypatch, mock_charm) -> None:
+    """Test that a command timeout blocks the unit and retries `config-changed`."""
+
+    def _reconcile(*_, **__):
+        raise runner.CommandTimeoutError(["apt-get", "install", "apptainer"], 1800)
+
+    monkeypatch.setattr(apptainer, "installed", lambda: True)
+    monkeypatch.setattr(apptainer, "reconcile", _reconcile)
+
+    state = mock_charm.run(mock_charm.on.config_changed(), testing.State())
+
+    assert state.unit_status == ops.BlockedStatus(
+        "`apt-get` timed out configuring Apptainer. Retrying"
+    )
+    assert len(state.deferred) == 1
+
+
+def test_pool(monkeypatch, mock_charm) -> None:
+    """Test that job steps are launched through the instance pool when it is configured."""
+    reconciled = []
+    monkeypatch.setattr(apptainer, "installed", lambda: True)
+    monkeypatch.setattr(apptainer, "reconcile", lambda *_, **__: [])
+    monkeypatch.setattr(launcher, "install", lambda: None)
+    monkeypatch.setattr(pool, "reconcile", lambda *args, **kwargs: reconciled.append(kwargs))
+
+    oci_runtime_integration = testing.Relation(
+        endpoint=OCI_RUNTIME_INTEGRATION_NAME,
+        interface="slurm-oci-runtime",
+        remote_app_name="slurmctld",
+    )
+    state = mock_charm.run(
+        mock_charm.on.config_changed(),
+        testing.State(
+            config={
+                "warm-pool-images": "/opt/images/a.sif, /opt/images/b.sif",
+                "warm-pool-size": 2,
+                "warm-pool-user": "workflow",
+            },
+            relations={oci_runtime_integration},
+            leader=True,
+        ),
+    )
+
+    assert state.unit_status == ops.ActiveStatus()
+    assert reconciled == [{"size": 2, "user": "workflow", "flags": ["--userns"]}]
+    config = OCIConfig.from_json(
+        state.get_relation(oci_runtime_integration.id).local_app_data["ociconfig"]
+    )
+    assert config.run_time_run == (
+        "/usr/local/bin/apptainer-launch %r -- apptainer exec --userns %r %@"
+    )
+
+
+def test_stage_cache(monkeypatch, mock_charm) -> None:
+    """Test that job steps are launched through the launch wrapper when staging is configured."""
+    staging = []
+    monkeypatch.setattr(apptainer, "installed", lambda: True)
+    monkeypatch.setattr(apptainer, "reconcile", lambda *_, **__: [])
+    monkeypatch.setattr(launcher, "install", lambda: None)
+    monkeypatch.setattr(launcher, "configure_staging", lambda *args: staging.append(args))
+
+    oci_runtime_integration = testing.Relation(
+        endpoint=OCI_RUNTIME_INTEGRATION_NAME,
+        interface="slurm-oci-runtime",
+        remote_app_name="slurmctld",
+    )
+    state = mock_charm.run(
+        mock_charm.on.config_changed(),
+        testing.State(
+            config={"stage-cache-dir": "/tmp/apptainer-stage", "stage-cache-max-size": 50},
+            relations={oci_runtime_integration},
+            leader=True,
+        ),
+    )
+
+    assert state.unit_status == ops.ActiveStatus()
+    assert staging == [("/tmp/apptainer-stage", 50 * 1024**3, 300)]
+    config = OCIConfig.from_json(
+        state.get_relation(oci_runtime_integration.id).local_app_data["ociconfig"]
+    )
+    assert config.run_time_run == (
+        "/usr/local/bin/apptainer-launch %r -- apptainer exec --userns %r %@"
+    )
+
+
+def test_fabric_bind_paths(monkeypatch, mock_charm, tmp_path) -> None:
+    """Test that host fabric libraries are bound into containers when they are configured."""
+    options = []
+    monkeypatch.setattr(apptainer, "installed", lambda: True)
+    monkeypatch.setattr(apptainer, "reconcile", lambda o, **_: options.append(o))
+    monkeypatch.setattr(apptainer, "site_config", lambda _: ["/etc/localtime", "/scratch"])
+    monkeypatch.setattr(launcher, "install", lambda: None)
+    monkeypatch.setattr(pool, "reconcile", lambda *_, **__: {})
+    (tmp_path / "libfabric.so.1").touch()
+    (tmp_path / "libfabric").mkdir()
+
+    oci_runtime_integration = testing.Relation(
+        endpoint=OCI_RUNTIME_INTEGRATION_NAME,
+        interface="slurm-oci-runtime",
+        remote_app_name="slurmctld",
+    )
+    state = mock_charm.run(
+        mock_charm.on.config_changed(),
+        testing.State(
+            config={"fabric-bind-paths": f"{tmp_path}/libfabric.so.1, {tmp_path}/libfabric"},
+            relations={oci_runtime_integration},
+            leader=True,
+        ),
+    )
+
+    assert state.unit_status == ops.ActiveStatus()
+    assert options == [
+        {
+            "bind path": [
+                "/etc/localtime",
+                "/scratch",
+                f"{tmp_path}/libfabric.so.1:/.singularity.d/libs/libfabric.so.1",
+                f"{tmp_path}/libfabric",
+            ]
+        }
+    ]
+    config = OCIConfig.from_json(
+        state.get_relation(oci_runtime_integration.id).local_app_data["ociconfig"]
+    )
+    assert config.run_time_run == (
+        f"apptainer exec --userns --env=FI_PROVIDER_PATH={tmp_path}/libfabric %r %@"
+    )
+
+    # Test that the unit is blocked if a configured path does not exist on the host.
+    options.clear()
+    state = mock_charm.run(
+        mock_charm.on.config_changed(),
+        testing.State(config={"fabric-bind-paths": f"{tmp_path}/missing"}, leader=True),
+    )
+
+    assert state.unit_status == ops.BlockedStatus(
+        "Fabric bind paths not found. See `juju debug-log` for details."
+    )
+    assert options == []
+
+
+def test_install_backend(monkeypatch, mock_charm, tmp_path) -> None:
+    """Test that Apptainer is reconciled with the configured install backend."""
+    used = []
+    monkeypatch.setattr(apptainer, "installed", lambda: True)
+    monkeypatch.setattr(apptainer, "reconcile", lambda _, backend: used.append(backend.spec()))
+    monkeypatch.setattr(launcher, "install", lambda: None)
+    monkeypatch.setattr(pool, "reconcile", lambda *_, **__: {})
+
+    state = mock_charm.run(
+        mock_charm.on.config_changed(),
+        testing.State(
+            config={"install-backend": "tarball", "install-source": f"{tmp_path}/apptainer.tgz"}
+        ),
+    )
+
+    assert state.unit_status == ops.ActiveStatus()
+    assert used == [backends.Tarball(f"{tmp_path}/apptainer.tgz").spec()]
+
+    # Test that the unit is blocked if the backend has nothing to install from.
+    used.clear()
+    state = mock_charm.run(
+        mock_charm.on.config_changed(), testing.State(config={"install-backend": "local-debs"})
+    )
+
+    assert state.unit_status == ops.BlockedStatus(
+        "`install-source` is required by the `local-debs` backend"
+    )
+    assert used == []
+
+
+def test_kernel_tuning(monkeypatch, mock_charm) -> None:
+    """Test that kernel limits are tuned for the configured number of containers."""
+    applied, removed = [], []
+    monkeypatch.setattr(apptainer, "installed", lambda: True)
+    monkeypatch.setattr(apptainer, "reconcile", lambda *_, **__: [])
+    monkeypatch.setattr(launcher, "install", lambda: None)
+    monkeypatch.setattr(pool, "reconcile", lambda *_, **__: {})
+    monkeypatch.setattr(tuning, "apply", lambda knobs, **_: applied.append(knobs) or [])
+    monkeypatch.setattr(tuning, "remove", lambda: removed.append(True))
+    monkeypatch.setattr(tuning, "drift", lambda: ["fs.inotify.max_user_instances"])
+    monkeypatch.setattr("charm.is_container", lambda: False)
+    monkeypatch.setattr(loopdev, "install", lambda size: None)
+    monkeypatch.setattr(loopdev, "create", lambda size: size)
+    monkeypatch.setattr(loopdev, "uninstall", lambda: None)
+
+    state = mock_charm.run(
+        mock_charm.on.config_changed(), testing.State(config={"max-concurrent-containers": 512})
+    )
+
+    assert applied[0] == tuning.recommend(os.cpu_count() or 1, 512, loops=1024)
+    assert state.unit_status == ops.ActiveStatus(
+        "Kernel limits below tuned values: fs.inotify.max_user_instances"
+    )
+
+    # Test that the drop-ins are removed once tuning is disabled.
+    mock_charm.run(mock_charm.on.config_changed(), testing.State())
+    assert removed == [True]
+
+
+def test_loop_pool(monkeypatch, mock_charm) -> None:
+    """Test that the loop device pool is created, and `max loop devices` covers it."""
+    options, installed, removed = [], [], []
+    monkeypatch.setattr(apptainer, "installed", lambda: True)
+    monkeypatch.setattr(apptainer, "reconcile", lambda o, **_: options.append(o))
+    monkeypatch.setattr(launcher, "install", lambda: None)
+    monkeypatch.setattr(pool, "reconcile", lambda *_, **__: {})
+    monkeypatch.setattr("charm.is_container", lambda: False)
+    monkeypatch.setattr(loopdev, "install", lambda size: installed.append(size))
+    monkeypatch.setattr(loopdev, "create", lambda size: size)
+    monkeypatch.setattr(loopdev, "uninstall", lambda: removed.append(True))
+
+    state = mock_charm.run(
+        mock_charm.on.config_changed(), testing.State(config={"loop-pool-size": 512})
+    )
+
+    assert state.unit_status == ops.ActiveStatus()
+    assert installed == [512]
+    assert options == [{"max loop devices": "512"}]
+
+    # Test that no pool is created inside a system container.
+    options.clear()
+    monkeypatch.setattr("charm.is_container", lambda: True)
+    mock_charm.run(mock_charm.on.config_changed(), testing.State(config={"loop-pool-size": 512}))
+
+    assert removed == [True]
+    assert options == [{}]
+
+
+def test_on_loop_pool_status(monkeypatch, mock_charm) -> None:
+    """Test the `_on_loop_pool_status` action event handler."""
+    monkeypatch.setattr("charm.is_container", lambda: False)
+    monkeypatch.setattr(
+        loopdev, "usage", lambda size: loopdev.Usage(size=size, present=size, attached=3)
+    )
+
+    mock_charm.run(
+        mock_charm.on.action("loop-pool-status"),
+        testing.State(config={"max-concurrent-containers": 32}),
+    )
+
+    assert mock_charm.action_results == {
+        "size": "64",
+        "present": "64",
+        "attached": "3",
+        "free": "61",
+    }
+
+
+def test_on_cache_warm(monkeypatch, mock_charm) -> None:
+    """Test the `_on_cache_warm` action event handler."""
+    warmed = []
+    monkeypatch.setattr(
+        warmer,
+        "rank",
+        lambda images, top, cache_dir: [warmer.Image(path=p, launches=0) for p in images],
+    )
+    monkeypatch.setattr(
+        warmer,
+        "warm",
+        lambda images, max_bytes: (
+            warmed.append(max_bytes)
+            or [warmer.Warmed(i.path, 1024, 0.5, warmer.WARMED) for i in images]
+        ),
+    )
+    monkeypatch.setattr(warmer, "pressure", lambda: 1.5)
+
+    mock_charm.run(
+        mock_charm.on.action("cache-warm"),
+        testing.State(config={"page-cache-images": "/opt/a.sif", "page-cache-max-size": 4}),
+    )
+
+    assert warmed == [4 * 1024**3]
+    assert mock_charm.action_results == {
+        "count": "1",
+        "pressure": "1.50",
+        "images": {
+            "image-0": {
+                "path": "/opt/a.sif",
+                "size": "1024",
+                "resident": "50.0%",
+                "state": "warmed",
+            }
+        },
+    }
+
+
+def test_on_verify_cache(monkeypatch, mock_charm, tmp_path) -> None:
+    """Test the `_on_verify_cache` action event handler."""
+    monkeypatch.setattr(launcher, "SIF_INDEX", tmp_path / "state" / "sif-index.json")
+    objects = tmp_path / str(os.getuid()) / "objects"
+    objects.mkdir(parents=True)
+    for name in ("ok.sif", "corrupt.sif", "new.sif"):
+        (objects / name).write_bytes(b"SIF_MAGIC" * 1024)
+    integrity.create(objects / "ok.sif")
+    integrity.create(objects / "corrupt.sif")
+    # The cache of another user that the unit does not own is not verified.
+    other = tmp_path / str(os.getuid() + 1) / "objects"
+    other.mkdir(parents=True)
+    (other / "other.sif").write_bytes(b"SIF_MAGIC")
+    (objects / "corrupt.sif").write_bytes(b"CORRUPT" * 1024)
+
+    mock_charm.run(
+        mock_charm.on.action("verify-cache", params={"full": True, "remove-corrupt": True}),
+        testing.State(config={"stage-cache-dir": str(tmp_path)}),
+    )
+
+    assert mock_charm.action_results == {
+        "count": "3",
+        "corrupt": "1",
+        "ok": "1",
+        "unverified": "1",
+        "not-sif": "2",
+        "images": {
+            "image-0": {
+                "path": str(objects / "corrupt.sif"),
+                "state": "corrupt",
+                "chunks": "1",
+                "corrupt": "0",
+            }
+        },
+    }
+    assert sorted(p.name for p in objects.iterdir()) == ["new.sif", "ok.sif", "ok.sif.manifest"]
+    assert str(objects / "ok.sif") in json.loads(launcher.SIF_INDEX.read_text())["images"]
+
+    # Test that the action fails if staging is not configured.
+    with pytest.raises(testing.ActionFailed) as e:
+        mock_charm.run(mock_charm.on.action("verify-cache"), testing.State())
+    assert e.value.message == "Failed to verify cache. reason: `stage-cache-dir` is not set"
+
+
+def test_on_install_status(monkeypatch, mock_charm) -> None:
+    """Test the `_on_install_status` action event handler."""
+    report = {"backend": "ppa", "installed": "true", "layout": "packages"}
+    monkeypatch.setattr(apptainer, "report", lambda: report)
+
+    mock_charm.run(mock_charm.on.action("install-status"), testing.State())
+
+    assert mock_charm.action_results == report
+
+
+def test_on_pool_stats(monkeypatch, mock_charm) -> None:
+    """Test the `_on_pool_stats` action event handler."""
+    monkeypatch.setattr(pool, "stats", lambda: pool.PoolStats(hits=3, misses=1))
+
+    mock_charm.run(mock_charm.on.action("pool-stats"), testing.State())
+
+    assert mock_charm.action_results == {"hits": "3", "misses": "1", "hit-rate": "0.750"}
+
+
+@pytest.fixture
+def mock_rollout(monkeypatch) -> dict[str, list]:
+    """Mock the unit operations of a rolling upgrade."""
+    calls = {"drain": [], "resume": [], "upgrade": [], "schedule": [], "reconcile": []}
+    monkeypatch.setattr(apptainer, "installed", lambda: True)
+    monkeypatch.setattr(apptainer, "version", lambda: "1.4.0")
+    monkeypatch.setattr(apptainer, "upgrade", lambda _: calls["upgrade"].append(True))
+    monkeypatch.setattr(
+        apptainer, "reconcile", lambda o, **_: calls["reconcile"].append(o) or ["config"]
+    )
+    monkeypatch.setattr(procscan, "scan", lambda: [])
+    monkeypatch.setattr(pool, "reconcile", lambda *_, **__: {})
+    monkeypatch.setattr(slurm, "nodename", lambda: "node-0")
+    monkeypatch.setattr(slurm, "out_of_service", lambda _: {})
+    monkeypatch.setattr(slurm, "drain", lambda nodes, reason: calls["drain"].append(nodes))
+    monkeypatch.setattr(slurm, "resume", lambda nodes: calls["resume"].append(nodes))
+    monkeypatch.setattr(scheduler, "schedule", lambda *args: calls["schedule"].append(args))
+    return calls
+
+
+def test_on_rolling_upgrade(mock_charm, mock_rollout) -> None:
+    """Test the `_on_rolling_upgrade` action event handler."""
+    peers = testing.PeerRelation(
+        endpoint=PEER_INTEGRATION_NAME, peers_data={1: {"nodename": "node-1"}}
+    )
+
+    state = mock_charm.run(
+        mock_charm.on.action("rolling-upgrade", params={"batch-size": 1, "concurrency": 1}),
+        testing.State(relations={peers}, leader=True),
+    )
+
+    # Verify that the leader upgraded its own batch, resumed it, and drained the next one.
+    assert mock_rollout["drain"] == [["node-0"], ["node-1"]]
+    assert mock_rollout["resume"] == [["node-0"]]
+    assert mock_rollout["upgrade"] == [True]
+    assert mock_rollout["reconcile"] == [{}]
+    relation = state.get_relation(peers.id)
+    rollout = Rollout.from_json(relation.local_app_data["rollout"])
+    assert rollout.batches == [["apptainer/0"], ["apptainer/1"]]
+    assert rollout.drained == [0, 1]
+    assert rollout.resumed == [0]
+    assert relation.local_unit_data["upgraded"] == rollout.id
+    assert mock_charm.action_results == {"id": rollout.id, "batches": "2"}
+    assert state.workload_version == "1.4.0"
+
+    # Verify that the leader resumes the last batch once its unit has upgraded.
+    peers = testing.PeerRelation(
+        endpoint=PEER_INTEGRATION_NAME,
+        local_app_data={"rollout": rollout.json()},
+        local_unit_data={"nodename": "node-0", "upgraded": rollout.id},
+        peers_data={1: {"nodename": "node-1", "upgraded": rollout.id}},
+    )
+    state = mock_charm.run(
+        mock_charm.on.relation_changed(peers, remote_unit=1),
+        testing.State(relations={peers}, leader=True),
+    )
+
+    assert mock_rollout["resume"] == [["node-0"], ["node-1"]]
+    rollout = Rollout.from_json(state.get_relation(peers.id).local_app_data["rollout"])
+    assert rollout.finished
+
+
+def test_on_rolling_upgrade_held(monkeypatch, mock_charm, mock_rollout) -> None:
+    """Test that nodes already out of service are neither drained nor resumed."""
+    peers = testing.PeerRelation(
+        endpoint=PEER_INTEGRATION_NAME, peers_data={1: {"nodename": "node-1"}}
+    )
+    monkeypatch.setattr(
+        slurm, "out_of_service", lambda nodes: {"node-0": "IDLE+DRAIN: disk failure"}
+    )
+
+    state = mock_charm.run(
+        mock_charm.on.action("rolling-upgrade", params={"batch-size": 2, "concurrency": 1}),
+        testing.State(relations={peers}, leader=True),
+    )
+
+    assert mock_rollout["drain"] == [["node-1"]]
+    rollout = Rollout.from_json(state.get_relation(peers.id).local_app_data["rollout"])
+    assert rollout.held == {"node-0": "IDLE+DRAIN: disk failure"}
+
+    peers = testing.PeerRelation(
+        endpoint=PEER_INTEGRATION_NAME,
+        local_app_data={"rollout": rollout.json()},
+        local_unit_data={"nodename": "node-0", "upgraded": rollout.id},
+        peers_data={1: {"nodename": "node-1", "upgraded": rollout.id}},
+    )
+    mock_charm.run(
+        mock_charm.on.relation_changed(peers, remote_unit=1),
+        testing.State(relations={peers}, leader=True),
+    )
+
+    assert mock_rollout["resume"] == [["node-1"]]
+
+
+def test_on_rolling_upgrade_not_leader(mock_charm, mock_rollout) -> None:
+    """Test that rolling upgrades can only be started on the leader unit."""
+    peers = testing.PeerRelation(endpoint=PEER_INTEGRATION_NAME)
+
+    with pytest.raises(testing.ActionFailed) as exec_info:
+        mock_charm.run(
+            mock_charm.on.action("rolling-upgrade", params={"batch-size": 1, "concurrency": 1}),
+            testing.State(relations={peers}, leader=False),
+        )
+
+    assert exec_info.value.message == "Rolling upgrades can only be started on the leader unit"
+    assert mock_rollout["drain"] == []
+
+
+def test_rolling_upgrade_busy(monkeypatch, mock_charm, mock_rollout) -> None:
+    """Test that units wait for running containers to exit before upgrading."""
+    rollout = Rollout(id="1234", batches=[["apptainer/0"]], drained=[0])
+    peers = testing.PeerRelation(
+        endpoint=PEER_INTEGRATION_NAME, local_app_data={"rollout": rollout.json()}
+    )
+    monkeypatch.setattr(procscan, "scan", lambda: [procscan.Container(pid=4242)])
+
+    state = mock_charm.run(
+        mock_charm.on.relation_changed(peers), testing.State(relations={peers}, leader=False)
+    )
+
+    assert state.unit_status == ops.WaitingStatus(
+        "Waiting for running containers to exit to upgrade"
+    )
+    assert mock_rollout["upgrade"] == []
+    assert [(unit, event) for unit, event, *_ in mock_rollout["schedule"]] == [
+        ("apptainer/0", "upgrade-retry")
+    ]
+
+    # Verify that the unit upgrades once the retry timer fires and the containers have exited.
+    monkeypatch.setattr(procscan, "scan", lambda: [])
+    # See `test_on_install_retry` for why the event is emitted inside another hook.
+    with mock_charm(
+        mock_charm.on.leader_elected(), testing.State(relations={peers}, leader=False)
+    ) as manager:
+        manager.charm.on.upgrade_retry.emit()
+        state = manager.run()
+
+    assert state.unit_status == ops.ActiveStatus()
+    assert mock_rollout["upgrade"] == [True]
+    assert state.get_relation(peers.id).local_unit_data["upgraded"] == "1234"
+
+
+def test_rolling_upgrade_leader_busy(monkeypatch, mock_charm, mock_rollout) -> None:
+    """Test that the leader advances the rollout while its own batch waits on containers."""
+    rollout = Rollout(
+        id="1234",
+        batches=[["apptainer/0"], ["apptainer/1"], ["apptainer/2"]],
+        concurrency=2,
+        drained=[0, 1],
+    )
+    peers = testing.PeerRelation(
+        endpoint=PEER_INTEGRATION_NAME,
+        local_app_data={"rollout": rollout.json()},
+        local_unit_data={"nodename": "node-0"},
+        peers_data={
+            1: {"nodename": "node-1", "upgraded": "1234"},
+            2: {"nodename": "node-2"},
+        },
+    )
+    monkeypatch.setattr(procscan, "scan", lambda: [procscan.Container(pid=4242)])
+
+    state = mock_charm.run(
+        mock_charm.on.relation_changed(peers), testing.State(relations={peers}, leader=True)
+    )
+
+    # Verify that the finished batch is resumed and the next one drained regardless.
+    assert state.unit_status == ops.WaitingStatus(
+        "Waiting for running containers to exit to upgrade"
+    )
+    assert mock_rollout["upgrade"] == []
+    assert mock_rollout["resume"] == [["node-1"]]
+    assert mock_rollout["drain"] == [["node-2"]]
+    rollout = Rollout.from_json(state.get_relation(peers.id).local_app_data["rollout"])
+    assert rollout.drained == [0, 1, 2]
+    assert rollout.resumed == [1]
+
+
+def test_on_list_containers(monkeypatch, mock_charm) -> None:
+    """Test the `_on_list_containers` action event handler."""
+    container = procscan.Container(
+        pid=4242,
+        job="1234.0",
+        command="/usr/bin/python3 train.py",
+        processes=[procscan.Process(4242, 1, "starter", 4 * 1024**2, 0.5)],
+    )
+    monkeypatch.setattr(procscan, "scan", lambda: [container])
+
+    mock_charm.run(mock_charm.on.action("list-containers"), testing.State())
+
+    assert mock_charm.action_results == {
+        "count": "1",
+        "containers": {
+            "pid-4242": {
+                "job": "1234.0",
+                "command": "/usr/bin/python3 train.py",
+                "processes": "1",
+                "rss-mib": "4.0",
+                "cpu-seconds": "0.5",
+            }
+        },
+    }
+
+
+def test_on_sync_fakeroot(monkeypatch, mock_charm, tmp_path) -> None:
+    """Test the `_on_sync_fakeroot` action event handler."""
+    synced = []
+    monkeypatch.setattr(
+        subid, "sync", lambda users, **kwargs: synced.append((users, kwargs)) or [users[0]]
+    )
+    users_file = tmp_path / "users"
+    users_file.write_text("# site users\nalice\nbob\n")
+
+    mock_charm.run(
+        mock_charm.on.action(
+            "sync-fakeroot",
+            params={"users-file": str(users_file), "start": 100000, "count": 65536},
+        ),
+        testing.State(),
+    )
+
+    assert synced == [(["alice", "bob"], {"start": 100000, "count": 65536})]
+    assert mock_charm.action_results == {"users": "2", "allocated": "1"}
+
+    # Test that a missing users file fails the action.
+    with pytest.raises(testing.ActionFailed) as exec_info:
+        mock_charm.run(
+            mock_charm.on.action(
+                "sync-fakeroot",
+                params={"users-file": str(tmp_path / "x"), "start": 100000, "count": 65536},
+            ),
+            testing.State(),
+        )
+
+    assert exec_info.value.message.startswith("Failed to sync fakeroot mappings")
@@ -0,0 +1,121 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `dpkglock` charm module."""
+
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+import dpkglock
+
+
+@pytest.fixture(scope="function")
+def lock(tmp_path: Path) -> Path:
+    """Create a lock file."""
+    lock = tmp_path / "lock-frontend"
+    lock.touch()
+    return lock
+
+
+def _hold(lock: Path, seconds: float) -> subprocess.Popen:
+    """Hold a `dpkg`-style `fcntl` lock on a file from another process."""
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import fcntl, os, sys, time\n"
+            f"fd = os.open({str(lock)!r}, os.O_RDWR)\n"
+            "fcntl.lockf(fd, fcntl.LOCK_EX)\n"
+            "print('locked', flush=True)\n"
+            f"time.sleep({seconds})\n",
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    assert process.stdout is not None
+    process.stdout.readline()
+    return process
+
+
+def test_holder(lock: Path, tmp_path: Path) -> None:
+    """Test `dpkglock.holder(...)` function."""
+    assert dpkglock.holder(lock) is None
+    assert dpkglock.holder(tmp_path / "missing") is None
+
+    process = _hold(lock, 5)
+    try:
+        assert dpkglock.holder(lock) == process.pid
+        assert dpkglock.holders([lock, tmp_path / "missing"]) == {lock: process.pid}
+        assert dpkglock.describe(process.pid).startswith(f"pid {process.pid} (")
+    finally:
+        process.kill()
+        process.wait()
+
+
+def test_wait(lock: Path) -> None:
+    """Test `dpkglock.wait(...)` function."""
+    # Test that waiting returns shortly after the lock is released.
+    process = _hold(lock, 0.5)
+    start = time.monotonic()
+    dpkglock.wait(timeout=10, base=0.05, cap=0.1, locks=[lock])
+    assert time.monotonic() - start < 2
+    process.wait()
+
+    # Test that waiting gives up once the timeout expires.
+    process = _hold(lock, 5)
+    try:
+        with pytest.raises(dpkglock.LockTimeoutError) as exec_info:
+            dpkglock.wait(timeout=0.2, base=0.05, cap=0.1, locks=[lock])
+
+        assert f"pid {process.pid}" in exec_info.value.message
+    finally:
+        process.kill()
+        process.wait()
+
+
+def test_retry(monkeypatch) -> None:
+    """Test `dpkglock.retry(...)` function."""
+    monkeypatch.setattr(dpkglock, "holders", lambda *_: {})
+    calls = []
+
+    def operation(*args, **kwargs):
+        calls.append((args, kwargs))
+        if len(calls) < 3:
+            raise subprocess.CalledProcessError(
+                100,
+                ["apt-get", "install"],
+                stderr=b"E: Could not get lock /var/lib/dpkg/lock-frontend. "
+                + b"It is held by process 1234 (unattended-upgr)",
+            )
+        return "installed"
+
+    # Test that operations failing on a held lock are retried.
+    assert dpkglock.retry(operation, "apptainer", base=0.01, cap=0.01, update=True) == "installed"
+    assert calls == [(("apptainer",), {"update": True})] * 3
+
+    # Test that other failures are raised straight away.
+    def fail():
+        raise ValueError("package not found")
+
+    with pytest.raises(ValueError):
+        dpkglock.retry(fail)
+
+    # Test that retries give up once the timeout expires.
+    calls.clear()
+    with pytest.raises(dpkglock.LockTimeoutError):
+        dpkglock.retry(operation, timeout=0, base=0.01, cap=0.01)
@@ -0,0 +1,94 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `fabric` charm module."""
+
+from pathlib import Path
+
+import pytest
+
+import fabric
+
+
+@pytest.fixture
+def host(tmp_path: Path) -> Path:
+    """Create a fake host filesystem with fabric libraries and devices."""
+    lib_dir = tmp_path / "usr" / "lib" / "x86_64-linux-gnu"
+    (lib_dir / "libfabric").mkdir(parents=True)
+    (lib_dir / "ucx").mkdir()
+    for lib in ("libfabric.so.1", "libucp.so.0", "libibverbs.so.1", "libc.so.6"):
+        (lib_dir / lib).touch()
+    # Libraries that also exist in a later library directory are only bound once.
+    (tmp_path / "usr" / "lib64").mkdir()
+    (tmp_path / "usr" / "lib64" / "libfabric.so.1").touch()
+    (tmp_path / "dev" / "infiniband").mkdir(parents=True)
+    (tmp_path / "dev" / "cxi0").touch()
+    (tmp_path / "etc" / "libibverbs.d").mkdir(parents=True)
+    return tmp_path
+
+
+def test_discover(host: Path) -> None:
+    """Test `fabric.discover(...)` function."""
+    lib_dir = host / "usr" / "lib" / "x86_64-linux-gnu"
+    assert fabric.discover(host) == [
+        lib_dir / "libfabric.so.1",
+        lib_dir / "libucp.so.0",
+        lib_dir / "libibverbs.so.1",
+        lib_dir / "libfabric",
+        lib_dir / "ucx",
+        host / "dev" / "infiniband",
+        host / "dev" / "cxi0",
+        host / "etc" / "libibverbs.d",
+    ]
+
+    assert fabric.discover(host / "empty") == []
+
+
+def test_binds(host: Path) -> None:
+    """Test `fabric.binds(...)` function."""
+    lib_dir = host / "usr" / "lib" / "x86_64-linux-gnu"
+    binds = fabric.binds([str(lib_dir / "libfabric.so.1"), str(lib_dir / "ucx")])
+    assert binds.bind_paths() == [
+        "/etc/localtime",
+        "/etc/hosts",
+        f"{lib_dir}/libfabric.so.1:/.singularity.d/libs/libfabric.so.1",
+        f"{lib_dir}/ucx",
+    ]
+    assert binds.flags() == [f"--env=UCX_MODULE_DIR={lib_dir}/ucx"]
+
+    # Test that the site's own entries are kept, and not repeated.
+    assert binds.bind_paths(["/scratch", f"{lib_dir}/ucx"]) == [
+        "/scratch",
+        f"{lib_dir}/ucx",
+        f"{lib_dir}/libfabric.so.1:/.singularity.d/libs/libfabric.so.1",
+    ]
+
+    # Test that `auto` discovers the fabric paths of the host.
+    binds = fabric.binds([fabric.AUTO], root=host)
+    assert len(binds.paths) == 8
+    assert binds.flags() == [
+        f"--env=FI_PROVIDER_PATH={lib_dir}/libfabric",
+        f"--env=UCX_MODULE_DIR={lib_dir}/ucx",
+    ]
+
+    # Test that no bind mounts are managed if no paths are configured.
+    assert fabric.binds([]) == fabric.Binds()
+
+    # Test that paths missing on the host are reported.
+    with pytest.raises(fabric.FabricError) as exec_info:
+        fabric.binds([str(host / "dev" / "hfi1_0"), str(lib_dir / "ucx")])
+
+    assert exec_info.value.message == (
+        f"fabric bind paths ['{host}/dev/hfi1_0'] do not exist on the host"
+    )
@@ -0,0 +1,175 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `integrity` charm module."""
+
+import hashlib
+import json
+import mmap
+import os
+import uuid
+from pathlib import Path
+
+import pytest
+
+import integrity
+import sif
+
+CHUNK = mmap.ALLOCATIONGRANULARITY
+
+
+def _write_sif(path: Path, partition: bytes) -> None:
+    """Write a SIF image with a primary partition after the descriptor table."""
+    offset = sif.HEADER.size
+    data_offset = 2 * CHUNK
+    header = sif.HEADER.pack(
+        b"",
+        sif.MAGIC,
+        b"01\0",
+        b"02\0",
+        uuid.uuid4().bytes,
+        0,
+        0,
+        0,
+        1,
+        offset,
+        sif.DESCRIPTOR_SIZE,
+        data_offset,
+        len(partition),
+    )
+    descriptor = sif.DESCRIPTOR.pack(
+        0x4004, True, 1, 0, 0, data_offset, len(partition), len(partition), 0, 0, 0, 0, b"rootfs"
+    ) + sif.PARTITION.pack(1, 2, b"02\0").ljust(384, b"\0")
+    path.write_bytes((header + descriptor).ljust(data_offset, b"\0") + partition)
+
+
+def test_hash_chunks(monkeypatch, tmp_path: Path) -> None:
+    """Test `integrity.hash_chunks(...)` function."""
+    image = tmp_path / "image.sif"
+    data = os.urandom(5 * CHUNK + 100)
+    image.write_bytes(data)
+    expected = [
+        hashlib.sha256(data[o : o + CHUNK]).hexdigest() for o in range(0, len(data), CHUNK)
+    ]
+
+    monkeypatch.setattr(integrity, "_workers", lambda: 4)
+    assert integrity.hash_chunks(image, CHUNK) == expected
+    monkeypatch.setattr(integrity, "_workers", lambda: 1)
+    assert integrity.hash_chunks(image, CHUNK) == expected
+
+    image.write_bytes(b"")
+    assert integrity.hash_chunks(image, CHUNK) == []
+
+
+def test_copy_compare(tmp_path: Path) -> None:
+    """Test `integrity.copy(...)` and `integrity.compare(...)` functions."""
+    src, dst = tmp_path / "src.sif", tmp_path / "dst.sif"
+    src.write_bytes(os.urandom(3 * CHUNK))
+
+    chunks = integrity.copy(src, dst, CHUNK)
+    assert dst.read_bytes() == src.read_bytes()
+    assert chunks == integrity.hash_chunks(src, CHUNK)
+    assert integrity.compare(dst, chunks, CHUNK) == []
+
+    with dst.open("r+b") as f:
+        f.seek(CHUNK + 1)
+        f.write(b"x")
+    assert integrity.compare(dst, chunks, CHUNK) == [1]
+    # Test that truncated files do not match.
+    dst.write_bytes(src.read_bytes()[:CHUNK])
+    assert integrity.compare(dst, chunks, CHUNK) == [1, 2]
+
+
+def test_verify(tmp_path: Path) -> None:
+    """Test `integrity.verify(...)` function."""
+    image = tmp_path / "image.sif"
+    _write_sif(image, os.urandom(3 * CHUNK))
+
+    assert integrity.verify(image).state == integrity.UNVERIFIED
+
+    integrity.create(image, CHUNK)
+    manifest = json.loads(integrity.manifest_file(image).read_text())
+    assert manifest["chunk_size"] == CHUNK
+    assert len(manifest["chunks"]) == 5
+
+    # Test that unchanged images are only hashed if requested.
+    assert integrity.verify(image) == integrity.Verified(
+        path=str(image), state=integrity.UNCHANGED, chunks=5
+    )
+    assert integrity.verify(image, full=True).state == integrity.OK
+
+    # Test that images that were only touched are hashed once.
+    os.utime(image, (0, 0))
+    assert integrity.verify(image).state == integrity.OK
+    assert integrity.verify(image).state == integrity.UNCHANGED
+
+    # Test that corrupt chunks are located in the SIF image.
+    with image.open("r+b") as f:
+        f.seek(3 * CHUNK + 10)
+        f.write(b"corrupt")
+    verified = integrity.verify(image)
+    assert (verified.state, verified.corrupt, verified.regions) == (
+        integrity.CORRUPT,
+        [3],
+        ["partition rootfs"],
+    )
+    assert verified.dict()["corrupt"] == "3"
+
+    with image.open("r+b") as f:
+        f.seek(0)
+        f.write(b"corrupt")
+    verified = integrity.verify(image)
+    assert (verified.corrupt, verified.regions) == ([0, 3], ["header", "partition rootfs"])
+
+
+def test_save_symlink(tmp_path: Path) -> None:
+    """Test that `integrity.save(...)` never writes through a planted symlink."""
+    image = tmp_path / "image.sif"
+    image.write_bytes(b"SIF_MAGIC")
+    victim = tmp_path / "victim"
+    victim.write_text("secret")
+    manifest = integrity.manifest_file(image)
+    (tmp_path / f".{manifest.name}.{os.getpid()}.tmp").symlink_to(victim)
+
+    integrity.save(image, ["0" * 64])
+
+    assert victim.read_text() == "secret"
+    assert json.loads(manifest.read_text())["chunks"] == ["0" * 64]
+
+
+def test_open_dir(tmp_path: Path) -> None:
+    """Test `integrity.open_dir(...)` function."""
+    objects = tmp_path / "objects"
+    objects.mkdir(mode=0o700)
+    os.close(integrity.open_dir(objects, os.getuid()))
+
+    # Test that symlinks, directories of other users, and shared directories are rejected.
+    (tmp_path / "link").symlink_to(objects)
+    with pytest.raises(OSError):
+        integrity.open_dir(tmp_path / "link", os.getuid())
+    with pytest.raises(OSError, match="only uid"):
+        integrity.open_dir(objects, os.getuid() + 1)
+    objects.chmod(0o777)
+    with pytest.raises(OSError, match="only uid"):
+        integrity.open_dir(objects, os.getuid())
+
+
+def test_verify_invalid_manifest(tmp_path: Path) -> None:
+    """Test that images with an unreadable manifest fail to verify."""
+    image = tmp_path / "image.sif"
+    image.write_bytes(b"SIF_MAGIC")
+    integrity.manifest_file(image).write_text("not json")
+
+    with pytest.raises(integrity.IntegrityError, match="failed to read manifest"):
+        integrity.verify(image)
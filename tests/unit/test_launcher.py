@@ -0,0 +1,405 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `launcher` charm module."""
+
+import fcntl
+import json
+import multiprocessing
+import os
+import pwd
+import shutil
+import sys
+import textwrap
+from pathlib import Path
+
+import pytest
+
+import integrity
+import launcher
+
+
+@pytest.fixture(scope="function")
+def state_dir(monkeypatch, tmp_path: Path) -> Path:
+    """Redirect the launch wrapper state to a temporary directory."""
+    monkeypatch.setattr(launcher, "STATE_DIR", tmp_path)
+    monkeypatch.setattr(launcher, "POOL_FILE", tmp_path / "pool.json")
+    monkeypatch.setattr(launcher, "LAUNCH_LOG", tmp_path / "launch.log")
+    monkeypatch.setattr(launcher, "STAGE_FILE", tmp_path / "stage.json")
+    launcher.rotate_log()
+    return tmp_path
+
+
+@pytest.fixture
+def registry(tmp_path: Path) -> Path:
+    """Stand-in for `apptainer pull` that records each pull and converts slowly."""
+    apptainer = tmp_path / "bin" / "apptainer"
+    apptainer.parent.mkdir()
+    apptainer.write_text(
+        textwrap.dedent(
+            f"""\
+            #!{sys.executable}
+            import sys, time
+            _, _, _, dest, ref = sys.argv
+            with open("{tmp_path / "pulls"}", "a") as f:
+                f.write(ref + "\\n")
+            time.sleep(0.2)
+            if "missing" in ref:
+                sys.exit(255)
+            with open(dest, "w") as f:
+                f.write(ref)
+            """
+        )
+    )
+    apptainer.chmod(0o755)
+    return apptainer
+
+
+def _pulls(tmp_path: Path) -> list[str]:
+    return (tmp_path / "pulls").read_text().splitlines()
+
+
+def _launch(cmd: list[str]) -> list[str]:
+    return launcher.pull(cmd[2], cmd)
+
+
+def _events(state_dir: Path) -> list[str]:
+    return [
+        json.loads(line)["event"] for line in (state_dir / "launch.log").read_text().splitlines()
+    ]
+
+
+def test_pool(monkeypatch, state_dir: Path) -> None:
+    """Test `launcher.pool(...)` function."""
+    image = str(state_dir / "image.sif")
+    cmd = ["env", "APPTAINER_TMPDIR=/scratch", "apptainer", "exec", "--userns", image, "hostname"]
+    user = pwd.getpwuid(os.getuid()).pw_name
+    running = {"pool-0"}
+    monkeypatch.setattr(launcher, "_instance_running", lambda _, name: name in running)
+
+    # Test that the launch command is unmodified when there is no pool.
+    assert launcher.pool(image, cmd) == cmd
+
+    # Test that a step runs inside a running pool instance.
+    (state_dir / "pool.json").write_text(
+        json.dumps({"user": user, "instances": {image: ["pool-0", "pool-1"]}})
+    )
+    assert launcher.pool(image, cmd) == [
+        "env",
+        "APPTAINER_TMPDIR=/scratch",
+        "apptainer",
+        "exec",
+        "instance://pool-0",
+        "hostname",
+    ]
+
+    # Test that a step falls back to a fresh container if no pool instance is running.
+    running.clear()
+    assert launcher.pool(image, cmd) == cmd
+
+    # Test that images outside of the pool are not counted.
+    other = str(state_dir / "other.sif")
+    assert launcher.pool(other, [*cmd[:-2], other, "hostname"]) == [*cmd[:-2], other, "hostname"]
+
+    # Test that steps of other users fall back to a fresh container.
+    running.add("pool-0")
+    (state_dir / "pool.json").write_text(
+        json.dumps({"user": f"not-{user}", "instances": {image: ["pool-0"]}})
+    )
+    assert launcher.pool(image, cmd) == cmd
+
+    assert _events(state_dir) == ["pool-hit", "pool-miss", "pool-miss"]
+
+
+def test_fs_type(tmp_path: Path) -> None:
+    """Test `launcher.fs_type(...)` function."""
+    assert isinstance(launcher.fs_type(str(tmp_path)), int)
+    assert launcher.fs_type(str(tmp_path / "missing")) is None
+
+
+def test_stage(monkeypatch, state_dir: Path, tmp_path: Path) -> None:
+    """Test `launcher.stage(...)` function."""
+    lustre = tmp_path / "lustre"
+    lustre.mkdir()
+    image = lustre / "image.sif"
+    image.write_bytes(b"SIF_MAGIC" + os.urandom(4096))
+    cmd = ["apptainer", "exec", "--userns", str(image), "hostname"]
+    on_lustre = {str(image)}
+    monkeypatch.setattr(
+        launcher, "fs_type", lambda path: 0x0BD00BD0 if path in on_lustre else 0xEF53
+    )
+    cache_dir = tmp_path / "cache"
+
+    # Test that the launch command is unmodified when staging is not configured.
+    assert launcher.stage(str(image), cmd) == cmd
+
+    launcher.configure_staging(str(cache_dir))
+    assert cache_dir.stat().st_mode & 0o7777 == 0o1777
+
+    # Test that the image is copied into the cache on the first launch only.
+    staged = launcher.stage(str(image), cmd)
+    cached = Path(staged[3])
+    assert cached.is_relative_to(cache_dir / str(os.getuid()) / "objects")
+    assert cached.read_bytes() == image.read_bytes()
+    assert staged == [*cmd[:3], str(cached), "hostname"]
+    assert launcher.stage(str(image), cmd) == staged
+
+    # Test that a copy of the image at another path is cached once.
+    copy = lustre / "copy.sif"
+    shutil.copy(image, copy)
+    on_lustre.add(str(copy))
+    assert launcher.stage(str(copy), [*cmd[:3], str(copy), "hostname"]) == staged
+
+    # Test that a changed image is copied again.
+    image.write_bytes(b"SIF_MAGIC" + os.urandom(4096))
+    assert launcher.stage(str(image), cmd) != staged
+
+    # Test that images on node-local filesystems are launched in place.
+    local = tmp_path / "local.sif"
+    local.write_bytes(b"SIF_MAGIC")
+    assert launcher.stage(str(local), [*cmd[:3], str(local)]) == [*cmd[:3], str(local)]
+
+    assert _events(state_dir) == ["stage-miss", "stage-hit", "stage-hit", "stage-miss"]
+
+
+def test_stage_integrity(monkeypatch, state_dir: Path, tmp_path: Path) -> None:
+    """Test that corrupt copies of images are not launched."""
+    monkeypatch.setattr(launcher, "fs_type", lambda _: 0x0BD00BD0)
+    launcher.configure_staging(str(tmp_path / "cache"))
+    image = tmp_path / "image.sif"
+    image.write_bytes(os.urandom(4 * 4096))
+
+    staged = Path(launcher.stage(str(image), [str(image)])[0])
+    assert integrity.manifest_file(staged).exists()
+
+    # Test that a cached image that was modified after it was staged is removed.
+    with staged.open("r+b") as f:
+        f.seek(2 * 4096)
+        f.write(b"corrupt")
+    assert launcher.stage(str(image), [str(image)]) == [str(image)]
+    assert not staged.exists()
+    assert launcher.stage(str(image), [str(image)]) == [str(staged)]
+
+    # Test that copies that do not match the source are not admitted to the cache.
+    staged.unlink()
+    monkeypatch.setattr(integrity, "compare", lambda *_: [1])
+    assert launcher.stage(str(image), [str(image)]) == [str(image)]
+    assert not staged.exists()
+
+    assert _events(state_dir) == ["stage-miss", "stage-error", "stage-miss", "stage-error"]
+
+
+def test_stage_evict(monkeypatch, state_dir: Path, tmp_path: Path) -> None:
+    """Test that the least recently used images are evicted from a full cache."""
+    monkeypatch.setattr(launcher, "fs_type", lambda _: 0x47504653)
+    launcher.configure_staging(str(tmp_path / "cache"), max_bytes=2 * 4096)
+    images = []
+    for i in range(3):
+        images.append(tmp_path / f"image-{i}.sif")
+        images[-1].write_bytes(os.urandom(4096))
+        os.utime(images[-1], (i, i))
+
+    staged = [launcher.stage(str(image), [str(image)])[0] for image in images]
+
+    assert [Path(path).exists() for path in staged] == [False, True, True]
+    # Test that an evicted image is staged again.
+    assert Path(launcher.stage(str(images[0]), [str(images[0])])[0]).exists()
+
+
+def test_stage_unsafe_cache(monkeypatch, state_dir: Path, tmp_path: Path) -> None:
+    """Test that images are not staged into a cache directory other users can write to."""
+    monkeypatch.setattr(launcher, "fs_type", lambda _: 0x0BD00BD0)
+    cache_dir = tmp_path / "cache"
+    launcher.configure_staging(str(cache_dir))
+    (cache_dir / str(os.getuid())).mkdir(mode=0o777)
+    (cache_dir / str(os.getuid())).chmod(0o777)
+    image = tmp_path / "image.sif"
+    image.write_bytes(b"SIF_MAGIC")
+
+    assert launcher.stage(str(image), [str(image)]) == [str(image)]
+    assert _events(state_dir) == ["stage-error"]
+
+
+def test_pull(state_dir: Path, tmp_path: Path, registry: Path) -> None:
+    """Test `launcher.pull(...)` function."""
+    ref = "docker://ubuntu:24.04"
+    cmd = [str(registry), "exec", ref, "hostname"]
+
+    # Test that the launch command is unmodified when staging is not configured.
+    assert launcher.pull(ref, cmd) == cmd
+
+    launcher.configure_staging(str(tmp_path / "cache"), pull_ttl=60)
+    pulled = launcher.pull(ref, cmd)
+    assert Path(pulled[2]).read_text() == ref
+    assert pulled == [str(registry), "exec", pulled[2], "hostname"]
+    assert launcher.pull(ref, cmd) == pulled
+
+    # Test that images referenced by tag are pulled again once they are stale.
+    os.utime(pulled[2], (0, 0))
+    assert launcher.pull(ref, cmd) == pulled
+
+    # Test that images pinned to a digest are keyed by the digest.
+    digest = "docker://ubuntu@sha256:" + "a" * 64
+    assert Path(launcher.pull(digest, [str(registry), "exec", digest])[2]).name == (
+        f"pull-{'a' * 64}.sif"
+    )
+
+    # Test that failed pulls launch the reference, so Apptainer reports the error.
+    missing = "oras://registry.example/missing:1"
+    assert launcher.pull(missing, [str(registry), "exec", missing]) == [
+        str(registry),
+        "exec",
+        missing,
+    ]
+
+    # Test that local images are not pulled.
+    assert launcher.pull("image.sif", [str(registry), "exec", "image.sif"]) == [
+        str(registry),
+        "exec",
+        "image.sif",
+    ]
+
+    assert _pulls(tmp_path) == [ref, ref, digest, missing]
+    assert _events(state_dir) == [
+        "pull-miss",
+        "pull-hit",
+        "pull-miss",
+        "pull-miss",
+        "pull-error",
+    ]
+
+
+def test_pull_single_flight(state_dir: Path, tmp_path: Path, registry: Path) -> None:
+    """Test that concurrent launches of an image on a node pull it exactly once."""
+    launcher.configure_staging(str(tmp_path / "cache"))
+    refs = ["docker://ubuntu:24.04", "oras://ghcr.io/example/solver:1.2"]
+    cmds = [[str(registry), "exec", ref, "true"] for ref in refs for _ in range(16)]
+
+    with multiprocessing.get_context("fork").Pool(len(cmds)) as workers:
+        pulled = workers.map(_launch, cmds)
+
+    assert sorted(_pulls(tmp_path)) == sorted(refs)
+    assert len({cmd[2] for cmd in pulled}) == len(refs)
+    events = _events(state_dir)
+    assert events.count("pull-miss") == len(refs)
+    assert events.count("pull-wait") + events.count("pull-hit") == len(cmds) - len(refs)
+
+
+def test_pull_takeover(state_dir: Path, tmp_path: Path, registry: Path) -> None:
+    """Test that a pull is taken over from a step that died while pulling."""
+    launcher.configure_staging(str(tmp_path / "cache"))
+    ref = "docker://ubuntu:24.04"
+    cache = launcher._user_cache(tmp_path / "cache")
+    key = launcher._pull_key(ref)
+
+    pid = os.fork()
+    if pid == 0:  # pragma: nocover
+        fd = os.open(cache / "locks" / f"{key}.lock", os.O_RDWR | os.O_CREAT)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        (cache / "objects" / f".pull-{key}.sif.{os.getpid()}.tmp").write_text("partial")
+        os._exit(1)
+    os.waitpid(pid, 0)
+
+    pulled = launcher.pull(ref, [str(registry), "exec", ref])
+    assert Path(pulled[2]).read_text() == ref
+    assert sorted(p.name for p in (cache / "objects").iterdir()) == [
+        f"pull-{key}.sif",
+        f"pull-{key}.sif.manifest",
+    ]
+    assert _events(state_dir) == ["pull-miss"]
+
+
+def test_rotate_log(state_dir: Path) -> None:
+    """Test `launcher.rotate_log(...)` function."""
+    launch_log = state_dir / "launch.log"
+    assert launch_log.stat().st_mode & 0o777 == 0o666
+
+    launcher.log("pool-hit", "image.sif")
+    launcher.rotate_log(max_bytes=1024)
+    assert len(_events(state_dir)) == 1
+
+    launcher.rotate_log(max_bytes=1)
+    assert launch_log.read_text() == ""
+    assert (state_dir / "launch.log.1").exists()
+
+
+def test_main(monkeypatch, state_dir: Path) -> None:
+    """Test `launcher.main(...)` function."""
+    execs = []
+    monkeypatch.setattr(os, "execvp", lambda file, args: execs.append(args))
+
+    assert launcher.main(["image.sif", "apptainer", "exec"]) == 2
+
+    launcher.main(["image.sif", "--", "apptainer", "exec", "image.sif", "true"])
+    assert execs == [["apptainer", "exec", "image.sif", "true"]]
+
+    # Test that steps are launched from the pulled or staged copy of the image.
+    monkeypatch.setattr(launcher, "stage", lambda image, cmd: [*cmd[:-2], "cached.sif", "true"])
+    launcher.main(["image.sif", "--", "apptainer", "exec", "image.sif", "true"])
+    assert execs[-1] == ["apptainer", "exec", "cached.sif", "true"]
+
+    # Test that steps run inside a pool instance are recorded with the image of the instance.
+    monkeypatch.setattr(
+        launcher, "pool", lambda image, cmd: ["apptainer", "exec", "instance://pool-0", "true"]
+    )
+    monkeypatch.setattr(launcher, "stage", lambda image, cmd: cmd)
+    launcher.main(["image.sif", "--", "apptainer", "exec", "image.sif", "true"])
+    assert execs[-1] == ["apptainer", "exec", "instance://pool-0", "true"]
+
+    # Test that launches are recorded with the file the step runs the image from.
+    launches = [json.loads(line) for line in (state_dir / "launch.log").read_text().splitlines()]
+    assert [(r["event"], r["path"]) for r in launches] == [
+        ("launch", "image.sif"),
+        ("launch", "cached.sif"),
+        ("launch", "image.sif"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "error,expected",
+    (
+        pytest.param(FileNotFoundError(2, "No such file or directory"), 127, id="not found"),
+        pytest.param(PermissionError(13, "Permission denied"), 126, id="not executable"),
+    ),
+)
+def test_main_exec_error(
+    monkeypatch, capsys, state_dir: Path, error: OSError, expected: int
+) -> None:
+    """Test that `launcher.main(...)` returns an error exit code if the command can not run."""
+
+    def _execvp(*_):
+        raise error
+
+    monkeypatch.setattr(os, "execvp", _execvp)
+
+    assert launcher.main(["image.sif", "--", "apptainer", "exec", "image.sif", "true"]) == expected
+    assert capsys.readouterr().err == f"apptainer-launch: apptainer: {error.strerror}\n"
+
+
+def test_install_uninstall(monkeypatch, tmp_path: Path) -> None:
+    """Test `launcher.install(...)` and `launcher.uninstall()` functions."""
+    monkeypatch.setattr(launcher, "LIB_DIR", tmp_path / "lib")
+    monkeypatch.setattr(launcher, "BIN_FILE", tmp_path / "apptainer-launch")
+    monkeypatch.setattr(launcher, "STATE_DIR", tmp_path / "state")
+    monkeypatch.setattr(launcher, "LAUNCH_LOG", tmp_path / "state" / "launch.log")
+
+    launcher.install()
+    assert (tmp_path / "apptainer-launch").resolve() == tmp_path / "lib" / "launcher.py"
+    assert (tmp_path / "state" / "launch.log").exists()
+
+    launcher.uninstall()
+    assert sorted(tmp_path.iterdir()) == []
+
+    # Test that uninstalling twice succeeds.
+    launcher.uninstall()
@@ -0,0 +1,127 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `loopdev` charm module."""
+
+import errno
+import os
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+import loopdev
+
+
+@pytest.fixture
+def dev(mocker: MockerFixture, tmp_path: Path) -> Path:
+    """Mock a `/dev` tree in which `mknod` creates regular files."""
+    dev = tmp_path / "dev"
+    dev.mkdir()
+    mocker.patch("os.chown")
+
+    def _mknod(path, mode, device):
+        Path(path).write_text(f"{os.major(device)}:{os.minor(device)}")
+
+    mocker.patch("os.mknod", side_effect=_mknod)
+    return dev
+
+
+def test_create(dev: Path) -> None:
+    """Test `loopdev.create(...)` function."""
+    (dev / "loop0").write_text("existing")
+
+    assert loopdev.create(4, dev) == 3
+    assert sorted(p.name for p in dev.iterdir()) == ["loop0", "loop1", "loop2", "loop3"]
+    assert (dev / "loop0").read_text() == "existing"
+    assert (dev / "loop3").read_text() == "7:3"
+
+    # Test that an existing pool is left as is.
+    assert loopdev.create(4, dev) == 0
+
+
+def test_create_loop_control(mocker: MockerFixture, dev: Path) -> None:
+    """Test that loop devices are added to the kernel through `/dev/loop-control`."""
+    (dev / "loop-control").touch()
+    added = []
+
+    def _ioctl(_, request, n):
+        assert request == loopdev.LOOP_CTL_ADD
+        if n == 0:
+            raise OSError(errno.EEXIST, "File exists")
+        added.append(n)
+
+    mocker.patch("fcntl.ioctl", side_effect=_ioctl)
+
+    assert loopdev.create(3, dev) == 3
+    assert added == [1, 2]
+
+    mocker.patch("fcntl.ioctl", side_effect=OSError(errno.ENOSPC, "No space left on device"))
+    with pytest.raises(OSError):
+        loopdev.create(4, dev)
+
+
+def test_usage(dev: Path, tmp_path: Path) -> None:
+    """Test `loopdev.usage(...)` function."""
+    sys_block = tmp_path / "sys" / "block"
+    loopdev.create(4, dev)
+    for n in (1, 2, 7):
+        (sys_block / f"loop{n}" / "loop").mkdir(parents=True)
+        (sys_block / f"loop{n}" / "loop" / "backing_file").write_text("/tmp/image.sif\n")
+
+    usage = loopdev.usage(8, dev, sys_block)
+
+    assert usage == loopdev.Usage(size=8, present=4, attached=3)
+    assert usage.free == 1
+
+
+def test_max_loop_devices() -> None:
+    """Test `loopdev.max_loop_devices(...)` function."""
+    assert loopdev.max_loop_devices(64) == 256
+    assert loopdev.max_loop_devices(1024) == 1024
+
+
+def test_install(tmp_path: Path) -> None:
+    """Test `loopdev.install(...)` and `loopdev.uninstall(...)` functions."""
+    lib_dir, systemd_dir = tmp_path / "lib", tmp_path / "systemd"
+    systemd_dir.mkdir()
+
+    loopdev.install(512, lib_dir=lib_dir, systemd_dir=systemd_dir)
+    loopdev.install(1024, lib_dir=lib_dir, systemd_dir=systemd_dir)
+
+    unit = systemd_dir / loopdev.UNIT_NAME
+    assert f"ExecStart=/usr/bin/python3 {lib_dir}/loopdev.py create 1024\n" in unit.read_text()
+    assert (systemd_dir / "multi-user.target.wants" / loopdev.UNIT_NAME).resolve() == unit
+    assert (lib_dir / "loopdev.py").read_text() == Path(loopdev.__file__).read_text()
+
+    loopdev.uninstall(lib_dir, systemd_dir)
+    loopdev.uninstall(lib_dir, systemd_dir)
+
+    assert not unit.exists()
+    assert not (systemd_dir / "multi-user.target.wants" / loopdev.UNIT_NAME).is_symlink()
+    assert not (lib_dir / "loopdev.py").exists()
+
+
+def test_main(mocker: MockerFixture, capsys) -> None:
+    """Test `loopdev.main(...)` function."""
+    mock_create = mocker.patch.object(loopdev, "create", return_value=62)
+
+    assert loopdev.main(["create", "64"]) == 0
+    mock_create.assert_called_once_with(64)
+    assert capsys.readouterr().out == "created 62 of 64 loop devices\n"
+
+    assert loopdev.main(["create"]) == 2
+
+    mock_create.side_effect = PermissionError(1, "Operation not permitted")
+    assert loopdev.main(["create", "64"]) == 1
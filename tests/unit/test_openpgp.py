@@ -0,0 +1,146 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `openpgp` charm module."""
+
+import shutil
+import subprocess
+from pathlib import Path
+
+import charms.operator_libs_linux.v0.apt as apt
+import pytest
+from pytest_mock import MockerFixture
+
+import openpgp
+import runner
+from constants import APPTAINER_PPA_KEY
+
+APPTAINER_PPA_FINGERPRINT = "F6B0F5193D4F3301EF491FF0AFE36534FC6218AE"
+
+requires_gpg = pytest.mark.skipif(shutil.which("gpg") is None, reason="gpg is not installed")
+
+
+@pytest.fixture(scope="module")
+def generated_key(tmp_path_factory) -> str:
+    """Generate a fresh ed25519 public key with `gpg`."""
+    home = tmp_path_factory.mktemp("gnupg")
+    home.chmod(0o700)
+    gpg = ["gpg", "--homedir", str(home), "--batch", "--pinentry-mode", "loopback"]
+    subprocess.run(
+        [*gpg, "--passphrase", "", "--quick-gen-key", "test@example.com", "ed25519", "sign"],
+        check=True,
+        capture_output=True,
+    )
+    return subprocess.check_output([*gpg, "--armor", "--export", "test@example.com"], text=True)
+
+
+def _gpg(*args: str, key: str) -> bytes:
+    """Run `gpg` on an ASCII-armored key without touching the user's keyring."""
+    return subprocess.run(
+        ["gpg", "--no-default-keyring", "--keyring", "/dev/null", *args],
+        input=key.encode(),
+        capture_output=True,
+    ).stdout
+
+
+def test_apptainer_ppa_key() -> None:
+    """Test decoding and fingerprinting the Apptainer PPA key."""
+    data = openpgp.dearmor(APPTAINER_PPA_KEY)
+
+    assert openpgp.fingerprint(data) == APPTAINER_PPA_FINGERPRINT
+
+
+@requires_gpg
+@pytest.mark.parametrize("key", ("apptainer", "generated"))
+def test_byte_identical(request, key: str) -> None:
+    """Test that keys are decoded and fingerprinted exactly as `gpg` does."""
+    armored = APPTAINER_PPA_KEY if key == "apptainer" else request.getfixturevalue("generated_key")
+
+    data = openpgp.dearmor(armored)
+
+    assert data == _gpg("--dearmor", key=armored)
+    colons = _gpg("--with-colons", "--show-keys", key=armored).decode()
+    fingerprints = [line.split(":")[9] for line in colons.splitlines() if line.startswith("fpr")]
+    assert openpgp.fingerprint(data) == fingerprints[0]
+
+
+def test_dearmor_invalid() -> None:
+    """Test that malformed armor is rejected."""
+    with pytest.raises(openpgp.OpenPGPError, match="markers missing"):
+        openpgp.dearmor("mQINBGPKLe0BEADKAHtUqLFryPhZ3m6uwuIQvwUr4US17QggRrOaS")
+
+    # Flip one character in the key data so that the CRC-24 checksum no longer matches.
+    lines = APPTAINER_PPA_KEY.strip().splitlines()
+    lines[3] = ("A" if lines[3][0] != "A" else "B") + lines[3][1:]
+    with pytest.raises(openpgp.OpenPGPError, match="checksum mismatch"):
+        openpgp.dearmor("\n".join(lines))
+
+
+@pytest.mark.parametrize(
+    "data,message",
+    (
+        pytest.param(b"", "invalid OpenPGP packet header", id="empty"),
+        pytest.param(b"\x99", "empty OpenPGP public key packet", id="no length"),
+        pytest.param(b"\x99\x00\x00", "empty OpenPGP public key packet", id="empty body"),
+        pytest.param(b"\xc6", "truncated OpenPGP packet header", id="truncated new header"),
+        pytest.param(b"\xc6\xff\x00", "truncated OpenPGP packet header", id="truncated length"),
+        pytest.param(b"\x99\x00\x05\x04", "truncated OpenPGP packet", id="truncated body"),
+    ),
+)
+def test_fingerprint_invalid(data: bytes, message: str) -> None:
+    """Test that truncated and empty packets are rejected."""
+    with pytest.raises(openpgp.OpenPGPError) as exec_info:
+        openpgp.fingerprint(data)
+
+    assert exec_info.value.message == message
+
+
+@requires_gpg
+def test_gpg() -> None:
+    """Test that the `gpg` fallback dearmors and fingerprints keys like `openpgp` does."""
+    assert openpgp._gpg(APPTAINER_PPA_KEY) == (
+        openpgp.dearmor(APPTAINER_PPA_KEY),
+        APPTAINER_PPA_FINGERPRINT,
+    )
+
+
+def test_import_key(mocker: MockerFixture, tmp_path: Path) -> None:
+    """Test `openpgp.import_key(...)` function."""
+    mock_run = mocker.patch.object(runner, "run")
+
+    file = openpgp.import_key(APPTAINER_PPA_KEY, key_dir=tmp_path)
+
+    assert file == tmp_path / f"{APPTAINER_PPA_FINGERPRINT}.gpg"
+    assert file.read_bytes() == openpgp.dearmor(APPTAINER_PPA_KEY)
+    assert file.stat().st_mode & 0o777 == 0o644
+    mock_run.assert_not_called()
+
+    # Test that keys that cannot be decoded here are imported with `gpg`.
+    def gpg(cmd: list[str], *_, **__) -> subprocess.CompletedProcess:
+        if "--dearmor" in cmd:
+            Path(cmd[cmd.index("--output") + 1]).write_bytes(b"v5 key")
+            return subprocess.CompletedProcess(cmd, 0, stdout="", stderr="")
+        return subprocess.CompletedProcess(
+            cmd, 0, stdout="pub:-:255:22:ABCD:::::::scSC:\nfpr:::::::::ABCD:\n", stderr=""
+        )
+
+    mock_run.side_effect = gpg
+    assert openpgp.import_key("v5 key", key_dir=tmp_path) == tmp_path / "ABCD.gpg"
+    assert (tmp_path / "ABCD.gpg").read_bytes() == b"v5 key"
+    assert [call[0][0][5] for call in mock_run.call_args_list] == ["--dearmor", "--with-colons"]
+
+    # Test that `gpg` failing to import the key is reported.
+    mock_run.side_effect = subprocess.CalledProcessError(2, ["gpg"], stderr="no valid data")
+    with pytest.raises(apt.GPGKeyError):
+        openpgp.import_key("v5 key", key_dir=tmp_path)
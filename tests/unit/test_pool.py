@@ -0,0 +1,142 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `pool` charm module."""
+
+import json
+import subprocess
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+import pool
+import runner
+import versions
+
+
+def test_reconcile(mocker: MockerFixture, tmp_path: Path) -> None:
+    """Test `pool.reconcile(...)` function."""
+    image = str(tmp_path / "image.sif")
+    keep, start = pool.instance_names(image, 2)
+    stale = f"{pool.INSTANCE_PREFIX}deadbeef-0"
+    pool_file = tmp_path / "pool.json"
+
+    mock_run = mocker.patch.object(runner, "run")
+    mock_run.return_value = subprocess.CompletedProcess(
+        [],
+        returncode=0,
+        stdout=json.dumps(
+            {"instances": [{"instance": keep}, {"instance": stale}, {"instance": "mine"}]}
+        ),
+    )
+
+    result = pool.reconcile([image], 2, "workflow", ["--userns"], pool_file=pool_file)
+
+    assert result == {image: [keep, start]}
+    assert json.loads(pool_file.read_text()) == {"user": "workflow", "instances": result}
+    commands = [call[0][0][4:] for call in mock_run.call_args_list]
+    assert commands == [
+        ["apptainer", "instance", "list", "--json"],
+        ["apptainer", "instance", "stop", stale],
+        ["apptainer", "instance", "start", "--userns", image, start],
+    ]
+
+    # Test that failing to list running instances is reported.
+    mock_run.side_effect = subprocess.CalledProcessError(1, [], stderr="boom")
+    with pytest.raises(pool.PoolError):
+        pool.reconcile([image], 2, "workflow", ["--userns"], pool_file=pool_file)
+
+
+def test_reconcile_disabled(mocker: MockerFixture, tmp_path: Path) -> None:
+    """Test `pool.reconcile(...)` function when no pool user is configured."""
+    mock_run = mocker.patch.object(runner, "run")
+    pool_file = tmp_path / "pool.json"
+
+    assert pool.reconcile(["/opt/image.sif"], 2, "", [], pool_file=pool_file) == {}
+    assert not mock_run.called
+    assert json.loads(pool_file.read_text()) == {"user": "", "instances": {}}
+
+
+def test_reconcile_user_changed(mocker: MockerFixture, tmp_path: Path) -> None:
+    """Test `pool.reconcile(...)` function when the pool user changed."""
+    stale = f"{pool.INSTANCE_PREFIX}deadbeef-0"
+    pool_file = tmp_path / "pool.json"
+    pool_file.write_text(json.dumps({"user": "workflow", "instances": {"/a.sif": [stale]}}))
+
+    mock_run = mocker.patch.object(runner, "run")
+    mock_run.return_value = subprocess.CompletedProcess(
+        [], returncode=0, stdout=json.dumps({"instances": [{"instance": stale}]})
+    )
+
+    assert pool.reconcile([], 2, "", [], pool_file=pool_file) == {}
+    commands = [call[0][0][2:] for call in mock_run.call_args_list]
+    assert commands == [
+        ["workflow", "--", "apptainer", "instance", "list", "--json"],
+        ["workflow", "--", "apptainer", "instance", "stop", stale],
+    ]
+    assert json.loads(pool_file.read_text()) == {"user": "", "instances": {}}
+
+    # Test that the instances of the previous user are not stopped again.
+    mock_run.reset_mock()
+    pool.reconcile([], 2, "", [], pool_file=pool_file)
+    assert not mock_run.called
+
+
+def test_reconcile_versioned(mocker: MockerFixture, tmp_path: Path) -> None:
+    """Test that the pool runs the `apptainer` of a versioned install."""
+    mocker.patch.object(versions, "active", return_value="1.4.0")
+    mock_run = mocker.patch.object(runner, "run")
+    mock_run.return_value = subprocess.CompletedProcess(
+        [], returncode=0, stdout=json.dumps({"instances": []})
+    )
+    image = str(tmp_path / "image.sif")
+
+    pool.reconcile([image], 1, "workflow", [], pool_file=tmp_path / "pool.json")
+
+    binary = str(versions.binary())
+    assert [call[0][0][4] for call in mock_run.call_args_list] == [binary, binary]
+
+
+def test_pids(mocker: MockerFixture) -> None:
+    """Test `pool.pids(...)` function."""
+    mock_run = mocker.patch.object(runner, "run")
+    mock_run.return_value = subprocess.CompletedProcess(
+        [],
+        returncode=0,
+        stdout=json.dumps(
+            {
+                "instances": [
+                    {"instance": f"{pool.INSTANCE_PREFIX}deadbeef-0", "pid": 4243},
+                    {"instance": "mine", "pid": 4343},
+                ]
+            }
+        ),
+    )
+
+    assert pool.pids("workflow") == {4243}
+
+
+def test_stats(tmp_path: Path) -> None:
+    """Test `pool.stats(...)` function."""
+    launch_log = tmp_path / "launch.log"
+    assert pool.stats(launch_log) == pool.PoolStats(hits=0, misses=0)
+    assert pool.stats(launch_log).hit_rate == 0.0
+
+    (tmp_path / "launch.log.1").write_text('{"event":"pool-hit"}\n{"event":"pool-miss"}\n')
+    launch_log.write_text('{"event":"pool-hit"}\nnot json\n{"event":"pool-hit"}\n')
+
+    stats = pool.stats(launch_log)
+    assert stats == pool.PoolStats(hits=3, misses=1)
+    assert stats.hit_rate == 0.75
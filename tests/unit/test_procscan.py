@@ -0,0 +1,111 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `procscan` charm module."""
+
+import os
+from pathlib import Path
+
+import pytest
+
+import procscan
+
+
+def _process(proc: Path, pid: int, ppid: int, comm: str, cmdline: str = "", cgroup: str = ""):
+    """Create a fake process in a fake `/proc`."""
+    # Fields after `comm`: state ppid ... utime (14) stime (15) ... rss (24).
+    fields = ["S", str(ppid), *["0"] * 9, "100", "50", *["0"] * 8, "256", *["0"] * 27]
+    (proc / str(pid)).mkdir()
+    (proc / str(pid) / "stat").write_text(f"{pid} ({comm}) {' '.join(fields)}\n")
+    (proc / str(pid) / "cmdline").write_text(cmdline.replace(" ", "\0") + "\0")
+    (proc / str(pid) / "cgroup").write_text(cgroup)
+
+
+@pytest.fixture
+def mock_proc(tmp_path: Path) -> Path:
+    """Create a fake `/proc` with a containerised Slurm job step and an instance."""
+    _process(tmp_path, 1, 0, "systemd", "/sbin/init")
+    _process(tmp_path, 100, 1, "slurmstepd", "slurmstepd: [1234.0]")
+    _process(
+        tmp_path,
+        101,
+        100,
+        "Apptainer runti",
+        cgroup="0::/system.slice/slurmstepd.scope/job_1234/step_0/user/task_0\n",
+    )
+    _process(tmp_path, 102, 101, "starter-suid")
+    _process(tmp_path, 103, 102, "python3", "/usr/bin/python3 train.py")
+    _process(tmp_path, 104, 103, "python3", "/usr/bin/python3 -c worker")
+    _process(tmp_path, 200, 1, "starter", cgroup="0::/user.slice/user-1000.slice\n")
+    _process(tmp_path, 201, 200, "sleep", "sleep infinity")
+    # Processes with odd names, and processes exiting during the scan, are handled.
+    _process(tmp_path, 300, 1, "a) (b", "weird")
+    (tmp_path / "301").mkdir()
+    (tmp_path / "self").mkdir()
+    return tmp_path
+
+
+def test_scan(mock_proc: Path) -> None:
+    """Test `procscan.scan(...)` function."""
+    containers = procscan.scan(mock_proc)
+
+    assert [c.pid for c in containers] == [101, 200]
+    job, instance = containers
+    assert job.job == "1234.0"
+    assert job.command == "/usr/bin/python3 train.py"
+    assert sorted(p.pid for p in job.processes) == [101, 102, 103, 104]
+    assert job.rss == 4 * 256 * os.sysconf("SC_PAGE_SIZE")
+    assert job.cpu_time == pytest.approx(4 * 150 / os.sysconf("SC_CLK_TCK"))
+    assert instance.job is None
+    assert instance.command == "sleep infinity"
+
+
+def test_scan_reads(monkeypatch, mock_proc: Path) -> None:
+    """Test that `cmdline` and `cgroup` are only read for container processes."""
+    reads = []
+    _read = procscan._read
+
+    def mock_read(path: str) -> bytes:
+        reads.append(path.removeprefix(f"{mock_proc}/"))
+        return _read(path)
+
+    for pid in range(1000, 3000):
+        _process(mock_proc, pid, 1, "bash", "bash")
+    monkeypatch.setattr(procscan, "_read", mock_read)
+
+    procscan.scan(mock_proc)
+
+    assert sorted(r for r in reads if not r.endswith("/stat")) == [
+        "101/cgroup",
+        "103/cmdline",
+        "200/cgroup",
+        "201/cmdline",
+    ]
+
+
+def test_executables(tmp_path: Path) -> None:
+    """Test `procscan.executables(...)` function."""
+    for pid, exe in ((1, "/usr/lib/systemd/systemd"), (42, "/opt/apptainer/1.3.6/starter")):
+        (tmp_path / str(pid)).mkdir()
+        (tmp_path / str(pid) / "exe").symlink_to(exe)
+    (tmp_path / "43").mkdir()
+    (tmp_path / "43" / "exe").symlink_to("/opt/apptainer/1.2.0/starter (deleted)")
+    # Kernel threads have no executable.
+    (tmp_path / "2").mkdir()
+
+    assert procscan.executables(tmp_path) == {
+        Path("/usr/lib/systemd/systemd"),
+        Path("/opt/apptainer/1.3.6/starter"),
+        Path("/opt/apptainer/1.2.0/starter"),
+    }
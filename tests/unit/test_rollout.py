@@ -0,0 +1,55 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `rollout` charm module."""
+
+from rollout import Rollout
+
+
+def test_plan() -> None:
+    """Test `Rollout.plan(...)` method."""
+    units = [f"apptainer/{i}" for i in (10, 2, 0, 1, 3)]
+    rollout = Rollout.plan(units, batch_size=2, concurrency=1)
+
+    assert rollout.batches == [
+        ["apptainer/0", "apptainer/1"],
+        ["apptainer/2", "apptainer/3"],
+        ["apptainer/10"],
+    ]
+    assert Rollout.from_json(rollout.json()) == rollout
+
+
+def test_progress() -> None:
+    """Test how a rolling upgrade progresses through its batches."""
+    rollout = Rollout(id="1234", batches=[["a/0"], ["a/1"], ["a/2"], ["a/3"]], concurrency=2)
+
+    assert rollout.active(set()) == [0, 1]
+    assert not rollout.authorized("a/0")
+
+    rollout.drained = [0, 1]
+    assert rollout.authorized("a/0")
+    assert rollout.authorized("a/1")
+    assert not rollout.authorized("a/2")
+
+    # Batches are admitted as soon as a batch in progress completes, in any order.
+    assert rollout.active({"a/1"}) == [0, 2]
+
+    rollout.drained = [0, 1, 2, 3]
+    rollout.resumed = [1]
+    assert not rollout.authorized("a/1")
+    assert not rollout.finished
+
+    rollout.resumed = [0, 1, 2, 3]
+    assert rollout.finished
+    assert rollout.active({"a/0", "a/1", "a/2", "a/3"}) == []
@@ -0,0 +1,106 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `runner` charm module."""
+
+import os
+import subprocess
+import time
+from pathlib import Path
+
+import pytest
+
+import runner
+
+# Stand-in for a hung binary that also leaves a child process behind, like `apt-get`
+# waiting on a `dpkg` or `http` method process.
+HUNG = """#!/bin/sh
+sleep 60 &
+echo $! > "$1"
+trap '' TERM
+sleep 60
+"""
+
+
+@pytest.fixture
+def hung(tmp_path: Path) -> Path:
+    """Create a stand-in binary that never exits, and ignores `SIGTERM`."""
+    script = tmp_path / "hung"
+    script.write_text(HUNG)
+    script.chmod(0o755)
+    return script
+
+
+def _alive(pid: int) -> bool:
+    """Check if a process is still running, and not a zombie."""
+    try:
+        return Path(f"/proc/{pid}/stat").read_text().split(") ")[1][0] != "Z"
+    except (FileNotFoundError, IndexError):
+        return False
+
+
+def test_run() -> None:
+    """Test `runner.run(...)` function."""
+    result = runner.run(["sh", "-c", "echo out; echo err >&2"])
+    assert (result.returncode, result.stdout, result.stderr) == (0, "out\n", "err\n")
+
+    with pytest.raises(subprocess.CalledProcessError) as exec_info:
+        runner.run(["sh", "-c", "echo failed >&2; exit 3"])
+
+    assert (exec_info.value.returncode, exec_info.value.stderr) == (3, "failed\n")
+    assert runner.run(["sh", "-c", "exit 3"], check=False).returncode == 3
+
+    with pytest.raises(FileNotFoundError):
+        runner.run(["/nonexistent/apptainer", "--version"])
+
+
+def test_run_timeout(hung: Path, tmp_path: Path, monkeypatch) -> None:
+    """Test that commands that time out are killed along with their children."""
+    monkeypatch.setattr(runner, "KILL_GRACE", 0.2)
+    monkeypatch.setitem(runner.TIMEOUTS, runner.QUERY, 0.5)
+    pid_file = tmp_path / "child.pid"
+
+    start = time.monotonic()
+    with pytest.raises(runner.CommandTimeoutError) as exec_info:
+        runner.run([str(hung), str(pid_file)])
+
+    # The stand-in ignores `SIGTERM`, so it is only gone once its group is killed.
+    assert time.monotonic() - start < 10
+    assert exec_info.value.message == f"command `{hung} {pid_file}` timed out after 0.5s"
+    assert exec_info.value.name == "hung"
+    child = int(pid_file.read_text())
+    deadline = time.monotonic() + 5
+    while _alive(child) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not _alive(child)
+
+    # Test that an explicit timeout overrides the timeout of the command class.
+    with pytest.raises(runner.CommandTimeoutError) as exec_info:
+        runner.run(["sleep", "60"], kind=runner.PACKAGE, timeout=0.2)
+
+    assert exec_info.value.timeout == 0.2
+
+
+def test_popen(monkeypatch) -> None:
+    """Test `runner.popen(...)` streams output until the timeout expires."""
+    lines = []
+    with pytest.raises(runner.CommandTimeoutError):
+        with runner.popen(
+            ["sh", "-c", "echo ready; sleep 60"], timeout=0.5, stdout=subprocess.PIPE, text=True
+        ) as proc:
+            lines.extend(proc.stdout)
+
+    assert lines == ["ready\n"]
+    assert proc.returncode is not None and proc.returncode < 0
+    assert os.getpgid(os.getpid()) != proc.pid
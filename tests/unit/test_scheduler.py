@@ -0,0 +1,66 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `scheduler` charm module."""
+
+import subprocess
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+import runner
+import scheduler
+
+
+def test_backoff() -> None:
+    """Test `scheduler.backoff(...)` function."""
+    for attempt, delay in ((1, 5), (2, 10), (3, 20), (10, 300)):
+        assert delay / 2 <= scheduler.backoff(attempt, base=5, cap=300) <= delay
+
+
+def test_schedule(mocker: MockerFixture) -> None:
+    """Test `scheduler.schedule(...)` function."""
+    mock_run = mocker.patch.object(runner, "run")
+
+    scheduler.schedule("apptainer/0", "install-retry", 12.4, Path("/var/lib/juju/charm"))
+
+    commands = [call[0][0] for call in mock_run.call_args_list]
+    assert commands == [
+        ["systemctl", "stop", "juju-apptainer-0-install-retry.timer"],
+        ["systemctl", "reset-failed", "juju-apptainer-0-install-retry"],
+        [
+            "systemd-run",
+            "--unit=juju-apptainer-0-install-retry",
+            "--description=Dispatch install-retry event to apptainer/0",
+            "--on-active=12s",
+            "--timer-property=AccuracySec=1s",
+            "/usr/bin/juju-exec",
+            "apptainer/0",
+            "JUJU_DISPATCH_PATH=hooks/install-retry /var/lib/juju/charm/dispatch",
+        ],
+    ]
+
+    # Test that failing to start the timer is reported.
+    mock_run.side_effect = [None, None, subprocess.CalledProcessError(1, [], stderr="no bus")]
+    with pytest.raises(scheduler.SchedulerError) as exec_info:
+        scheduler.schedule("apptainer/0", "install-retry", 5, Path("/charm"))
+
+    assert exec_info.value.message.endswith("no bus")
+
+
+def test_cancel(mocker: MockerFixture) -> None:
+    """Test `scheduler.cancel(...)` function when `systemctl` is not available."""
+    mocker.patch.object(runner, "run", side_effect=FileNotFoundError("systemctl"))
+    scheduler.cancel("apptainer/0", "install-retry")
@@ -0,0 +1,109 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `scratch` charm module."""
+
+import stat
+import subprocess
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+import runner
+import scratch
+
+
+def test_setup(tmp_path: Path) -> None:
+    """Test `scratch.setup(...)` function on existing local storage."""
+    path = tmp_path / "nvme" / "apptainer"
+    scratch.setup(path)
+
+    assert path.is_dir()
+    assert stat.S_IMODE(path.stat().st_mode) == 0o1777
+
+
+def test_setup_tmpfs(mocker: MockerFixture, tmp_path: Path) -> None:
+    """Test `scratch.setup(...)` function when a tmpfs size cap is set."""
+    mock_run = mocker.patch.object(runner, "run")
+    mock_mount = mocker.patch.object(scratch, "_mount_options")
+
+    # Test that a new tmpfs is mounted if nothing is mounted at the path.
+    mock_mount.return_value = None
+    scratch.setup(tmp_path, size="8G")
+    assert mock_run.call_args[0][0] == [
+        "mount",
+        "-t",
+        "tmpfs",
+        "-o",
+        "size=8G,mode=1777",
+        "tmpfs",
+        str(tmp_path),
+    ]
+
+    # Test that an existing tmpfs is resized.
+    mock_mount.return_value = ("tmpfs", "rw,size=4194304k")
+    scratch.setup(tmp_path, size="8G")
+    assert mock_run.call_args[0][0] == ["mount", "-o", "remount,size=8G", str(tmp_path)]
+
+    # Test that other filesystems are not mounted over.
+    mock_mount.return_value = ("ext4", "rw")
+    with pytest.raises(scratch.ScratchError):
+        scratch.setup(tmp_path, size="8G")
+
+    # Test that invalid sizes are rejected.
+    with pytest.raises(scratch.ScratchError) as exec_info:
+        scratch.setup(tmp_path, size="lots")
+
+    assert exec_info.value.message == (
+        "invalid scratch size `lots`. expected a size like `64G` or `50%`"
+    )
+
+
+def test_teardown(mocker: MockerFixture, tmp_path: Path) -> None:
+    """Test `scratch.teardown(...)` function."""
+    mock_run = mocker.patch.object(runner, "run")
+    mock_mount = mocker.patch.object(scratch, "_mount_options")
+
+    # Test that a tmpfs is unmounted.
+    mock_mount.return_value = ("tmpfs", "rw,size=8388608k")
+    scratch.teardown(tmp_path)
+    assert mock_run.call_args[0][0] == ["umount", str(tmp_path)]
+
+    # Test that other filesystems, and paths without a mount, are left alone.
+    mock_run.reset_mock()
+    for mount in (("ext4", "rw"), None):
+        mock_mount.return_value = mount
+        scratch.teardown(tmp_path)
+    assert not mock_run.called
+
+    # Test that failing to unmount the tmpfs is reported.
+    mock_mount.return_value = ("tmpfs", "rw")
+    mock_run.side_effect = subprocess.CalledProcessError(32, [], stderr="target is busy")
+    with pytest.raises(scratch.ScratchError) as exec_info:
+        scratch.teardown(tmp_path)
+
+    assert exec_info.value.message == (
+        f"failed to tear down scratch directory {tmp_path}. reason: target is busy"
+    )
+
+
+def test_throughput(tmp_path: Path) -> None:
+    """Test `scratch.throughput(...)` function."""
+    assert scratch.throughput(tmp_path, size=4 * 1024**2) > 0
+    # Verify that the test file is cleaned up.
+    assert list(tmp_path.iterdir()) == []
+
+    with pytest.raises(scratch.ScratchError):
+        scratch.throughput(tmp_path / "missing")
@@ -0,0 +1,189 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `sif` charm module."""
+
+import logging
+import os
+import time
+import uuid
+from pathlib import Path
+
+import pytest
+
+import sif
+
+ID = uuid.UUID("0b5a1d3e-7c1f-4f4e-9d2a-8f6c1e2b3a4d")
+ENTITY = bytes(range(20))
+
+
+def _descriptor(datatype: int, id_: int, offset: int, size: int, name: bytes, extra: bytes):
+    return sif.DESCRIPTOR.pack(
+        datatype, True, id_, 0xF0000001, 0, offset, size, size, 1700000000, 0, 0, 0, name
+    ) + extra.ljust(384, b"\0")
+
+
+def _write(path: Path, data: bytes = b"hsqs" + bytes(4092), free: int = 1) -> None:
+    """Write a SIF image with a definition file, a primary partition, and a signature."""
+    offset = sif.HEADER.size
+    total = 3 + free
+    data_offset = offset + total * sif.DESCRIPTOR_SIZE
+    deffile = b"Bootstrap: docker\nFrom: ubuntu\n"
+    part = data_offset + len(deffile)
+    descriptors = (
+        _descriptor(0x4001, 1, data_offset, len(deffile), b"", b"")
+        + _descriptor(0x4004, 2, part, len(data), b"rootfs", sif.PARTITION.pack(1, 2, b"02\0"))
+        + _descriptor(0x4005, 3, part + len(data), 0, b"", sif.SIGNATURE.pack(1, ENTITY))
+        + bytes(free * sif.DESCRIPTOR_SIZE)
+    )
+    header = sif.HEADER.pack(
+        b"#!/usr/bin/env run-singularity\n",
+        sif.MAGIC,
+        b"01\0",
+        b"02\0",
+        ID.bytes,
+        1700000000,
+        1700000100,
+        free,
+        total,
+        offset,
+        total * sif.DESCRIPTOR_SIZE,
+        data_offset,
+        len(deffile) + len(data),
+    )
+    path.write_bytes(header + descriptors + deffile + data)
+
+
+def test_parse(tmp_path: Path) -> None:
+    """Test `sif.parse(...)` function."""
+    image = tmp_path / "image.sif"
+    _write(image)
+
+    parsed = sif.parse(image)
+    assert (parsed.id, parsed.arch, parsed.created, parsed.modified) == (
+        str(ID),
+        "amd64",
+        1700000000,
+        1700000100,
+    )
+    assert [d.type for d in parsed.descriptors] == ["deffile", "partition", "signature"]
+    primary = parsed.primary()
+    assert (primary.id, primary.name, primary.fs, primary.arch, primary.group) == (
+        2,
+        "rootfs",
+        "squashfs",
+        "amd64",
+        1,
+    )
+    assert image.read_bytes()[primary.offset : primary.offset + 4] == b"hsqs"
+    assert parsed.signed()
+    assert parsed.descriptors[2].hash == "sha256"
+    assert parsed.descriptors[2].entity == ENTITY.hex()
+    assert parsed.summary()["primary"] == {
+        "fs": "squashfs",
+        "offset": primary.offset,
+        "size": 4096,
+    }
+
+
+@pytest.mark.parametrize(
+    "content,message",
+    (
+        (b"", "is not a SIF image"),
+        (b"#!/bin/sh\n" * 20, "is not a SIF image"),
+    ),
+)
+def test_parse_invalid(tmp_path: Path, content: bytes, message: str) -> None:
+    """Test that files that are not SIF images are rejected."""
+    image = tmp_path / "image.sif"
+    image.write_bytes(content)
+
+    with pytest.raises(sif.SIFError, match=message):
+        sif.parse(image)
+
+
+def test_parse_truncated(tmp_path: Path) -> None:
+    """Test that images with a truncated descriptor table are rejected."""
+    image = tmp_path / "image.sif"
+    _write(image)
+    image.write_bytes(image.read_bytes()[: sif.HEADER.size + sif.DESCRIPTOR_SIZE])
+
+    with pytest.raises(sif.SIFError, match="is truncated"):
+        sif.parse(image)
+
+    with pytest.raises(sif.SIFError, match="failed to read"):
+        sif.parse(tmp_path / "missing.sif")
+
+
+def test_index(monkeypatch, tmp_path: Path) -> None:
+    """Test `sif.index(...)` function."""
+    cache, index_file = tmp_path / "cache", tmp_path / "index.json"
+    (cache / "a").mkdir(parents=True)
+    _write(cache / "a" / "one.sif")
+    _write(cache / "two.sif")
+    (cache / "notes.txt").write_text("not an image")
+    os.symlink(cache / "two.sif", cache / "link.sif")
+
+    parsed = []
+    parse = sif.parse
+    monkeypatch.setattr(sif, "parse", lambda path: parsed.append(path) or parse(path))
+
+    images = sif.index(cache, index_file)
+    assert sorted(images) == [str(cache / "a" / "one.sif"), str(cache / "two.sif")]
+    assert images[str(cache / "two.sif")]["id"] == str(ID)
+    assert len(parsed) == 3
+
+    # Test that only changed images are parsed again.
+    parsed.clear()
+    _write(cache / "two.sif", data=b"hsqs" + bytes(8188))
+    images = sif.index(cache, index_file)
+    assert parsed == [str(cache / "two.sif")]
+    assert images[str(cache / "two.sif")]["primary"]["size"] == 8192
+
+    # Test that removed images are dropped from the index.
+    (cache / "a" / "one.sif").unlink()
+    assert sorted(sif.index(cache, index_file)) == [str(cache / "two.sif")]
+
+
+def test_index_benchmark(caplog, monkeypatch, tmp_path: Path) -> None:
+    """Benchmark indexing a cache of generated SIF images."""
+    count = 2000
+    cache = tmp_path / "cache"
+    cache.mkdir()
+    for i in range(count):
+        _write(cache / f"image-{i}.sif", data=b"hsqs" + bytes(64 * 1024))
+
+    start = time.perf_counter()
+    for path in cache.iterdir():
+        sif.parse(path)
+    parse = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assert len(sif.index(cache, tmp_path / "index.json")) == count
+    cold = time.perf_counter() - start
+
+    monkeypatch.setattr(sif, "parse", lambda path: pytest.fail(f"{path} was parsed again"))
+    start = time.perf_counter()
+    assert len(sif.index(cache, tmp_path / "index.json")) == count
+    warm = time.perf_counter() - start
+
+    with caplog.at_level(logging.INFO):
+        logging.getLogger(__name__).info(
+            "%d images: parse %.1f us/image, cold index %.3f s, warm index %.3f s",
+            count,
+            parse / count * 1e6,
+            cold,
+            warm,
+        )
+    assert warm < cold
@@ -0,0 +1,84 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `slurm` charm module."""
+
+import os
+from pathlib import Path
+
+import pytest
+
+import slurm
+
+
+@pytest.fixture
+def mock_scontrol(monkeypatch, tmp_path: Path) -> Path:
+    """Put a stub `scontrol` on `$PATH` that records its arguments."""
+    calls = tmp_path / "calls"
+    stub = tmp_path / "bin" / "scontrol"
+    stub.parent.mkdir()
+    stub.write_text(
+        "#!/bin/sh\n"
+        + 'case "$2" in *fail*) echo "Invalid node name specified" >&2; exit 1;; esac\n'
+        + f'echo "$@" >> {calls}\n'
+    )
+    stub.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{stub.parent}{os.pathsep}{os.environ['PATH']}")
+    return calls
+
+
+def test_drain_resume(mock_scontrol: Path) -> None:
+    """Test `slurm.drain(...)` and `slurm.resume(...)` functions."""
+    slurm.drain(["node-0", "node-1"], reason="apptainer rolling upgrade 1234")
+    slurm.resume(["node-0", "node-1"])
+
+    assert mock_scontrol.read_text().splitlines() == [
+        "update nodename=node-0,node-1 state=drain reason=apptainer rolling upgrade 1234",
+        "update nodename=node-0,node-1 state=resume",
+    ]
+
+    # Test that `scontrol` errors are reported.
+    with pytest.raises(slurm.SlurmOpsError) as exec_info:
+        slurm.drain(["fail-0"], reason="test")
+
+    assert exec_info.value.message == (
+        "failed to update nodes `['fail-0']`. reason: Invalid node name specified"
+    )
+
+
+def test_out_of_service(monkeypatch, tmp_path: Path) -> None:
+    """Test `slurm.out_of_service(...)` function."""
+    stub = tmp_path / "scontrol"
+    stub.write_text(
+        "#!/bin/sh\n"
+        + "echo 'NodeName=node-0 Arch=x86_64 State=IDLE Partitions=batch'\n"
+        + "echo 'NodeName=node-1 Arch=x86_64 State=MIXED+DRAIN Partitions=batch "
+        + "Reason=disk failure [root@2025-01-01T00:00:00] Comment=(null)'\n"
+        + "echo 'NodeName=node-2 Arch=x86_64 State=DOWN* Partitions=batch'\n"
+    )
+    stub.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+    assert slurm.out_of_service(["node-0", "node-1", "node-2"]) == {
+        "node-1": "MIXED+DRAIN: disk failure",
+        "node-2": "DOWN*",
+    }
+
+
+def test_drain_no_scontrol(monkeypatch, tmp_path: Path) -> None:
+    """Test `slurm.drain(...)` when `scontrol` is not installed."""
+    monkeypatch.setenv("PATH", str(tmp_path))
+
+    with pytest.raises(slurm.SlurmOpsError):
+        slurm.drain(["node-0"], reason="test")
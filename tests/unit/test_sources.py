@@ -0,0 +1,109 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `sources` charm module."""
+
+import os
+from pathlib import Path
+
+import charms.operator_libs_linux.v0.apt as apt
+import pytest
+from pytest_mock import MockerFixture
+
+import sources
+
+PPA = apt.DebianRepository(
+    enabled=True,
+    repotype="deb",
+    uri="https://ppa.launchpadcontent.net/apptainer/ppa/ubuntu/",
+    release="noble",
+    groups=["main"],
+)
+
+
+@pytest.fixture
+def apt_dir(tmp_path: Path) -> Path:
+    """Create an apt configuration directory with hundreds of vendor repositories."""
+    sources_dir = tmp_path / "sources.list.d"
+    sources_dir.mkdir()
+    (tmp_path / "sources.list").write_text("# See ubuntu.sources\n")
+    (sources_dir / "ubuntu.sources").write_text(
+        "Types: deb\n"
+        + "URIs: http://archive.ubuntu.com/ubuntu/\n"
+        + "Suites: noble noble-updates\n"
+        + "Components: main universe\n"
+        + "Signed-By: /usr/share/keyrings/ubuntu-archive-keyring.gpg\n"
+    )
+    for i in range(300):
+        (sources_dir / f"vendor-{i}.list").write_text(
+            f"# Vendor repository {i}\n"
+            + f"deb [arch=amd64] https://packages.vendor-{i}.example.com/ubuntu noble main\n"
+            + f"# deb-src https://packages.vendor-{i}.example.com/ubuntu noble main\n"
+        )
+    for i in range(100):
+        (sources_dir / f"vendor-{i}.sources").write_text(
+            "Types: deb\n"
+            + f"URIs: https://mirror.vendor-{i}.example.com/apt/\n"
+            + "Suites: stable\n"
+            + "Components: main\n"
+        )
+    (sources_dir / "broken.list").write_text("deb\n")
+    (sources_dir / "broken.sources").write_text("Types: deb\nSuites: noble\n")
+    (sources_dir / "binary.list").write_bytes(b"\xff\xfe\x00deb")
+    return tmp_path
+
+
+def test_add_disable(tmp_path: Path) -> None:
+    """Test `sources.add(...)` and `sources.disable(...)` functions."""
+    file = sources.filename(PPA, apt_dir=tmp_path)
+    other = tmp_path / "sources.list.d" / "other.list"
+    other.parent.mkdir()
+    other.write_text("this is not a valid source file\n")
+
+    assert sources.add(PPA, apt_dir=tmp_path) is True
+    assert file.read_text() == (
+        "deb https://ppa.launchpadcontent.net/apptainer/ppa/ubuntu/ noble main\n"
+    )
+    assert sources.add(PPA, apt_dir=tmp_path) is False
+
+    assert sources.disable(PPA, apt_dir=tmp_path) is True
+    assert file.read_text() == (
+        "# deb https://ppa.launchpadcontent.net/apptainer/ppa/ubuntu/ noble main\n"
+    )
+    assert sources.disable(PPA, apt_dir=tmp_path) is False
+
+    # Verify that re-adding the repository enables it again.
+    assert sources.add(PPA, apt_dir=tmp_path) is True
+    assert not file.read_text().startswith("#")
+
+    # Verify that no other source file was touched.
+    assert other.read_text() == "this is not a valid source file\n"
+    assert sorted(p.name for p in file.parent.iterdir()) == [file.name, other.name]
+
+
+def test_add_disable_untouched(mocker: MockerFixture, apt_dir: Path) -> None:
+    """Test that `add(...)` and `disable(...)` never read or modify other source files."""
+    files = sorted(p for p in apt_dir.rglob("*") if p.is_file())
+    for file in files:
+        os.utime(file, ns=(1_000_000_000, 1_000_000_000))
+    before = {file: (file.read_bytes(), file.stat().st_mtime_ns) for file in files}
+    mock_open = mocker.spy(Path, "open")
+
+    assert sources.add(PPA, apt_dir=apt_dir) is True
+    assert sources.disable(PPA, apt_dir=apt_dir) is True
+
+    file = sources.filename(PPA, apt_dir)
+    opened = {call.args[0] for call in mock_open.call_args_list}
+    assert opened == {file, file.with_name(f".{file.name}.tmp")}
+    assert {file: (file.read_bytes(), file.stat().st_mtime_ns) for file in files} == before
@@ -0,0 +1,112 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `subid` charm module."""
+
+from pathlib import Path
+
+import pytest
+
+import subid
+
+
+def test_parse() -> None:
+    """Test `subid.parse(...)` function."""
+    assert subid.parse("# comment\nalice:100000:65536\n\nbob:x:1\nbroken\n") == [
+        subid.Range("alice", 100000, 65536)
+    ]
+
+
+def test_read_users(tmp_path: Path) -> None:
+    """Test `subid.read_users(...)` function."""
+    users_file = tmp_path / "users"
+    users_file.write_text("# LDAP export\nalice\n\n  bob  # staff\n")
+    assert subid.read_users(users_file) == ["alice", "bob"]
+
+    users_file.write_text("alice\nbob:1000\n")
+    with pytest.raises(subid.SubIDError) as exec_info:
+        subid.read_users(users_file)
+
+    assert exec_info.value.message == f"invalid user name `bob:1000` on line 2 of {users_file}"
+
+
+def test_allocate() -> None:
+    """Test `subid.allocate(...)` function."""
+    existing = [
+        subid.Range("alice", 100000, 100),
+        subid.Range("bob", 100250, 100),
+        subid.Range("carol", 100400, 50),
+    ]
+    # Test that new ranges fill the gaps between existing ranges, and skip users with a range.
+    assert subid.allocate(["alice", "dave", "erin", "dave", "frank"], existing, count=100) == [
+        subid.Range("dave", 100100, 100),
+        subid.Range("erin", 100450, 100),
+        subid.Range("frank", 100550, 100),
+    ]
+
+    # Test that tens of thousands of users are allocated without overlaps.
+    users = [f"user{i}" for i in range(50000)]
+    ranges = subid.allocate(users, existing)
+    assert len(ranges) == 50000
+    spans = sorted((r.start, r.end) for r in [*existing, *ranges])
+    assert all(a[1] <= b[0] for a, b in zip(spans, spans[1:]))
+
+    # Test that running out of subordinate IDs is reported.
+    with pytest.raises(subid.SubIDError) as exec_info:
+        subid.allocate(["a", "b"], [], start=subid.MAX_ID - 100, count=100)
+
+    assert exec_info.value.message == (
+        "subordinate ID space exhausted after allocating 1 of 2 ranges of 100 IDs"
+    )
+
+
+def test_sync(tmp_path: Path) -> None:
+    """Test `subid.sync(...)` function."""
+    subuid, subgid = tmp_path / "subuid", tmp_path / "subgid"
+    subuid.write_text("# managed by site\nalice:100000:65536\nbob:165536:65536")
+    subgid.write_text("alice:100000:65536\n")
+
+    new = subid.sync(["alice", "bob", "carol"], subuid_file=subuid, subgid_file=subgid)
+
+    # `bob` only had a subordinate user ID range, so it gets the same group range.
+    assert new == [subid.Range("bob", 165536, 65536), subid.Range("carol", 231072, 65536)]
+    assert subuid.read_text() == (
+        "# managed by site\n"
+        + "alice:100000:65536\n"
+        + "bob:165536:65536\n"
+        + "carol:231072:65536\n"
+    )
+    assert subgid.read_text() == ("alice:100000:65536\nbob:165536:65536\ncarol:231072:65536\n")
+    assert subgid.stat().st_mode & 0o777 == 0o644
+
+    # Test that syncing again is a no-op, so existing allocations are stable.
+    assert subid.sync(["carol", "bob"], subuid_file=subuid, subgid_file=subgid) == []
+
+    # Test that a user missing from one file whose range is taken there gets a new range
+    # in that file only.
+    subgid.write_text(subgid.read_text() + "dave:296608:65536\n")
+    subuid.write_text(subuid.read_text() + "erin:296608:65536\n")
+    assert subid.sync(["erin"], subuid_file=subuid, subgid_file=subgid) == [
+        subid.Range("erin", 362144, 65536)
+    ]
+    assert subuid.read_text().endswith("carol:231072:65536\nerin:296608:65536\n")
+    assert subgid.read_text().endswith("dave:296608:65536\nerin:362144:65536\n")
+
+    # Test that missing files are created.
+    subuid.unlink()
+    subgid.unlink()
+    assert subid.sync(["alice"], subuid_file=subuid, subgid_file=subgid) == [
+        subid.Range("alice", 100000, 65536)
+    ]
+    assert subuid.read_text() == subgid.read_text() == "alice:100000:65536\n"
@@ -0,0 +1,160 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `tuning` charm module."""
+
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+import runner
+import tuning
+
+
+@pytest.fixture
+def kernel(tmp_path: Path) -> dict[str, Path]:
+    """Mock the live kernel limits and the drop-in directories."""
+    proc_sys, sys_module = tmp_path / "proc" / "sys", tmp_path / "sys" / "module"
+    for name, value in (
+        ("user/max_user_namespaces", "15000"),
+        ("fs/inotify/max_user_instances", "128"),
+        ("fs/file-max", "9223372036854775807"),
+    ):
+        (proc_sys / name).parent.mkdir(parents=True, exist_ok=True)
+        (proc_sys / name).write_text(f"{value}\n")
+    (sys_module / "loop" / "parameters").mkdir(parents=True)
+    (sys_module / "loop" / "parameters" / "max_loop").write_text("8\n")
+    (sys_module / "loop" / "initstate").write_text("live\n")
+    (tmp_path / "modules.builtin").write_text("kernel/drivers/block/null_blk/null_blk.ko\n")
+
+    return {
+        "sysctl_file": tmp_path / "sysctl.d" / "60-apptainer-operator.conf",
+        "modprobe_file": tmp_path / "modprobe.d" / "60-apptainer-operator-loop.conf",
+        "proc_sys": proc_sys,
+        "sys_module": sys_module,
+        "modules_builtin": tmp_path / "modules.builtin",
+    }
+
+
+def test_recommend() -> None:
+    """Test `tuning.recommend(...)` function."""
+    knobs = {knob.name: knob for knob in tuning.recommend(cores=64, containers=1000)}
+
+    assert knobs["user.max_user_namespaces"].value == 15000
+    assert knobs["fs.inotify.max_user_instances"].value == 4000
+    assert knobs["fs.file-max"].value == 64 * 65536 + 1000 * 16384
+    assert knobs["max_loop"].value == 2000
+    assert knobs["max_loop"].module == "loop"
+    assert [k.name for k in knobs.values() if k.host_only] == ["fs.file-max", "max_loop"]
+
+
+def test_apply(mocker: MockerFixture, kernel: dict[str, Path]) -> None:
+    """Test `tuning.apply(...)` and `tuning.drift(...)` functions."""
+    mock_run = mocker.patch.object(runner, "run")
+    knobs = tuning.recommend(cores=64, containers=1000)
+
+    assert tuning.apply(knobs, **kernel) == []
+    mock_run.assert_called_once_with(
+        ["sysctl", "--load", str(kernel["sysctl_file"])], runner.SYSTEM
+    )
+    # Limits are only raised, so `fs.file-max` is kept at its live value.
+    assert kernel["sysctl_file"].read_text() == (
+        tuning.HEADER
+        + "user.max_user_namespaces = 15000\n"
+        + "fs.inotify.max_user_instances = 4000\n"
+        + "fs.file-max = 9223372036854775807\n"
+    )
+    assert kernel["modprobe_file"].read_text() == tuning.HEADER + "options loop max_loop=2000\n"
+
+    # Test that the limits that were not applied by the kernel are reported as drifted.
+    assert tuning.drift(**kernel) == ["fs.inotify.max_user_instances", "loop.max_loop"]
+    (kernel["proc_sys"] / "fs" / "inotify" / "max_user_instances").write_text("4000\n")
+    (kernel["sys_module"] / "loop" / "parameters" / "max_loop").write_text("0\n")
+    assert tuning.drift(**kernel) == []
+
+    # Test that the limits are not reloaded if nothing has changed.
+    mock_run.reset_mock()
+    tuning.apply(knobs, **kernel)
+    mock_run.assert_not_called()
+
+    # Test that host-only limits are skipped inside a system container.
+    skipped = tuning.apply(knobs, container=True, **kernel)
+    assert [k.name for k in skipped] == ["fs.file-max", "max_loop"]
+    assert "fs.file-max" not in kernel["sysctl_file"].read_text()
+    assert not kernel["modprobe_file"].exists()
+
+    # Test that a failure to apply the limits is reported.
+    (kernel["proc_sys"] / "user" / "max_user_namespaces").write_text("100\n")
+    mock_run.side_effect = subprocess.CalledProcessError(
+        255, [], stderr="sysctl: permission denied on key 'user.max_user_namespaces'\n"
+    )
+    with pytest.raises(tuning.TuningError) as exec_info:
+        tuning.apply(knobs, container=True, **kernel)
+
+    assert exec_info.value.message == (
+        "failed to tune kernel limits. "
+        + "reason: sysctl: permission denied on key 'user.max_user_namespaces'"
+    )
+
+
+def test_apply_missing(mocker: MockerFixture, kernel: dict[str, Path]) -> None:
+    """Test that limits the kernel does not have are skipped."""
+    mocker.patch.object(runner, "run")
+    (kernel["proc_sys"] / "user" / "max_user_namespaces").unlink()
+
+    skipped = tuning.apply(tuning.recommend(cores=4, containers=10), **kernel)
+
+    assert [k.name for k in skipped] == ["user.max_user_namespaces"]
+    assert "user.max_user_namespaces" not in kernel["sysctl_file"].read_text()
+
+
+def test_apply_builtin(mocker: MockerFixture, kernel: dict[str, Path]) -> None:
+    """Test that parameters of modules built into the kernel are skipped."""
+    mocker.patch.object(runner, "run")
+    knobs = tuning.recommend(cores=4, containers=10)
+    kernel["modprobe_file"].parent.mkdir(parents=True)
+    kernel["modprobe_file"].write_text(tuning.HEADER + "options loop max_loop=256\n")
+
+    # A built-in module is in sysfs without an `initstate`.
+    (kernel["sys_module"] / "loop" / "initstate").unlink()
+    assert tuning.drift(**kernel) == []
+    skipped = tuning.apply(knobs, **kernel)
+
+    assert [k.name for k in skipped] == ["max_loop"]
+    assert not kernel["modprobe_file"].exists()
+
+    # A module that is not in sysfs is looked up in `modules.builtin`.
+    shutil.rmtree(kernel["sys_module"] / "loop")
+    assert tuning.apply(knobs, **kernel) == []
+    assert kernel["modprobe_file"].exists()
+    with kernel["modules_builtin"].open("a") as f:
+        f.write("kernel/drivers/block/loop.ko\n")
+    assert [k.name for k in tuning.apply(knobs, **kernel)] == ["max_loop"]
+
+
+def test_remove(kernel: dict[str, Path]) -> None:
+    """Test `tuning.remove(...)` function."""
+    for file in (kernel["sysctl_file"], kernel["modprobe_file"]):
+        file.parent.mkdir(parents=True)
+        file.write_text(tuning.HEADER)
+
+    tuning.remove(kernel["sysctl_file"], kernel["modprobe_file"])
+    tuning.remove(kernel["sysctl_file"], kernel["modprobe_file"])
+
+    assert not kernel["sysctl_file"].exists()
+    assert not kernel["modprobe_file"].exists()
+    assert tuning.drift(**kernel) == []
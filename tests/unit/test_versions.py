@@ -0,0 +1,152 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `versions` charm module."""
+
+import os
+import shutil
+import subprocess
+import tarfile
+from pathlib import Path
+
+import pytest
+
+import procscan
+import versions
+
+requires_dpkg_deb = pytest.mark.skipif(
+    shutil.which("dpkg-deb") is None, reason="dpkg-deb is not installed"
+)
+
+
+def _build_deb(tmp_path: Path, version: str) -> Path:
+    """Build a minimal `apptainer` package with `dpkg-deb`."""
+    pkg = tmp_path / f"apptainer-{version}"
+    (pkg / "DEBIAN").mkdir(parents=True)
+    (pkg / "DEBIAN" / "control").write_text(
+        "Package: apptainer\n"
+        + f"Version: {version}\n"
+        + "Architecture: all\n"
+        + "Maintainer: Test <test@example.com>\n"
+        + "Depends: squashfs-tools, fuse2fs\n"
+        + "Description: test package\n"
+    )
+    binary = pkg / "usr" / "bin" / "apptainer"
+    binary.parent.mkdir(parents=True)
+    binary.write_text(f"#!/bin/sh\necho apptainer version {version}\n")
+    binary.chmod(0o755)
+    (pkg / "etc" / "apptainer").mkdir(parents=True)
+    (pkg / "etc" / "apptainer" / "apptainer.conf").write_text("allow setuid = no\n")
+    deb = tmp_path / f"apptainer_{version}_all.deb"
+    subprocess.run(
+        ["dpkg-deb", "--root-owner-group", "--build", pkg, deb], check=True, capture_output=True
+    )
+    return deb
+
+
+@requires_dpkg_deb
+def test_unpack(tmp_path: Path) -> None:
+    """Test `versions.unpack(...)` and `versions.field(...)` functions."""
+    root = tmp_path / "opt"
+    deb = _build_deb(tmp_path, "1.3.6")
+
+    assert versions.field(deb, "Depends") == "squashfs-tools, fuse2fs"
+    assert versions.unpack([deb], root) == "1.3.6"
+    assert (root / "1.3.6" / "usr" / "bin" / "apptainer").is_file()
+    assert versions.installed(root) == ["1.3.6"]
+
+    # Test that an unpacked version is not unpacked again.
+    (root / "1.3.6" / "marker").touch()
+    assert versions.unpack([deb], root) == "1.3.6"
+    assert (root / "1.3.6" / "marker").exists()
+
+
+def test_extract(tmp_path: Path) -> None:
+    """Test `versions.extract(...)` function."""
+    root = tmp_path / "opt"
+    tree = tmp_path / "apptainer-1.4.0"
+    binary = tree / "usr" / "bin" / "apptainer"
+    binary.parent.mkdir(parents=True)
+    binary.write_text("#!/bin/sh\necho apptainer version 1.4.0\n")
+    binary.chmod(0o755)
+    tarball = tmp_path / "apptainer-1.4.0.tar.gz"
+    with tarfile.open(tarball, "w:gz") as tar:
+        tar.add(tree, arcname=tree.name)
+
+    # Test that the tree is extracted from below its top-level directory.
+    assert versions.extract(tarball, root) == "1.4.0"
+    assert (root / "1.4.0" / "usr" / "bin" / "apptainer").is_file()
+    assert versions.installed(root) == ["1.4.0"]
+
+    # Test that tarballs without an Apptainer tree are rejected.
+    binary.unlink()
+    with tarfile.open(tarball, "w:gz") as tar:
+        tar.add(tree, arcname=".")
+    with pytest.raises(versions.VersionsError) as exec_info:
+        versions.extract(tarball, root)
+
+    assert exec_info.value.message == f"`{tarball}` does not contain `usr/bin/apptainer`"
+    assert versions.installed(root) == ["1.4.0"]
+
+    tarball.write_bytes(b"not a tarball")
+    with pytest.raises(versions.VersionsError):
+        versions.extract(tarball, root)
+
+
+def test_activate(tmp_path: Path) -> None:
+    """Test `versions.activate(...)`, `versions.rollback(...)`, and `versions.deactivate(...)`."""
+    root = tmp_path / "opt"
+    for version in ("1.3.6", "1.4.0"):
+        (root / version / "usr" / "bin").mkdir(parents=True)
+        (root / version / "usr" / "bin" / "apptainer").write_text(version)
+
+    assert versions.active(root) is None
+    versions.activate("1.3.6", root)
+    assert versions.binary(root).read_text() == "1.3.6"
+    assert versions.previous(root) is None
+
+    versions.activate("1.4.0", root)
+    assert (versions.active(root), versions.previous(root)) == ("1.4.0", "1.3.6")
+    assert versions.binary(root).read_text() == "1.4.0"
+    assert not [p for p in os.listdir(root) if p.endswith(".tmp")]
+
+    # Test that rolling back swaps the active and previous versions.
+    assert versions.rollback(root) == "1.3.6"
+    assert (versions.active(root), versions.previous(root)) == ("1.3.6", "1.4.0")
+
+    with pytest.raises(versions.VersionsError) as exec_info:
+        versions.activate("2.0.0", root)
+
+    assert exec_info.value.message == f"apptainer 2.0.0 is not unpacked in {root}"
+
+    versions.deactivate(root)
+    assert versions.active(root) is None
+    with pytest.raises(versions.VersionsError):
+        versions.rollback(root)
+
+
+def test_gc(tmp_path: Path, monkeypatch) -> None:
+    """Test `versions.gc(...)` function."""
+    root = tmp_path / "opt"
+    for version in ("1.2.0", "1.3.0", "1.3.6", "1.4.0"):
+        (root / version / "usr" / "libexec" / "apptainer" / "bin").mkdir(parents=True)
+    versions.activate("1.3.6", root)
+    versions.activate("1.4.0", root)
+
+    # A container started with 1.2.0 is still running.
+    starter = root / "1.2.0" / "usr" / "libexec" / "apptainer" / "bin" / "starter"
+    monkeypatch.setattr(procscan, "executables", lambda _: {starter, Path("/usr/bin/bash")})
+
+    assert versions.gc(root) == ["1.3.0"]
+    assert sorted(versions.installed(root)) == ["1.2.0", "1.3.6", "1.4.0"]
@@ -0,0 +1,128 @@
+# Copyright 2025 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for `warmer` charm module."""
+
+import json
+import os
+from pathlib import Path
+
+import warmer
+
+PSI = """\
+some avg10={some} avg60=0.00 avg300=0.00 total=1234
+full avg10=0.00 avg60=0.00 avg300=0.00 total=0
+"""
+
+
+def _launch_log(path: Path, images: list[str]) -> None:
+    path.write_text(
+        "".join(json.dumps({"event": "launch", "image": i, "path": i}) + "\n" for i in images)
+    )
+
+
+def test_rank(tmp_path: Path) -> None:
+    """Test `warmer.rank(...)` function."""
+    cache_dir = tmp_path / "cache"
+    a, b, c = (str(cache_dir / "alice" / "objects" / f"{name}.sif") for name in "abc")
+    outside = str(tmp_path / "shadow")
+    launch_log = tmp_path / "launch.log"
+    _launch_log(launch_log.with_name("launch.log.1"), [a, b, c, c, outside, outside, outside])
+    _launch_log(launch_log, [str(cache_dir / "alice" / "." / "objects" / "a.sif"), a, c])
+    with launch_log.open("a") as f:
+        f.write('{"event": "pool-hit", "image": "x.sif"}\nnot json\n{"event": "launch"}\n')
+
+    # Test that launched images in the stage cache are ranked by launches.
+    root = os.path.realpath(cache_dir)
+    assert warmer.rank([], top=2, cache_dir=str(cache_dir), launch_log=launch_log) == [
+        warmer.Image(path=a, launches=3, root=root),
+        warmer.Image(path=c, launches=3, root=root),
+    ]
+    # Test that configured images are ranked first.
+    assert warmer.rank([b, b], top=1, cache_dir=str(cache_dir), launch_log=launch_log) == [
+        warmer.Image(path=b, launches=1),
+        warmer.Image(path=a, launches=3, root=root),
+    ]
+    assert warmer.rank([outside], top=0, launch_log=launch_log) == [
+        warmer.Image(path=outside, launches=3)
+    ]
+    # Test that no launched images are ranked without a stage cache.
+    assert warmer.rank([], top=2, launch_log=launch_log) == []
+
+
+def test_pressure(tmp_path: Path) -> None:
+    """Test `warmer.pressure(...)` function."""
+    psi_file = tmp_path / "memory"
+    psi_file.write_text(PSI.format(some="12.50"))
+    assert warmer.pressure(psi_file) == 12.5
+
+    # Test that kernels without PSI report no memory pressure.
+    assert warmer.pressure(tmp_path / "missing") == 0.0
+
+
+def test_warm(tmp_path: Path) -> None:
+    """Test `warmer.warm(...)` function."""
+    psi_file = tmp_path / "memory"
+    psi_file.write_text(PSI.format(some="0.00"))
+    images = []
+    for name, size in (("a.sif", 8192), ("b.sif", 16384), ("c.sif", 4096)):
+        (tmp_path / name).write_bytes(os.urandom(size))
+        images.append(warmer.Image(path=str(tmp_path / name), launches=1))
+    os.mkfifo(tmp_path / "fifo.sif")
+    images.append(warmer.Image(path=str(tmp_path / "fifo.sif"), launches=1))
+    os.symlink(tmp_path / "a.sif", tmp_path / "link.sif")
+    images.append(warmer.Image(path=str(tmp_path / "link.sif"), launches=1))
+    # Test that images found in the launch log must be in their root directory.
+    (tmp_path / "cache").mkdir()
+    os.symlink(tmp_path, tmp_path / "cache" / "alice")
+    images.append(
+        warmer.Image(
+            path=str(tmp_path / "cache" / "alice" / "c.sif"),
+            launches=1,
+            root=os.path.realpath(tmp_path / "cache"),
+        )
+    )
+
+    # Test that images that do not fit the budget are skipped.
+    warmed = warmer.warm(images, max_bytes=16384, psi_file=psi_file)
+    assert [(w.size, w.state) for w in warmed] == [
+        (8192, warmer.WARMED),
+        (16384, warmer.OVER_BUDGET),
+        (4096, warmer.WARMED),
+        (0, warmer.FAILED),
+        (0, warmer.FAILED),
+        (0, warmer.FAILED),
+    ]
+    assert all(0.0 <= w.resident <= 1.0 for w in warmed)
+    assert warmed[0].dict()["resident"].endswith("%")
+
+    # Test that images are not warmed under memory pressure.
+    psi_file.write_text(PSI.format(some="25.00"))
+    warmed = warmer.warm(images[:1], max_bytes=16384, psi_file=psi_file)
+    assert [w.state for w in warmed] == [warmer.PRESSURE]
+
+
+def test_resident(tmp_path: Path) -> None:
+    """Test that the page cache residency of an image is reported with `mincore(2)`."""
+    image = tmp_path / "image.sif"
+    image.write_bytes(os.urandom(4 * 4096))
+    with image.open("rb") as f:
+        f.read()
+
+    fd = os.open(image, os.O_RDONLY)
+    try:
+        assert warmer._resident(fd, 4 * 4096) == 1.0
+        assert warmer._resident(fd, 0) == 1.0
+    finally:
+        os.close(fd)